@@ -0,0 +1,390 @@
+"""
+Route benchmark for the Zeshare app.
+
+    python bench.py seed --db bench.db --users 2000 --videos 20000 --comments 200000 --likes 400000
+    python bench.py run --db bench.db --serve --concurrency 16 --duration 30
+    python bench.py compare bench_results/a.json bench_results/b.json
+
+`seed` builds a synthetic dataset whose video popularity and user activity
+follow a Zipf distribution. `run` drives the routes through a threaded HTTP
+load generator and writes p50/p95/p99 latency, throughput and SQL statements
+per request (from the X-Query-Count header) to a JSON file.
+"""
+import argparse
+import bisect
+import hashlib
+import http.cookiejar
+import itertools
+import json
+import os
+import platform
+import random
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime, timedelta
+
+BENCH_PASSWORD = 'bench-password'
+GENRES = ['Nature', 'Cooking', 'Dance', 'Technology', 'Health & Fitness',
+          'Music', 'Comedy', 'Sports', 'Travel', 'Education']
+AGE_RATINGS = ['G', 'PG', '12', '15', '18']
+SAMPLE_URL = 'https://commondatastorage.googleapis.com/gtv-videos-bucket/sample/ForBiggerJoyrides.mp4'
+DEFAULT_MIX = 'index=10,shorts=30,watch=35,like=12,comment=10,upload=3'
+SCHEMA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schema.sql')
+
+
+class Zipf:
+    """Sample ranks 0..n-1 with probability proportional to 1 / (rank + 1) ** s"""
+
+    def __init__(self, n, s, rng):
+        self.rng = rng
+        self.cum_weights = list(itertools.accumulate(1.0 / (k ** s) for k in range(1, n + 1)))
+        self.total = self.cum_weights[-1]
+
+    def sample(self):
+        return bisect.bisect_left(self.cum_weights, self.rng.random() * self.total)
+
+
+def hash_password(password):
+    # Must match app.hash_password so benchmark users can log in
+    return hashlib.sha256(password.encode()).hexdigest()
+
+
+def seed(args):
+    if os.path.exists(args.db):
+        if not args.force:
+            sys.exit(f"{args.db} already exists (use --force to overwrite)")
+        os.remove(args.db)
+    rng = random.Random(args.seed)
+    conn = sqlite3.connect(args.db)
+    with open(SCHEMA_FILE) as f:
+        conn.executescript(f.read())
+
+    started = time.perf_counter()
+    password = hash_password(BENCH_PASSWORD)
+    creators = max(1, int(args.users * args.creator_ratio))
+    conn.executemany(
+        'INSERT INTO users (id, username, password, role) VALUES (?, ?, ?, ?)',
+        ((i, f'bench_user_{i}', password, 'creator' if i <= creators else 'consumer')
+         for i in range(1, args.users + 1))
+    )
+
+    # Popular creators upload more; ids are dense so ranks map straight to ids
+    creator_rank = Zipf(creators, args.zipf, rng)
+    conn.executemany(
+        'INSERT INTO videos (id, title, publisher, producer, genre, age_rating, url, uploaded_by) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+        ((i, f'Synthetic video {i}', f'Publisher {i % 97}', f'Producer {i % 89}',
+          rng.choice(GENRES), rng.choice(AGE_RATINGS), SAMPLE_URL, creator_rank.sample() + 1)
+         for i in range(1, args.videos + 1))
+    )
+
+    video_rank = Zipf(args.videos, args.zipf, rng)
+    user_rank = Zipf(args.users, args.zipf, rng)
+    epoch = datetime(2025, 1, 1)
+    conn.executemany(
+        'INSERT INTO comments (video_id, user_id, comment, rating, created_at) VALUES (?, ?, ?, ?, ?)',
+        ((video_rank.sample() + 1, user_rank.sample() + 1, f'Synthetic comment {i}',
+          rng.randint(1, 5), epoch + timedelta(seconds=rng.randrange(365 * 86400)))
+         for i in range(args.comments))
+    )
+
+    # UNIQUE(video_id, user_id) caps likes at videos * users
+    target = min(args.likes, args.videos * args.users)
+    pairs = set()
+    attempts = 0
+    while len(pairs) < target and attempts < target * 20:
+        pairs.add((video_rank.sample() + 1, user_rank.sample() + 1))
+        attempts += 1
+    conn.executemany('INSERT INTO likes (video_id, user_id) VALUES (?, ?)', sorted(pairs))
+    conn.commit()
+    conn.execute('ANALYZE')
+    conn.close()
+
+    print(f"Seeded {args.db}: {args.users} users ({creators} creators), {args.videos} videos, "
+          f"{args.comments} comments, {len(pairs)} likes in {time.perf_counter() - started:.1f}s")
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    # Time the route itself, not the page it redirects to
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+class Client:
+    def __init__(self, base_url, timeout):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect()
+        )
+
+    def request(self, path, form=None):
+        data = urllib.parse.urlencode(form).encode() if form is not None else None
+        started = time.perf_counter()
+        try:
+            with self.opener.open(self.base_url + path, data=data, timeout=self.timeout) as resp:
+                resp.read()
+                status, headers = resp.status, resp.headers
+        except urllib.error.HTTPError as e:
+            e.read()
+            status, headers = e.code, e.headers
+        except (urllib.error.URLError, OSError):
+            return time.perf_counter() - started, 0, None
+        elapsed = time.perf_counter() - started
+        queries = headers.get('X-Query-Count')
+        return elapsed, status, int(queries) if queries is not None else None
+
+    def login(self, username):
+        _, status, _ = self.request('/login', {'username': username, 'password': BENCH_PASSWORD})
+        return status in (200, 302)
+
+
+def parse_mix(mix):
+    weights = {}
+    for part in mix.split(','):
+        name, _, weight = part.partition('=')
+        weights[name.strip()] = float(weight)
+    unknown = set(weights) - {'index', 'shorts', 'watch', 'like', 'comment', 'upload'}
+    if unknown:
+        sys.exit(f"Unknown routes in --mix: {', '.join(sorted(unknown))}")
+    return weights
+
+
+def load_dataset(db):
+    conn = sqlite3.connect(db)
+    try:
+        max_video = conn.execute('SELECT MAX(id) FROM videos').fetchone()[0] or 0
+        users = conn.execute(
+            "SELECT username, role FROM users WHERE username LIKE 'bench_user_%' ORDER BY id"
+        ).fetchall()
+    finally:
+        conn.close()
+    if not max_video or not users:
+        sys.exit(f"{db} has no benchmark data; run `python bench.py seed` first")
+    return max_video, [u for u, r in users if r == 'consumer'], [u for u, r in users if r == 'creator']
+
+
+def worker(idx, args, mix, dataset, deadline, budget, samples, lock):
+    rng = random.Random(args.seed * 1000 + idx)
+    max_video, consumers, creators = dataset
+    video_rank = Zipf(max_video, args.zipf, rng)
+    anonymous = Client(args.base_url, args.timeout)
+    consumer = Client(args.base_url, args.timeout)
+    consumer.login(rng.choice(consumers or creators))
+    creator = Client(args.base_url, args.timeout)
+    creator.login(rng.choice(creators))
+    routes, weights = list(mix), list(mix.values())
+
+    while time.perf_counter() < deadline and next(budget, False):
+        route = rng.choices(routes, weights)[0]
+        video_id = video_rank.sample() + 1
+        if route == 'index':
+            result = anonymous.request('/')
+        elif route == 'shorts':
+            result = consumer.request('/shorts')
+        elif route == 'watch':
+            result = consumer.request(f'/watch/{video_id}')
+        elif route == 'like':
+            result = consumer.request('/like', {'video_id': video_id, 'liked': rng.choice(['true', 'false'])})
+        elif route == 'comment':
+            result = consumer.request('/comment', {'video_id': video_id, 'rating': rng.randint(1, 5),
+                                                   'comment': f'bench comment {rng.random():.6f}'})
+        else:
+            result = creator.request('/upload', {'title': f'Bench upload {rng.random():.6f}',
+                                                 'publisher': 'Bench', 'genre': rng.choice(GENRES),
+                                                 'age_rating': rng.choice(AGE_RATINGS), 'url': SAMPLE_URL})
+        with lock:
+            samples.append((route,) + result)
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(pct / 100.0 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(samples, elapsed):
+    by_route = {}
+    for route, latency, status, queries in samples:
+        by_route.setdefault(route, []).append((latency, status, queries))
+    by_route['ALL'] = [s[1:] for s in samples]
+
+    report = {}
+    for route, rows in sorted(by_route.items()):
+        latencies = sorted(r[0] * 1000 for r in rows)
+        queries = [r[2] for r in rows if r[2] is not None]
+        report[route] = {
+            'requests': len(rows),
+            'errors': sum(1 for r in rows if not r[1] or r[1] >= 500),
+            'throughput_rps': round(len(rows) / elapsed, 2) if elapsed else None,
+            'latency_ms': {
+                'p50': round(percentile(latencies, 50), 3),
+                'p95': round(percentile(latencies, 95), 3),
+                'p99': round(percentile(latencies, 99), 3),
+                'mean': round(sum(latencies) / len(latencies), 3),
+                'max': round(latencies[-1], 3),
+            },
+            'queries_per_request': round(sum(queries) / len(queries), 2) if queries else None,
+        }
+    return report
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(db):
+    port = free_port()
+    # Uploads use SAMPLE_URL; mirroring it would put real downloads into every run.
+    # Pages would start a live dispatcher on the default port, shared with a dev server
+    env = dict(os.environ, VIDEOAPP_DB=os.path.abspath(db), QUERY_COUNT_HEADER='1', MIRROR_VIDEOS='0',
+               LIVE_PORT='0')
+    code = ("import logging, app; logging.getLogger().setLevel(logging.WARNING); "
+            "logging.getLogger('werkzeug').setLevel(logging.ERROR); "
+            f"app.app.run(host='127.0.0.1', port={port}, threaded=True)")
+    proc = subprocess.Popen([sys.executable, '-c', code], env=env,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    base_url = f'http://127.0.0.1:{port}'
+    for _ in range(100):
+        try:
+            urllib.request.urlopen(base_url + '/login', timeout=1).read()
+            return proc, base_url
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.1)
+    proc.kill()
+    sys.exit('Benchmark server did not start')
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    mix = parse_mix(args.mix)
+    dataset = load_dataset(args.db)
+    server = None
+    if args.serve:
+        server, args.base_url = start_server(args.db)
+    try:
+        samples, lock = [], threading.Lock()
+        budget = itertools.repeat(True, args.requests) if args.requests else itertools.repeat(True)
+        started = time.perf_counter()
+        deadline = started + args.duration
+        threads = [threading.Thread(target=worker, args=(i, args, mix, dataset, deadline, budget, samples, lock))
+                   for i in range(args.concurrency)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - started
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    result = {
+        'label': args.label,
+        'revision': git_revision(),
+        'timestamp': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+        'python': platform.python_version(),
+        'params': {'db': args.db, 'base_url': args.base_url, 'concurrency': args.concurrency,
+                   'duration': args.duration, 'requests': args.requests, 'mix': mix,
+                   'zipf': args.zipf, 'seed': args.seed},
+        'elapsed_s': round(elapsed, 3),
+        'routes': summarize(samples, elapsed),
+    }
+    out = args.out or os.path.join(
+        'bench_results', f"{datetime.utcnow():%Y%m%dT%H%M%S}_{result['revision'] or 'local'}.json"
+    )
+    os.makedirs(os.path.dirname(out) or '.', exist_ok=True)
+    with open(out, 'w') as f:
+        json.dump(result, f, indent=2)
+    print_report(result['routes'])
+    print(f"\nResults written to {out}")
+
+
+def print_report(routes):
+    print(f"{'route':<10}{'reqs':>8}{'errs':>6}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'q/req':>7}")
+    for route, r in routes.items():
+        lat = r['latency_ms']
+        qpr = r['queries_per_request']
+        print(f"{route:<10}{r['requests']:>8}{r['errors']:>6}{r['throughput_rps']:>9.1f}"
+              f"{lat['p50']:>9.2f}{lat['p95']:>9.2f}{lat['p99']:>9.2f}{'-' if qpr is None else qpr:>7}")
+
+
+def compare(args):
+    with open(args.baseline) as f:
+        base = json.load(f)
+    with open(args.candidate) as f:
+        cand = json.load(f)
+    print(f"{base.get('revision')} -> {cand.get('revision')}")
+    print(f"{'route':<10}{'p50':>18}{'p95':>18}{'p99':>18}{'rps':>18}")
+    for route in sorted(set(base['routes']) & set(cand['routes'])):
+        b, c = base['routes'][route], cand['routes'][route]
+        cols = [(b['latency_ms'][k], c['latency_ms'][k]) for k in ('p50', 'p95', 'p99')]
+        cols.append((b['throughput_rps'], c['throughput_rps']))
+        print(f"{route:<10}" + ''.join(f"{_delta(old, new):>18}" for old, new in cols))
+
+
+def _delta(old, new):
+    if not old:
+        return f'{new}'
+    return f'{new:.1f} ({(new - old) / old * 100:+.0f}%)'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('seed', help='generate a synthetic dataset')
+    p.add_argument('--db', default='bench.db')
+    p.add_argument('--users', type=int, default=1000)
+    p.add_argument('--videos', type=int, default=5000)
+    p.add_argument('--comments', type=int, default=50000)
+    p.add_argument('--likes', type=int, default=100000)
+    p.add_argument('--creator-ratio', type=float, default=0.1)
+    p.add_argument('--zipf', type=float, default=1.1, help='Zipf exponent for popularity')
+    p.add_argument('--seed', type=int, default=42)
+    p.add_argument('--force', action='store_true')
+    p.set_defaults(func=seed)
+
+    p = sub.add_parser('run', help='drive the routes and record latencies')
+    p.add_argument('--db', default='bench.db', help='seeded database (used for ids and logins)')
+    p.add_argument('--base-url', default='http://127.0.0.1:5000')
+    p.add_argument('--serve', action='store_true', help='start the app on a free port against --db')
+    p.add_argument('--concurrency', type=int, default=8)
+    p.add_argument('--duration', type=float, default=30, help='seconds')
+    p.add_argument('--requests', type=int, default=0, help='stop after this many requests')
+    p.add_argument('--mix', default=DEFAULT_MIX, help='route weights, e.g. "watch=50,shorts=50"')
+    p.add_argument('--zipf', type=float, default=1.1)
+    p.add_argument('--seed', type=int, default=42)
+    p.add_argument('--timeout', type=float, default=30)
+    p.add_argument('--label', default='')
+    p.add_argument('--out', help='result file (default bench_results/<time>_<rev>.json)')
+    p.set_defaults(func=run)
+
+    p = sub.add_parser('compare', help='compare two result files')
+    p.add_argument('baseline')
+    p.add_argument('candidate')
+    p.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,283 @@
+"""
+Comment filter benchmark for moderation.py.
+
+    python bench_moderation.py run --sizes 1000,10000,100000 --comments 20000
+    python bench_moderation.py compare bench_results/moderation_a.json bench_results/moderation_b.json
+
+`run` generates synthetic blocked-term lists (whole words, prefixes,
+suffixes, two-word phrases, some accented) and comments built from a common
+vocabulary, a share of which hide a term behind leetspeak, odd casing,
+accents or lookalike letters. For each list size it records the compile time
+and the size of the automaton's arrays, the per-comment check latency for
+clean and dirty comments, how many dirty comments were caught, the check
+latency while a reload compiles in the background, and a naive loop over
+every term for comparison. Every size runs in its own process, so the peak
+RSS reported is that list's alone. Results go to a JSON file.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import statistics
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from types import SimpleNamespace
+
+import moderation
+from bench import git_revision
+
+DEFAULT_SIZES = '1000,10000,100000'
+SYLLABLES = ['ba', 'ka', 'ro', 'ti', 'mu', 'ne', 'sh', 'gr', 'tor', 'vel', 'qu', 'zi', 'pla', 'dre', 'on',
+             'ex', 'ly', 'st', 'ch', 'ick', 'um', 'ar', 'fo', 'bl', 'sn', 'wh', 'ip', 'ud']
+VOCABULARY = ('the a this that video really great so much love thanks for sharing i you we it is was '
+              'not very good bad best worst ever first time watching again please more like subscribe '
+              'music dance part two when where how why what amazing funny lol wow cool nice 10/10 '
+              'can\'t wait next one! :) who else here in 2024?').split()
+ACCENTS = {'a': 'á', 'e': 'é', 'i': 'í', 'o': 'ö', 'u': 'ü', 'c': 'ç', 'n': 'ñ'}
+DISGUISES = {'a': '4', 'e': '3', 'i': '1', 'o': '0', 's': '$', 't': '7'}
+LOOKALIKES = {latin: other for other, latin in moderation.LOOKALIKES.items()}
+LATENCY_GROUPS = ('clean', 'dirty', 'during_reload')
+
+
+def make_word(rng):
+    return ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+
+
+def make_terms(count, rng):
+    # Terms that would match ordinary words ("mu" + "ch") would flag clean comments
+    vocabulary = moderation.normalize(' '.join(VOCABULARY))
+    terms = set()
+    while len(terms) < count:
+        kind = rng.random()
+        word = make_word(rng)
+        if moderation.pattern(word).strip() in vocabulary:
+            continue
+        if kind < 0.05:
+            word = ''.join(ACCENTS.get(char, char) if rng.random() < 0.3 else char for char in word)
+        if kind < 0.80:
+            terms.add(word)
+        elif kind < 0.90:
+            terms.add(f'{word}*')
+        elif kind < 0.95:
+            terms.add(f'*{word}')
+        else:
+            terms.add(f'{word} {make_word(rng)}')
+    return sorted(terms)
+
+
+def disguise(term, rng):
+    """The term as a commenter might type it to get past a filter"""
+    chars = []
+    for char in term.strip('*'):
+        roll = rng.random()
+        if roll < 0.25 and char in DISGUISES:
+            char = DISGUISES[char]
+        elif roll < 0.35 and char in ACCENTS:
+            char = ACCENTS[char]
+        elif roll < 0.40 and char in LOOKALIKES:
+            char = LOOKALIKES[char]
+        elif roll < 0.60:
+            char = char.upper()
+        chars.append(char)
+    word = ''.join(chars)
+    # Terms that match inside words can be glued to other text
+    if term.endswith('*'):
+        word += rng.choice(['', 'ing', 'ed', 'ers'])
+    if term.startswith('*'):
+        word = rng.choice(['', 'un', 'mega']) + word
+    return word
+
+
+def make_comments(count, words, terms, dirty_share, rng):
+    comments = []
+    for _ in range(count):
+        text = [rng.choice(VOCABULARY) for _ in range(rng.randint(max(1, words // 4), words * 2))]
+        dirty = rng.random() < dirty_share
+        if dirty:
+            text.insert(rng.randrange(len(text) + 1), disguise(rng.choice(terms), rng))
+        comments.append((' '.join(text), dirty))
+    return comments
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    if not samples:
+        return None
+    pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))]
+    return {'p50': round(pick(0.50) * 1e6, 2), 'p99': round(pick(0.99) * 1e6, 2),
+            'mean': round(statistics.fmean(samples) * 1e6, 2)}
+
+
+def time_checks(check, comments):
+    samples = []
+    caught = 0
+    for text, _ in comments:
+        started = time.perf_counter()
+        found = check(text)
+        samples.append(time.perf_counter() - started)
+        caught += found is not None
+    return samples, caught
+
+
+def measure(size, args):
+    """Runs in a fresh process per term list size"""
+    rng = random.Random(args.seed + size)
+    terms = make_terms(size, rng)
+    comments = make_comments(args.comments, args.words, terms, args.dirty, rng)
+    dirty = [comment for comment in comments if comment[1]]
+    clean = [comment for comment in comments if not comment[1]]
+
+    with tempfile.TemporaryDirectory(prefix='bench_moderation_') as workdir:
+        path = os.path.join(workdir, 'terms.txt')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(terms))
+        builds = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            automaton = moderation.Automaton(moderation.read_terms(path))
+            builds.append(time.perf_counter() - started)
+
+        result = {
+            'terms': len(automaton),
+            'states': automaton.states,
+            'build_seconds': {'min': round(min(builds), 3), 'median': round(statistics.median(builds), 3)},
+            'arrays_mb': round(sum(len(a) * a.itemsize for a in (automaton.base, automaton.check,
+                                                               automaton.fail, automaton.out)) / 1e6, 2),
+            'us': {},
+        }
+        for name, group in (('clean', clean), ('dirty', dirty)):
+            samples, caught = time_checks(automaton.find, group)
+            result['us'][name] = percentiles(samples)
+            if name == 'dirty':
+                result['dirty_caught'] = round(caught / len(group), 4) if group else None
+            else:
+                result['clean_flagged'] = round(caught / len(group), 4) if group else None
+        result['checks_per_s'] = round(len(comments) / sum(time_checks(automaton.find, comments)[0]))
+
+        # Checks go on against the old automaton while a changed file compiles
+        comment_filter = moderation.CommentFilter(SimpleNamespace(config={
+            'COMMENT_FILTER_TERMS': path, 'COMMENT_FILTER_RELOAD_SECONDS': 0.0}))
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write('\nbenchreloadterm\n')
+        comment_filter.check_file()
+        samples = []
+        while comment_filter.loading.locked() and len(samples) < len(comments) * 20:
+            text = comments[len(samples) % len(comments)][0]
+            started = time.perf_counter()
+            comment_filter.automaton.find(text)
+            samples.append(time.perf_counter() - started)
+        with comment_filter.loading:
+            pass
+        result['us']['during_reload'] = percentiles(samples)
+        result['reloaded'] = comment_filter.automaton.find('benchreloadterm') is not None
+
+    # Baseline: one substring test per term on the normalized comment
+    patterns = [moderation.pattern(term) for term in terms]
+    naive = comments[:args.naive_comments]
+    samples, _ = time_checks(lambda text: _naive(patterns, text), naive)
+    result['us']['naive'] = percentiles(samples)
+    # ru_maxrss is KiB on Linux
+    result['peak_rss_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    return result
+
+
+def _naive(patterns, text):
+    text = moderation.normalize(text)
+    for pattern in patterns:
+        if pattern in text:
+            return pattern
+    return None
+
+
+def run(args):
+    sizes = [int(size) for size in args.sizes.split(',')]
+    results = {}
+    for size in sizes:
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            results[str(size)] = pool.submit(measure, size, args).result()
+        print_row(size, results[str(size)])
+
+    result = {
+        'label': args.label,
+        'revision': git_revision(),
+        'timestamp': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+        'python': platform.python_version(),
+        'params': {'sizes': sizes, 'comments': args.comments, 'words': args.words, 'dirty': args.dirty,
+                   'naive_comments': args.naive_comments, 'repeat': args.repeat, 'seed': args.seed},
+        'sizes': results,
+    }
+    out = args.out or os.path.join(
+        'bench_results', f"moderation_{datetime.utcnow():%Y%m%dT%H%M%S}_{result['revision'] or 'local'}.json"
+    )
+    os.makedirs(os.path.dirname(out) or '.', exist_ok=True)
+    with open(out, 'w') as f:
+        json.dump(result, f, indent=2)
+    print(f"\nResults written to {out}")
+
+
+def print_row(size, r):
+    if size == 'header':
+        print(f"{'terms':>7}{'build s':>9}{'MB':>7}{'clean p50':>11}{'p99':>8}{'dirty p50':>11}{'p99':>8}"
+              f"{'reload p99':>12}{'naive p50':>11}{'caught':>8}{'rss MB':>8}")
+        return
+    us = r['us']
+    print(f"{r['terms']:>7}{r['build_seconds']['median']:>9.2f}{r['arrays_mb']:>7.1f}"
+          f"{us['clean']['p50']:>11.1f}{us['clean']['p99']:>8.1f}{us['dirty']['p50']:>11.1f}{us['dirty']['p99']:>8.1f}"
+          f"{us['during_reload']['p99'] if us['during_reload'] else 0:>12.1f}{us['naive']['p50']:>11.1f}"
+          f"{r['dirty_caught']:>8.3f}{r['peak_rss_mb']:>8.1f}")
+
+
+def compare(args):
+    with open(args.baseline) as f:
+        base = json.load(f)
+    with open(args.candidate) as f:
+        cand = json.load(f)
+    print(f"{base.get('revision')} -> {cand.get('revision')}  (p50 microseconds per check)")
+    print(f"{'terms':>7}" + ''.join(f"{column:>20}" for column in ('build s',) + LATENCY_GROUPS + ('rss MB',)))
+    for size in sorted(set(base['sizes']) & set(cand['sizes']), key=int):
+        b, c = base['sizes'][size], cand['sizes'][size]
+        cols = [(b['build_seconds']['median'], c['build_seconds']['median'])]
+        cols += [((b['us'][group] or {}).get('p50'), (c['us'][group] or {}).get('p50')) for group in LATENCY_GROUPS]
+        cols.append((b['peak_rss_mb'], c['peak_rss_mb']))
+        print(f"{size:>7}" + ''.join(f"{_delta(old, new):>20}" for old, new in cols))
+
+
+def _delta(old, new):
+    if not old or new is None:
+        return f'{new}'
+    return f'{new:.2f} ({(new - old) / old * 100:+.0f}%)'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('run', help='compile synthetic term lists and time comment checks')
+    p.add_argument('--sizes', default=DEFAULT_SIZES, help='term counts, comma separated')
+    p.add_argument('--comments', type=int, default=20000, help='comments checked per size')
+    p.add_argument('--words', type=int, default=20, help='typical words per comment')
+    p.add_argument('--dirty', type=float, default=0.1, help='share of comments hiding a term')
+    p.add_argument('--naive-comments', type=int, default=200, help='comments checked by the naive loop')
+    p.add_argument('--repeat', type=int, default=3, help='compiles per size')
+    p.add_argument('--seed', type=int, default=42)
+    p.add_argument('--label', default='')
+    p.add_argument('--out', help='result file (default bench_results/moderation_<time>_<rev>.json)')
+    p.set_defaults(func=run)
+
+    p = sub.add_parser('compare', help='compare two result files')
+    p.add_argument('baseline')
+    p.add_argument('candidate')
+    p.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        print_row('header', None)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
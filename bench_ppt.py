@@ -0,0 +1,246 @@
+"""
+Converter benchmark for ppt.py.
+
+    python bench_ppt.py run --sizes 10,100,1000,5000 --repeat 3
+    python bench_ppt.py compare bench_results/ppt_a.json bench_results/ppt_b.json
+
+`run` generates synthetic decks built from the blocks extract_slide_data
+recognizes (stat cards, performance tables, algorithm grids, feature bars,
+chart placeholders with real PNGs behind them, bullet lists and highlight
+boxes) and converts each one from scratch. Extraction, shape building and
+prs.save are timed separately. Every size runs in its own process, so the
+peak RSS reported is that deck's alone; --tracemalloc adds one more pass
+that records the Python heap peak of each phase. Results go to a JSON file.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import resource
+import statistics
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from PIL import Image, ImageDraw
+
+import ppt
+from bench import git_revision
+
+DEFAULT_SIZES = '10,100,500,1000,5000'
+PHASES = ('extract', 'build', 'save')
+SLIDE_KINDS = ('stats', 'table', 'algorithms', 'features', 'chart', 'bullets')
+ALGORITHMS = ['Logistic Regression', 'Random Forest', 'Gradient Boosting', 'SVM', 'KNN', 'Naive Bayes']
+FEATURES = ['Glucose', 'BMI', 'Age', 'Insulin', 'Blood Pressure', 'Pregnancies']
+
+
+def chart_name(i):
+    return f'[Chart {i} - Synthetic Benchmark Figure]'
+
+
+def make_images(folder, count, size, rng):
+    os.makedirs(folder, exist_ok=True)
+    width, height = size
+    for i in range(count):
+        img = Image.new('RGB', size, 'white')
+        draw = ImageDraw.Draw(img)
+        bars = 12
+        for b in range(bars):
+            x = width * (b + 0.2) / bars
+            top = rng.uniform(0.1, 0.9) * height
+            draw.rectangle([x, top, x + width * 0.6 / bars, height * 0.95],
+                           fill=(rng.randrange(256), 90, rng.randrange(256)))
+        draw.line([(0, height * 0.95), (width, height * 0.95)], fill='black', width=max(1, width // 400))
+        img.save(ppt.chart_image_path(chart_name(i), folder))
+
+
+def make_slide(index, kind, rng, charts):
+    parts = [f'<div class="slide"><h2>Slide {index}: {kind.title()} Overview</h2>',
+             f'<p>Synthetic body text for slide {index} with value {rng.random():.4f}.</p>']
+    if kind == 'stats':
+        parts.append('<div class="stats-grid">')
+        for s in range(4):
+            parts.append(f'<div class="stat-card"><span class="stat-number">{rng.randint(1, 999)}M</span>'
+                         f'<span class="stat-label">Metric {s}</span><p>Card detail</p></div>')
+        parts.append('</div>')
+    elif kind == 'table':
+        parts.append('<table class="performance-table"><thead><tr>'
+                     '<th>Algorithm</th><th>Accuracy</th><th>Precision</th><th>Recall</th><th>F1</th>'
+                     '</tr></thead><tbody>')
+        for name in ALGORITHMS:
+            cells = ''.join(f'<td>{rng.uniform(0.6, 0.99):.3f}</td>' for _ in range(4))
+            parts.append(f'<tr><td>{name}</td>{cells}</tr>')
+        parts.append('</tbody></table>')
+    elif kind == 'algorithms':
+        parts.append('<div class="algorithm-grid">')
+        for name in ALGORITHMS[:4]:
+            parts.append(f'<div class="algorithm-card"><h4>{name}</h4><p>Why {name} fits this data.</p></div>')
+        parts.append('</div>')
+    elif kind == 'features':
+        for name in FEATURES:
+            value = rng.randint(5, 95)
+            parts.append(f'<div class="feature-bar"><span class="feature-name">{name}</span>'
+                         f'<div class="bar-container"><div class="bar-fill" style="width: {value}%">{value}%</div>'
+                         '</div></div>')
+    elif kind == 'chart':
+        parts.append(f'<div class="chart-placeholder">{chart_name(rng.randrange(charts))}</div>')
+    else:
+        items = ''.join(f'<li>Point {b} on slide {index}</li>' for b in range(5))
+        parts.append(f'<ul class="bullet-points">{items}</ul>'
+                     f'<div class="highlight-box"><p>Key finding for slide {index}</p></div>')
+    parts.append('</div>')
+    return ''.join(parts)
+
+
+def make_deck(slides, charts, rng):
+    parts = ['<html><body>',
+             '<div class="slide"><h1>Synthetic Benchmark Deck</h1><p>Generated by bench_ppt.py</p></div>']
+    for i in range(1, slides):
+        parts.append(make_slide(i, SLIDE_KINDS[(i - 1) % len(SLIDE_KINDS)], rng, charts))
+    parts.append('</body></html>')
+    return '\n'.join(parts)
+
+
+def convert(deck, output, images, args, timings=None):
+    # The converter reports progress on stdout; keep the report readable
+    with contextlib.redirect_stdout(io.StringIO()):
+        return ppt.html_to_pptx_converter(deck, output, images, workers=args.workers,
+                                          incremental=False, image_dpi=args.dpi, timings=timings)
+
+
+def measure(size, deck, images, args):
+    """Runs in a fresh process per deck size"""
+    output = os.path.join(os.path.dirname(deck), f'deck_{size}.pptx')
+    runs = []
+    for _ in range(args.repeat):
+        timings = {}
+        started = time.perf_counter()
+        slides = convert(deck, output, images, args, timings)
+        timings['total'] = time.perf_counter() - started
+        runs.append(timings)
+    result = {
+        'slides': slides,
+        'seconds': {phase: summarize([run[phase] for run in runs]) for phase in PHASES + ('total',)},
+        # ru_maxrss is KiB on Linux
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'output_mb': round(os.path.getsize(output) / 1e6, 2),
+    }
+    result['slides_per_s'] = round(slides / result['seconds']['total']['median'], 1)
+    if args.tracemalloc:
+        timings = {}
+        tracemalloc.start()
+        try:
+            convert(deck, output, images, args, timings)
+        finally:
+            tracemalloc.stop()
+        result['heap_peak_mb'] = {phase: round(timings[phase + '_peak_bytes'] / 1e6, 1) for phase in PHASES}
+    return result
+
+
+def summarize(values):
+    return {'min': round(min(values), 4), 'median': round(statistics.median(values), 4)}
+
+
+def run(args):
+    sizes = [int(size) for size in args.sizes.split(',')]
+    rng = random.Random(args.seed)
+    results = {}
+    with tempfile.TemporaryDirectory(prefix='bench_ppt_') as workdir:
+        images = os.path.join(workdir, 'images')
+        width, height = (int(v) for v in args.image_size.split('x'))
+        make_images(images, args.charts, (width, height), rng)
+        # Downsampled copies are a one-off cost per image, not per conversion
+        ppt.prepare_images([os.path.join(images, name) for name in os.listdir(images)
+                            if name.endswith('.png')], args.dpi)
+        for size in sizes:
+            deck = os.path.join(workdir, f'deck_{size}.html')
+            with open(deck, 'w', encoding='utf-8') as f:
+                f.write(make_deck(size, args.charts, rng))
+            with ProcessPoolExecutor(max_workers=1) as pool:
+                results[str(size)] = pool.submit(measure, size, deck, images, args).result()
+            print_row(size, results[str(size)])
+
+    result = {
+        'label': args.label,
+        'revision': git_revision(),
+        'timestamp': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+        'python': platform.python_version(),
+        'cpus': ppt.default_workers(),
+        'params': {'sizes': sizes, 'repeat': args.repeat, 'workers': args.workers, 'dpi': args.dpi,
+                   'charts': args.charts, 'image_size': args.image_size, 'seed': args.seed},
+        'sizes': results,
+    }
+    out = args.out or os.path.join(
+        'bench_results', f"ppt_{datetime.utcnow():%Y%m%dT%H%M%S}_{result['revision'] or 'local'}.json"
+    )
+    os.makedirs(os.path.dirname(out) or '.', exist_ok=True)
+    with open(out, 'w') as f:
+        json.dump(result, f, indent=2)
+    print(f"\nResults written to {out}")
+
+
+def print_row(size, r):
+    if size == 'header':
+        print(f"{'slides':>7}{'extract':>10}{'build':>10}{'save':>10}{'total':>10}{'slides/s':>10}"
+              f"{'rss MB':>9}{'pptx MB':>9}")
+        return
+    s = r['seconds']
+    print(f"{r['slides']:>7}" + ''.join(f"{s[phase]['median']:>10.3f}" for phase in PHASES + ('total',))
+          + f"{r['slides_per_s']:>10.1f}{r['peak_rss_mb']:>9.1f}{r['output_mb']:>9.2f}")
+
+
+def compare(args):
+    with open(args.baseline) as f:
+        base = json.load(f)
+    with open(args.candidate) as f:
+        cand = json.load(f)
+    print(f"{base.get('revision')} -> {cand.get('revision')}  (median seconds)")
+    print(f"{'slides':>7}" + ''.join(f"{column:>20}" for column in PHASES + ('total', 'rss MB')))
+    for size in sorted(set(base['sizes']) & set(cand['sizes']), key=int):
+        b, c = base['sizes'][size], cand['sizes'][size]
+        cols = [(b['seconds'][phase]['median'], c['seconds'][phase]['median']) for phase in PHASES + ('total',)]
+        cols.append((b['peak_rss_mb'], c['peak_rss_mb']))
+        print(f"{size:>7}" + ''.join(f"{_delta(old, new):>20}" for old, new in cols))
+
+
+def _delta(old, new):
+    if not old:
+        return f'{new}'
+    return f'{new:.3f} ({(new - old) / old * 100:+.0f}%)'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('run', help='convert synthetic decks and record phase timings')
+    p.add_argument('--sizes', default=DEFAULT_SIZES, help='slide counts, comma separated')
+    p.add_argument('--repeat', type=int, default=3, help='conversions per size')
+    p.add_argument('--workers', type=int, help='extraction processes (default: the converter picks)')
+    p.add_argument('--dpi', type=int, default=ppt.IMAGE_DPI)
+    p.add_argument('--charts', type=int, default=8, help='distinct chart images')
+    p.add_argument('--image-size', default='2400x1440', help='chart image pixels, WxH')
+    p.add_argument('--tracemalloc', action='store_true', help='extra pass recording heap peak per phase')
+    p.add_argument('--seed', type=int, default=42)
+    p.add_argument('--label', default='')
+    p.add_argument('--out', help='result file (default bench_results/ppt_<time>_<rev>.json)')
+    p.set_defaults(func=run)
+
+    p = sub.add_parser('compare', help='compare two result files')
+    p.add_argument('baseline')
+    p.add_argument('candidate')
+    p.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        print_row('header', None)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,216 @@
+"""
+Bulk import/export of users, videos, comments and likes.
+
+    python bulk_io.py --db videoapp.db import users=users.jsonl videos=videos.csv comments=comments.jsonl
+    python bulk_io.py --db videoapp.db export comments comments.jsonl
+
+Files are streamed: JSONL (one object per line), or CSV/TSV with a header
+row, picked by extension unless --format is given. An import runs as a single
+transaction: secondary indexes on the target tables are dropped first and
+rebuilt once the rows are in, and PRAGMA foreign_key_check runs before the
+commit so orphaned rows roll the whole load back (unless --allow-orphans).
+"""
+import argparse
+import csv
+import itertools
+import json
+import os
+import sqlite3
+import sys
+import time
+
+TABLES = ('users', 'videos', 'comments', 'likes')
+DELIMITERS = {'csv': ',', 'tsv': '\t'}
+SCHEMA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schema.sql')
+
+
+def detect_format(path, fmt=None):
+    if fmt:
+        return fmt
+    ext = os.path.splitext(path)[1].lower()
+    if ext in ('.jsonl', '.ndjson', '.json'):
+        return 'jsonl'
+    if ext == '.csv':
+        return 'csv'
+    if ext == '.tsv':
+        return 'tsv'
+    raise ValueError(f"Cannot tell the format of {path}; pass --format")
+
+
+def read_records(path, fmt):
+    with open(path, newline='', encoding='utf-8') as f:
+        if fmt in DELIMITERS:
+            for row in csv.DictReader(f, delimiter=DELIMITERS[fmt]):
+                # CSV has no NULL; an empty cell means "not set"
+                yield {k: (v if v != '' else None) for k, v in row.items()}
+        else:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+
+def table_columns(conn, table):
+    return [row[1] for row in conn.execute(f'PRAGMA table_info({table})')]
+
+
+def drop_indexes(conn, tables):
+    """Drop named secondary indexes and return their CREATE statements"""
+    placeholders = ', '.join('?' * len(tables))
+    indexes = conn.execute(
+        f"SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL "
+        f"AND tbl_name IN ({placeholders})", tables
+    ).fetchall()
+    for name, _ in indexes:
+        conn.execute(f'DROP INDEX "{name}"')
+    return [sql for _, sql in indexes]
+
+
+class Progress:
+    def __init__(self, label, every=2.0):
+        self.label = label
+        self.every = every
+        self.rows = 0
+        self.started = self.last = time.perf_counter()
+
+    def add(self, n):
+        self.rows += n
+        now = time.perf_counter()
+        if now - self.last >= self.every:
+            self.last = now
+            self.report(final=False)
+
+    def report(self, final=True):
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        end = '\n' if final else '\r'
+        print(f"{self.label}: {self.rows:,} rows, {self.rows / elapsed:,.0f} rows/s", end=end, file=sys.stderr, flush=True)
+
+
+def load_table(conn, table, path, fmt, batch_size, on_conflict):
+    records = read_records(path, fmt)
+    first = next(records, None)
+    if first is None:
+        return 0
+    known = table_columns(conn, table)
+    # Columns missing from the file keep their schema defaults
+    columns = [c for c in known if c in first]
+    unknown = set(first) - set(known)
+    if not columns:
+        raise ValueError(f"{path} has none of the columns of {table} ({', '.join(known)})")
+    if unknown:
+        print(f"{table}: ignoring unknown columns {', '.join(sorted(unknown))}", file=sys.stderr)
+    verb = 'INSERT' if on_conflict == 'abort' else f'INSERT OR {on_conflict.upper()}'
+    sql = f"{verb} INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+
+    rows = (tuple(rec.get(c) for c in columns) for rec in itertools.chain([first], records))
+    progress = Progress(f'{table} <- {path}')
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            break
+        conn.executemany(sql, batch)
+        progress.add(len(batch))
+    progress.report()
+    return progress.rows
+
+
+def import_command(args):
+    jobs = []
+    for spec in args.files:
+        table, sep, path = spec.partition('=')
+        if not sep or table not in TABLES:
+            sys.exit(f"Expected TABLE=PATH with TABLE in {', '.join(TABLES)}, got {spec!r}")
+        jobs.append((table, path, detect_format(path, args.format)))
+    # Parents first so rowids referenced by later files already exist
+    jobs.sort(key=lambda job: TABLES.index(job[0]))
+
+    conn = sqlite3.connect(args.db, isolation_level=None)
+    with open(SCHEMA_FILE) as f:
+        conn.executescript(f.read())
+    conn.execute('PRAGMA foreign_keys = OFF')
+    conn.execute('PRAGMA synchronous = OFF')
+    conn.execute('PRAGMA temp_store = MEMORY')
+    conn.execute(f'PRAGMA cache_size = {-args.cache_mb * 1024}')
+
+    started = time.perf_counter()
+    total = 0
+    conn.execute('BEGIN')
+    try:
+        index_sql = drop_indexes(conn, sorted({table for table, _, _ in jobs}))
+        for table, path, fmt in jobs:
+            total += load_table(conn, table, path, fmt, args.batch_size, args.on_conflict)
+
+        rebuild = time.perf_counter()
+        for sql in index_sql:
+            conn.execute(sql)
+        print(f"Rebuilt {len(index_sql)} indexes in {time.perf_counter() - rebuild:.1f}s", file=sys.stderr)
+
+        orphans = []
+        for table in sorted({table for table, _, _ in jobs}):
+            orphans.extend(conn.execute(f'PRAGMA foreign_key_check({table})').fetchall())
+        if orphans:
+            for row in orphans[:10]:
+                print(f"Foreign key violation: {row[0]} rowid {row[1]} -> {row[2]}", file=sys.stderr)
+            if not args.allow_orphans:
+                raise ValueError(f"{len(orphans)} foreign key violations")
+        conn.execute('COMMIT')
+    except BaseException as e:
+        conn.execute('ROLLBACK')
+        conn.close()
+        sys.exit(f"Import rolled back: {e}")
+    conn.execute('ANALYZE')
+    conn.close()
+    elapsed = time.perf_counter() - started
+    print(f"Imported {total:,} rows in {elapsed:.1f}s ({total / max(elapsed, 1e-9):,.0f} rows/s)", file=sys.stderr)
+
+
+def export_command(args):
+    if args.table not in TABLES:
+        sys.exit(f"Unknown table {args.table!r}; expected one of {', '.join(TABLES)}")
+    fmt = detect_format(args.path, args.format)
+    conn = sqlite3.connect(args.db)
+    cursor = conn.execute(f'SELECT * FROM {args.table} ORDER BY id')
+    columns = [d[0] for d in cursor.description]
+    progress = Progress(f'{args.table} -> {args.path}')
+    with open(args.path, 'w', newline='', encoding='utf-8') as f:
+        if fmt in DELIMITERS:
+            writer = csv.writer(f, delimiter=DELIMITERS[fmt])
+            writer.writerow(columns)
+        while True:
+            batch = cursor.fetchmany(args.batch_size)
+            if not batch:
+                break
+            if fmt in DELIMITERS:
+                writer.writerows(batch)
+            else:
+                f.writelines(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + '\n' for row in batch)
+            progress.add(len(batch))
+    progress.report()
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default=os.environ.get('VIDEOAPP_DB', 'videoapp.db'))
+    parser.add_argument('--format', choices=['jsonl', 'csv', 'tsv'])
+    parser.add_argument('--batch-size', type=int, default=50000)
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('import', help='load TABLE=PATH files in one transaction')
+    p.add_argument('files', nargs='+', metavar='TABLE=PATH')
+    p.add_argument('--on-conflict', choices=['abort', 'ignore', 'replace'], default='abort')
+    p.add_argument('--allow-orphans', action='store_true', help='commit despite foreign key violations')
+    p.add_argument('--cache-mb', type=int, default=256)
+    p.set_defaults(func=import_command)
+
+    p = sub.add_parser('export', help='stream a table to a file')
+    p.add_argument('table', choices=TABLES)
+    p.add_argument('path')
+    p.set_defaults(func=export_command)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""
+Single writer thread with group commit.
+
+Request handlers hand their writes to the writer instead of committing on
+their own connection:
+
+    like_count = writer.run(add_like, video_id, user_id)
+
+Each operation is a function taking the writer's connection (plus any
+arguments). The writer drains whatever is queued, runs each operation inside
+its own SAVEPOINT in one transaction and commits once, so a burst of N
+writes costs one lock acquisition and one fsync instead of N. An
+operation that raises is rolled back on its own and its exception is
+re-raised in the caller; the rest of the batch still commits. Results are
+only delivered after the COMMIT succeeds. Statements an operation runs are
+counted in the metrics of the request that submitted it; the shared COMMIT
+is not.
+
+Operations must not call commit() or rollback() themselves.
+"""
+import logging
+import queue
+import threading
+from concurrent.futures import Future, TimeoutError
+from time import perf_counter
+
+from sqlalchemy.exc import SQLAlchemyError
+
+import metrics
+
+logger = logging.getLogger('dbwriter')
+
+QUEUE_DEPTH = metrics.Gauge('db_writer_queue_depth', 'Write operations waiting for the writer thread')
+BATCH_SIZE = metrics.Histogram('db_writer_batch_size', 'Operations committed per transaction',
+                               buckets=metrics.COUNT_BUCKETS)
+COMMIT_LATENCY = metrics.Histogram('db_writer_commit_seconds', 'Time spent in COMMIT per batch')
+WAIT_LATENCY = metrics.Histogram('db_writer_wait_seconds', 'Time from submit until the write is committed')
+FAILED = metrics.Counter('db_writer_failed_operations_total', 'Write operations that raised', ('error',))
+
+
+class WriteTimeout(SQLAlchemyError):
+    """The write was not committed within the timeout; it may still be applied later"""
+
+
+class Writer:
+    def __init__(self, connect, max_batch=256, timeout=10.0):
+        self.connect = connect
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self.queue = queue.SimpleQueue()
+        self.thread = None
+        self.start_lock = threading.Lock()
+        QUEUE_DEPTH.set_function(self.depth)
+
+    def depth(self):
+        return self.queue.qsize()
+
+    def submit(self, operation, *args):
+        """Queue operation(connection, *args) and return a Future for its result"""
+        if self.thread is None:
+            self._start()
+        future = Future()
+        self.queue.put((future, operation, args, perf_counter(), metrics.request_stats()))
+        return future
+
+    def run(self, operation, *args):
+        """Submit and wait for the commit; raises whatever the operation raised"""
+        try:
+            return self.submit(operation, *args).result(self.timeout)
+        except TimeoutError:
+            raise WriteTimeout(f'write not committed within {self.timeout}s') from None
+
+    def _start(self):
+        # Started on first use so forked worker processes each get their own thread
+        with self.start_lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._loop, name='db-writer', daemon=True)
+                self.thread.start()
+
+    def _loop(self):
+        conn = self.connect()
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._commit_batch(conn, batch)
+            except Exception:
+                # Never let the writer die; reconnect and carry on with the next batch
+                logger.exception("Writer batch failed")
+                for future, *_ in batch:
+                    if not future.done():
+                        future.set_exception(SQLAlchemyError('write batch failed'))
+                conn.close()
+                conn = self.connect()
+
+    def _commit_batch(self, conn, batch):
+        done = []
+        transaction = conn.begin()
+        for item in batch:
+            future, operation, args, _, stats = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            savepoint = conn.begin_nested()
+            try:
+                with metrics.counting_for(stats):
+                    result = operation(conn, *args)
+            except Exception as e:
+                savepoint.rollback()
+                FAILED.inc((type(e).__name__,))
+                future.set_exception(e)
+                continue
+            savepoint.commit()
+            done.append((item, result))
+
+        started = perf_counter()
+        try:
+            transaction.commit()
+        except SQLAlchemyError as e:
+            transaction.rollback()
+            for (future, *_), _ in done:
+                future.set_exception(e)
+            return
+        finished = perf_counter()
+        COMMIT_LATENCY.observe(finished - started)
+        BATCH_SIZE.observe(len(done))
+        for (future, _, _, queued, _), result in done:
+            WAIT_LATENCY.observe(finished - queued)
+            future.set_result(result)
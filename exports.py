@@ -0,0 +1,199 @@
+"""
+Engagement spreadsheets for creators.
+
+    exporter = exports.Exporter(app)
+    job = exporter.start(user_id)
+
+A job writes an .xlsx with a Videos sheet (likes, comments and ratings per
+video) and a Comments sheet (one row per comment) to EXPORT_FOLDER. Rows come
+from keyset-paginated queries, EXPORT_PAGE_ROWS at a time, and xlsxwriter
+runs in constant_memory mode, flushing each row to disk as it is written, so
+memory stays flat however many comments a channel has. The read transaction
+is ended after every page so a long export doesn't pin the SQLite WAL.
+
+Jobs run on a small thread pool. Job state lives in this process only; a
+restart forgets unfinished exports and their files are left behind.
+"""
+import logging
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from datetime import datetime
+from time import perf_counter
+
+import xlsxwriter
+
+import database
+import metrics
+import queries
+
+logger = logging.getLogger('exports')
+
+# Excel's limit; comments spill onto "Comments (2)" and so on past it
+SHEET_MAX_ROWS = 1048576
+VIDEO_COLUMNS = ('Video ID', 'Title', 'Genre', 'Age rating', 'Likes', 'Comments', 'Ratings', 'Average rating')
+COMMENT_COLUMNS = ('Comment ID', 'Video ID', 'Video title', 'User', 'Rating', 'Comment', 'Posted at')
+
+JOBS = metrics.Counter('export_jobs_total', 'Engagement exports finished', ('status',))
+DURATION = metrics.Histogram('export_seconds', 'Time to write an engagement export',
+                             buckets=(0.1, 0.5, 1.0, 5.0, 15.0, 60.0, 300.0, 900.0))
+
+
+class Job:
+    def __init__(self, user_id, folder):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.path = os.path.join(folder, f'{user_id}-{self.id}.xlsx')
+        self.status = 'queued'
+        self.rows = 0
+        self.error = None
+        self.created = datetime.now()
+        self.future = None
+
+
+class Exporter:
+    def __init__(self, app=None):
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+        self.pool = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.folder = app.config.get('EXPORT_FOLDER', 'exports')
+        self.page_rows = app.config.get('EXPORT_PAGE_ROWS', 5000)
+        self.keep = app.config.get('EXPORT_KEEP', 5)
+        self.pool = ThreadPoolExecutor(max_workers=app.config.get('EXPORT_WORKERS', 1),
+                                       thread_name_prefix='export')
+        os.makedirs(self.folder, exist_ok=True)
+
+    def start(self, user_id):
+        """Queue an export of user_id's channel and return its Job"""
+        job = Job(user_id, self.folder)
+        with self.lock:
+            self.jobs[job.id] = job
+            self._expire(user_id)
+        job.future = self.pool.submit(self._run, job)
+        return job
+
+    def wait(self, job, timeout):
+        """True if the job finished (or failed) within timeout seconds"""
+        try:
+            job.future.result(timeout)
+        except TimeoutError:
+            return False
+        return True
+
+    def get(self, job_id, user_id):
+        job = self.jobs.get(job_id)
+        return job if job is not None and job.user_id == user_id else None
+
+    def jobs_for(self, user_id):
+        """Newest first"""
+        with self.lock:
+            return [job for job in reversed(self.jobs.values()) if job.user_id == user_id]
+
+    def _expire(self, user_id):
+        # Oldest finished exports beyond EXPORT_KEEP per user are dropped with their files
+        mine = [job for job in self.jobs.values() if job.user_id == user_id and job.status in ('done', 'failed')]
+        for job in mine[:max(0, len(mine) - self.keep)]:
+            del self.jobs[job.id]
+            if os.path.exists(job.path):
+                os.remove(job.path)
+
+    def _run(self, job):
+        job.status = 'running'
+        started = perf_counter()
+        partial = job.path + '.partial'
+        try:
+            with database.engine.connect() as conn:
+                job.rows = write_workbook(conn, job.user_id, partial, self.page_rows)
+            os.replace(partial, job.path)
+            job.status = 'done'
+        except Exception as e:
+            logger.exception("Export %s failed", job.id)
+            job.status, job.error = 'failed', str(e)
+            if os.path.exists(partial):
+                os.remove(partial)
+        DURATION.observe(perf_counter() - started)
+        JOBS.inc((job.status,))
+        return job
+
+
+def video_pages(conn, user_id, page_rows):
+    after = 0
+    while True:
+        rows = conn.execute(queries.EXPORT_VIDEOS,
+                            {'user_id': user_id, 'after': after, 'limit': page_rows}).fetchall()
+        conn.rollback()
+        if not rows:
+            return
+        yield rows
+        after = rows[-1].id
+
+
+def comment_pages(conn, user_id, page_rows):
+    video, after = 0, 0
+    while True:
+        rows = []
+        if video:
+            rows = conn.execute(queries.EXPORT_COMMENTS_IN_VIDEO,
+                                {'video_id': video, 'after': after, 'limit': page_rows}).fetchall()
+        if len(rows) < page_rows:
+            rows += conn.execute(queries.EXPORT_COMMENTS_AFTER_VIDEO,
+                                 {'user_id': user_id, 'after': video, 'limit': page_rows - len(rows)}).fetchall()
+        conn.rollback()
+        if not rows:
+            return
+        yield rows
+        video, after = rows[-1].video_id, rows[-1].id
+
+
+def write_workbook(conn, user_id, path, page_rows=5000):
+    """Write user_id's engagement to path; returns the number of data rows"""
+    workbook = xlsxwriter.Workbook(path, {
+        'constant_memory': True,
+        'tmpdir': os.path.dirname(path) or '.',
+        # Comments are user input: never turn "=..." into a formula or text into links
+        'strings_to_formulas': False,
+        'strings_to_urls': False,
+    })
+    header = workbook.add_format({'bold': True})
+    average = workbook.add_format({'num_format': '0.00'})
+    total = 0
+    try:
+        sheet = _sheet(workbook, 'Videos', VIDEO_COLUMNS, header)
+        sheet.set_column(4, 6, 10)
+        sheet.set_column(7, 7, 14, average)
+        row = 1
+        for page in video_pages(conn, user_id, page_rows):
+            for video in page:
+                sheet.write_row(row, 0, tuple(video))
+                row += 1
+        total += row - 1
+
+        part, row = 1, 1
+        sheet = _sheet(workbook, 'Comments', COMMENT_COLUMNS, header)
+        for page in comment_pages(conn, user_id, page_rows):
+            for comment in page:
+                if row == SHEET_MAX_ROWS:
+                    total += row - 1
+                    part, row = part + 1, 1
+                    sheet = _sheet(workbook, f'Comments ({part})', COMMENT_COLUMNS, header)
+                values = list(comment)
+                values[-1] = str(values[-1]) if values[-1] is not None else None
+                sheet.write_row(row, 0, values)
+                row += 1
+        total += row - 1
+    finally:
+        workbook.close()
+    return total
+
+
+def _sheet(workbook, name, columns, header):
+    sheet = workbook.add_worksheet(name)
+    sheet.write_row(0, 0, columns, header)
+    sheet.freeze_panes(1, 0)
+    return sheet
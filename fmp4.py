@@ -0,0 +1,479 @@
+"""
+Pure-Python packager from progressive MP4 to fragmented MP4 + HLS.
+
+    python fmp4.py static/uploads/<file>.mp4 static/hls/<name> --segment 2
+    python fmp4.py --all            # package every upload that has no playlist yet
+
+The sample tables in `moov` are parsed into per-track arrays. Segments are
+cut at the first video keyframe at or after each target boundary, and every
+segment is written as `moof` + `mdat` by copying sample bytes straight from
+the source file in bounded reads, so memory use does not grow with the
+media size. The output directory holds init.mp4, seg_NNNNN.m4s,
+index.m3u8 (media playlist) and master.m3u8 (with CODECS/RESOLUTION).
+"""
+import argparse
+import glob
+import logging
+import math
+import os
+import shutil
+import struct
+import tempfile
+from array import array
+
+logger = logging.getLogger('fmp4')
+
+SYNC_SAMPLE_FLAGS = 0x02000000       # sample_depends_on = 2 (I-frame)
+NON_SYNC_SAMPLE_FLAGS = 0x01010000   # sample_depends_on = 1, sample_is_non_sync_sample
+COPY_CHUNK = 1 << 20
+MASTER_PLAYLIST = 'master.m3u8'
+
+
+class PackagingError(ValueError):
+    pass
+
+
+def box(kind, *payloads):
+    data = b''.join(payloads)
+    return struct.pack('>I4s', 8 + len(data), kind) + data
+
+
+def full_box(kind, version, flags, *payloads):
+    return box(kind, struct.pack('>I', (version << 24) | flags), *payloads)
+
+
+def iter_boxes(data, start=0, end=None):
+    """Yield (type, payload_start, box_end) for the boxes in data[start:end]"""
+    end = len(data) if end is None else end
+    pos = start
+    while pos + 8 <= end:
+        size, kind = struct.unpack_from('>I4s', data, pos)
+        header = 8
+        if size == 1:
+            size = struct.unpack_from('>Q', data, pos + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header or pos + size > end:
+            raise PackagingError(f"Truncated {kind!r} box at offset {pos}")
+        yield kind, pos + header, pos + size
+        pos += size
+
+
+def find(data, path, start=0, end=None):
+    """Return (payload_start, box_end) of the first box matching a list of types"""
+    for kind, payload, box_end in iter_boxes(data, start, end):
+        if kind == path[0]:
+            return (payload, box_end) if len(path) == 1 else find(data, path[1:], payload, box_end)
+    return None
+
+
+def read_moov(f):
+    f.seek(0, os.SEEK_END)
+    file_size = f.tell()
+    pos = 0
+    while pos + 8 <= file_size:
+        f.seek(pos)
+        size, kind = struct.unpack('>I4s', f.read(8))
+        header = 8
+        if size == 1:
+            size = struct.unpack('>Q', f.read(8))[0]
+            header = 16
+        elif size == 0:
+            size = file_size - pos
+        if kind == b'moov':
+            f.seek(pos)
+            return f.read(size)
+        if kind == b'moof':
+            raise PackagingError('Input is already fragmented')
+        if size < header:
+            break
+        pos += size
+    raise PackagingError('No moov box found')
+
+
+class Track:
+    def __init__(self, moov, start, end):
+        self.moov = moov
+        self.trak = (start, end)
+        tkhd = find(moov, [b'tkhd'], start, end)
+        version = moov[tkhd[0]]
+        self.track_id = struct.unpack_from('>I', moov, tkhd[0] + (20 if version == 1 else 12))[0]
+        self.width, self.height = (v >> 16 for v in struct.unpack_from('>II', moov, tkhd[1] - 8))
+
+        mdhd = find(moov, [b'mdia', b'mdhd'], start, end)
+        version = moov[mdhd[0]]
+        self.timescale = struct.unpack_from('>I', moov, mdhd[0] + (20 if version == 1 else 12))[0]
+        hdlr = find(moov, [b'mdia', b'hdlr'], start, end)
+        self.handler = moov[hdlr[0] + 8:hdlr[0] + 12]
+
+        stbl = find(moov, [b'mdia', b'minf', b'stbl'], start, end)
+        self.stbl = stbl
+        self.stsd = find(moov, [b'stsd'], *stbl)
+        self._read_sample_tables(*stbl)
+
+    def _table(self, kind, stbl_start, stbl_end):
+        found = find(self.moov, [kind], stbl_start, stbl_end)
+        if found is None:
+            return None, None, None
+        payload, _ = found
+        version = self.moov[payload]
+        count = struct.unpack_from('>I', self.moov, payload + 4)[0]
+        return version, count, payload + 8
+
+    def _read_sample_tables(self, stbl_start, stbl_end):
+        moov = self.moov
+        _, count, pos = self._table(b'stts', stbl_start, stbl_end)
+        self.durations = array('q')
+        for i in range(count or 0):
+            n, delta = struct.unpack_from('>II', moov, pos + 8 * i)
+            self.durations.extend([delta] * n)
+        total = len(self.durations)
+        self.dts = array('q', [0]) * total
+        t = 0
+        for i, d in enumerate(self.durations):
+            self.dts[i] = t
+            t += d
+        self.end_dts = t
+
+        version, count, pos = self._table(b'ctts', stbl_start, stbl_end)
+        self.cts_offsets = None
+        if count:
+            self.cts_offsets = array('q')
+            fmt = '>Ii' if version == 1 else '>II'
+            for i in range(count):
+                n, offset = struct.unpack_from(fmt, moov, pos + 8 * i)
+                self.cts_offsets.extend([offset] * n)
+
+        _, count, pos = self._table(b'stss', stbl_start, stbl_end)
+        self.sync = None
+        if count is not None:
+            self.sync = bytearray(total)
+            for i in range(count):
+                number = struct.unpack_from('>I', moov, pos + 4 * i)[0]
+                if 0 < number <= total:
+                    self.sync[number - 1] = 1
+
+        payload, _ = find(moov, [b'stsz'], stbl_start, stbl_end)
+        fixed, count = struct.unpack_from('>II', moov, payload + 4)
+        if fixed:
+            self.sizes = array('q', [fixed]) * count
+        else:
+            self.sizes = array('q', struct.unpack_from(f'>{count}I', moov, payload + 12))
+
+        found = find(moov, [b'stco'], stbl_start, stbl_end)
+        if found:
+            count = struct.unpack_from('>I', moov, found[0] + 4)[0]
+            chunk_offsets = struct.unpack_from(f'>{count}I', moov, found[0] + 8)
+        else:
+            found = find(moov, [b'co64'], stbl_start, stbl_end)
+            count = struct.unpack_from('>I', moov, found[0] + 4)[0]
+            chunk_offsets = struct.unpack_from(f'>{count}Q', moov, found[0] + 8)
+
+        _, count, pos = self._table(b'stsc', stbl_start, stbl_end)
+        stsc = [struct.unpack_from('>III', moov, pos + 12 * i) for i in range(count)]
+        self.offsets = array('q', [0]) * len(self.sizes)
+        sample = 0
+        for i, (first_chunk, per_chunk, _) in enumerate(stsc):
+            last_chunk = stsc[i + 1][0] - 1 if i + 1 < len(stsc) else len(chunk_offsets)
+            for chunk in range(first_chunk - 1, last_chunk):
+                offset = chunk_offsets[chunk]
+                for _ in range(per_chunk):
+                    if sample >= len(self.sizes):
+                        break
+                    self.offsets[sample] = offset
+                    offset += self.sizes[sample]
+                    sample += 1
+        if not (len(self.sizes) == len(self.durations) == sample):
+            raise PackagingError(f"Track {self.track_id}: inconsistent sample tables")
+
+    @property
+    def is_video(self):
+        return self.handler == b'vide'
+
+    def is_sync(self, i):
+        return self.sync is None or bool(self.sync[i])
+
+    def codec(self):
+        moov = self.moov
+        entry = self.stsd[0] + 8
+        kind = moov[entry + 4:entry + 8]
+        entry_end = entry + struct.unpack_from('>I', moov, entry)[0]
+        if kind in (b'avc1', b'avc3'):
+            avcc = find(moov, [b'avcC'], entry + 86, entry_end)
+            if avcc:
+                p = avcc[0]
+                return f'{kind.decode()}.{moov[p + 1]:02x}{moov[p + 2]:02x}{moov[p + 3]:02x}'
+        if kind == b'mp4a':
+            esds = find(moov, [b'esds'], entry + 36, entry_end)
+            if esds:
+                return _mp4a_codec(moov[esds[0] + 4:esds[1]])
+            return 'mp4a.40.2'
+        return kind.decode('latin1')
+
+    def init_trak(self):
+        """trak box for the init segment: same headers, empty sample tables"""
+        moov = self.moov
+        start, end = self.trak
+        parts = []
+        for kind, payload, box_end in iter_boxes(moov, start, end):
+            if kind == b'tkhd':
+                parts.append(_zero_duration(moov, kind, payload, box_end, v0=20, v1=28))
+            elif kind == b'mdia':
+                parts.append(self._init_mdia(payload, box_end))
+            elif kind != b'udta':
+                parts.append(moov[payload - 8:box_end])
+        return box(b'trak', *parts)
+
+    def _init_mdia(self, start, end):
+        moov = self.moov
+        parts = []
+        for kind, payload, box_end in iter_boxes(moov, start, end):
+            if kind == b'mdhd':
+                parts.append(_zero_duration(moov, kind, payload, box_end, v0=16, v1=24))
+            elif kind == b'minf':
+                minf = []
+                for inner, p, e in iter_boxes(moov, payload, box_end):
+                    if inner == b'stbl':
+                        minf.append(box(b'stbl', moov[self.stsd[0] - 8:self.stsd[1]],
+                                        full_box(b'stts', 0, 0, b'\0\0\0\0'),
+                                        full_box(b'stsc', 0, 0, b'\0\0\0\0'),
+                                        full_box(b'stsz', 0, 0, b'\0' * 8),
+                                        full_box(b'stco', 0, 0, b'\0\0\0\0')))
+                    else:
+                        minf.append(moov[p - 8:e])
+                parts.append(box(b'minf', *minf))
+            else:
+                parts.append(moov[payload - 8:box_end])
+        return box(b'mdia', *parts)
+
+
+def _zero_duration(data, kind, payload, box_end, v0, v1):
+    # Fragmented files carry no duration in mvhd/tkhd/mdhd
+    body = bytearray(data[payload:box_end])
+    if body[0] == 1:
+        body[v1:v1 + 8] = b'\0' * 8
+    else:
+        body[v0:v0 + 4] = b'\0' * 4
+    return box(kind, bytes(body))
+
+
+def _mp4a_codec(esds):
+    def descriptor(pos):
+        tag = esds[pos]
+        size, pos = 0, pos + 1
+        for _ in range(4):
+            byte = esds[pos]
+            pos += 1
+            size = (size << 7) | (byte & 0x7f)
+            if not byte & 0x80:
+                break
+        return tag, pos, pos + size
+
+    try:
+        tag, pos, end = descriptor(0)
+        if tag != 0x03:
+            return 'mp4a.40.2'
+        flags = esds[pos + 2]
+        pos += 3 + (2 if flags & 0x80 else 0) + (esds[pos + 3] + 1 if flags & 0x40 else 0) + (2 if flags & 0x20 else 0)
+        tag, pos, end = descriptor(pos)
+        object_type = esds[pos]
+        if object_type != 0x40:
+            return f'mp4a.{object_type:02x}'
+        tag, pos, end = descriptor(pos + 13)
+        audio_object_type = esds[pos] >> 3 if tag == 0x05 else 2
+        return f'mp4a.40.{audio_object_type}'
+    except IndexError:
+        return 'mp4a.40.2'
+
+
+def plan_segments(tracks, target_seconds):
+    """Boundaries in seconds: keyframes of the first video track at least target apart"""
+    lead = next((t for t in tracks if t.is_video), tracks[0])
+    step = target_seconds * lead.timescale
+    boundaries = [0]
+    for i in range(1, len(lead.dts)):
+        if lead.is_sync(i) and lead.dts[i] - boundaries[-1] >= step:
+            boundaries.append(lead.dts[i])
+    end = max(t.end_dts / t.timescale for t in tracks)
+    return [b / lead.timescale for b in boundaries] + [end]
+
+
+def _sample_range(track, start, end):
+    # Samples whose decode time falls in [start, end) seconds
+    lo = _bisect(track.dts, round(start * track.timescale))
+    hi = len(track.dts) if end == math.inf else _bisect(track.dts, round(end * track.timescale))
+    return lo, hi
+
+
+def _bisect(values, target):
+    lo, hi = 0, len(values)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if values[mid] < target:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+def build_moof(sequence, track_ranges, data_offsets):
+    trafs = []
+    for (track, lo, hi), data_offset in zip(track_ranges, data_offsets):
+        has_cts = track.cts_offsets is not None
+        flags = 0x000001 | 0x000100 | 0x000200 | 0x000400 | (0x000800 if has_cts else 0)
+        entries = []
+        for i in range(lo, hi):
+            sample_flags = SYNC_SAMPLE_FLAGS if track.is_sync(i) else NON_SYNC_SAMPLE_FLAGS
+            if has_cts:
+                entries.append(struct.pack('>IIIi', track.durations[i], track.sizes[i], sample_flags,
+                                           track.cts_offsets[i]))
+            else:
+                entries.append(struct.pack('>III', track.durations[i], track.sizes[i], sample_flags))
+        trafs.append(box(
+            b'traf',
+            full_box(b'tfhd', 0, 0x020000, struct.pack('>I', track.track_id)),
+            full_box(b'tfdt', 1, 0, struct.pack('>Q', track.dts[lo])),
+            full_box(b'trun', 1, flags, struct.pack('>Ii', hi - lo, data_offset), *entries),
+        ))
+    return box(b'moof', full_box(b'mfhd', 0, 0, struct.pack('>I', sequence)), *trafs)
+
+
+def write_segment(src, out, sequence, track_ranges):
+    sizes = [sum(track.sizes[lo:hi]) for track, lo, hi in track_ranges]
+    moof_size = len(build_moof(sequence, track_ranges, [0] * len(track_ranges)))
+    offsets, running = [], moof_size + 8
+    for size in sizes:
+        offsets.append(running)
+        running += size
+    out.write(build_moof(sequence, track_ranges, offsets))
+    out.write(struct.pack('>I4s', 8 + sum(sizes), b'mdat'))
+    for track, lo, hi in track_ranges:
+        i = lo
+        while i < hi:
+            # Coalesce samples stored back to back into one bounded read
+            start = track.offsets[i]
+            length = track.sizes[i]
+            i += 1
+            while i < hi and track.offsets[i] == start + length and length < COPY_CHUNK:
+                length += track.sizes[i]
+                i += 1
+            src.seek(start)
+            while length:
+                data = src.read(min(length, COPY_CHUNK))
+                if not data:
+                    raise PackagingError('Sample data runs past the end of the file')
+                out.write(data)
+                length -= len(data)
+    return 8 + sum(sizes) + moof_size
+
+
+def package(src_path, out_dir, segment_seconds=2.0):
+    """Write init.mp4, segments and playlists for src_path into out_dir atomically"""
+    with open(src_path, 'rb') as src:
+        moov = read_moov(src)
+        tracks = []
+        for kind, payload, box_end in iter_boxes(moov, 8):
+            if kind == b'trak':
+                track = Track(moov, payload, box_end)
+                if track.handler in (b'vide', b'soun') and len(track.sizes):
+                    tracks.append(track)
+        if not tracks:
+            raise PackagingError('No audio or video tracks')
+
+        parent = os.path.dirname(os.path.abspath(out_dir))
+        os.makedirs(parent, exist_ok=True)
+        tmp = tempfile.mkdtemp(prefix='.fmp4-', dir=parent)
+        try:
+            _write_package(src, moov, tracks, tmp, segment_seconds)
+            if os.path.isdir(out_dir):
+                shutil.rmtree(out_dir)
+            os.replace(tmp, out_dir)
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+    return os.path.join(out_dir, MASTER_PLAYLIST)
+
+
+def _write_package(src, moov, tracks, out_dir, segment_seconds):
+    mvhd = find(moov, [b'mvhd'], 8)
+    next_track_id = max(t.track_id for t in tracks) + 1
+    mvhd_box = _zero_duration(moov, b'mvhd', mvhd[0], mvhd[1], v0=16, v1=24)
+    mvhd_box = mvhd_box[:-4] + struct.pack('>I', next_track_id)
+    trex = [full_box(b'trex', 0, 0, struct.pack('>IIIII', t.track_id, 1, 0, 0, 0)) for t in tracks]
+    with open(os.path.join(out_dir, 'init.mp4'), 'wb') as f:
+        f.write(box(b'ftyp', b'iso6', struct.pack('>I', 0), b'iso6', b'mp41', b'isom'))
+        f.write(box(b'moov', mvhd_box, *(t.init_trak() for t in tracks), box(b'mvex', *trex)))
+
+    boundaries = plan_segments(tracks, segment_seconds)
+    segments = []
+    for n, (start, end) in enumerate(zip(boundaries, boundaries[1:])):
+        ranges = [(t,) + _sample_range(t, start, end if n < len(boundaries) - 2 else math.inf) for t in tracks]
+        ranges = [r for r in ranges if r[2] > r[1]]
+        if not ranges:
+            continue
+        name = f'seg_{n:05d}.m4s'
+        with open(os.path.join(out_dir, name), 'wb') as out:
+            size = write_segment(src, out, n + 1, ranges)
+        segments.append((name, end - start, size))
+
+    target = max(math.ceil(duration) for _, duration, _ in segments)
+    lines = ['#EXTM3U', '#EXT-X-VERSION:7', f'#EXT-X-TARGETDURATION:{target}', '#EXT-X-MEDIA-SEQUENCE:0',
+             '#EXT-X-PLAYLIST-TYPE:VOD', '#EXT-X-INDEPENDENT-SEGMENTS', '#EXT-X-MAP:URI="init.mp4"']
+    for name, duration, _ in segments:
+        lines.extend([f'#EXTINF:{duration:.5f},', name])
+    lines.append('#EXT-X-ENDLIST')
+    with open(os.path.join(out_dir, 'index.m3u8'), 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+    peak = max(size * 8 / max(duration, 0.001) for _, duration, size in segments)
+    average = sum(size for _, _, size in segments) * 8 / max(sum(d for _, d, _ in segments), 0.001)
+    attrs = [f'BANDWIDTH={int(peak)}', f'AVERAGE-BANDWIDTH={int(average)}',
+             'CODECS="{}"'.format(','.join(t.codec() for t in tracks))]
+    video = next((t for t in tracks if t.is_video), None)
+    if video and video.width and video.height:
+        attrs.append(f'RESOLUTION={video.width}x{video.height}')
+    with open(os.path.join(out_dir, MASTER_PLAYLIST), 'w') as f:
+        f.write('#EXTM3U\n#EXT-X-VERSION:7\n#EXT-X-INDEPENDENT-SEGMENTS\n'
+                f"#EXT-X-STREAM-INF:{','.join(attrs)}\nindex.m3u8\n")
+
+
+def output_dir_for(upload_path, hls_root):
+    return os.path.join(hls_root, os.path.splitext(os.path.basename(upload_path))[0])
+
+
+def package_upload(upload_path, hls_root, segment_seconds=2.0):
+    """Post-upload stage; failures are logged, the progressive file still plays"""
+    try:
+        return package(upload_path, output_dir_for(upload_path, hls_root), segment_seconds)
+    except (PackagingError, OSError, struct.error) as e:
+        logger.warning("Could not package %s for HLS: %s", upload_path, e)
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('input', nargs='?')
+    parser.add_argument('output', nargs='?')
+    parser.add_argument('--segment', type=float, default=2.0, help='target segment length in seconds')
+    parser.add_argument('--all', action='store_true', help='package every MP4 under --uploads')
+    parser.add_argument('--uploads', default='static/uploads')
+    parser.add_argument('--hls-root', default='static/hls')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    if args.all:
+        for path in sorted(glob.glob(os.path.join(args.uploads, '*.mp4'))):
+            if not os.path.exists(os.path.join(output_dir_for(path, args.hls_root), MASTER_PLAYLIST)):
+                result = package_upload(path, args.hls_root, args.segment)
+                if result:
+                    logger.info("%s -> %s", path, result)
+    elif args.input:
+        output = args.output or output_dir_for(args.input, args.hls_root)
+        logger.info("%s -> %s", args.input, package(args.input, output, args.segment))
+    else:
+        parser.error('give an input file or --all')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+Fragment cache for rendered template blocks.
+
+    {% cache video['id'], video['version'] %} ...card markup... {% endcache %}
+
+The key is the template name plus the given values, so callers pass a
+version that changes whenever the fragment's inputs do (videos.version is
+bumped on like, comment and metadata changes). Entries are evicted least
+recently used first once their total UTF-8 size exceeds the byte budget.
+"""
+import threading
+from collections import OrderedDict
+
+from jinja2 import nodes
+from jinja2.ext import Extension
+
+import metrics
+
+REQUESTS = metrics.Counter('fragment_cache_requests_total', 'Fragment cache lookups', ('result',))
+
+
+class FragmentCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                return entry[0]
+        return None
+
+    def set(self, key, value):
+        size = len(value.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            self.entries[key] = (value, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.size -= evicted
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+class FragmentCacheExtension(Extension):
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        key = [nodes.Const(parser.name), parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            key.append(parser.parse_expression())
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        return nodes.CallBlock(self.call_method('_render', [nodes.Tuple(key, 'load')]), [], [], body).set_lineno(lineno)
+
+    def _render(self, key, caller):
+        cache = getattr(self.environment, 'fragment_cache', None)
+        if cache is None:
+            return caller()
+        value = cache.get(key)
+        if value is None:
+            REQUESTS.inc(('miss',))
+            value = caller()
+            cache.set(key, value)
+        else:
+            REQUESTS.inc(('hit',))
+        return value
+
+
+def init_app(app):
+    app.jinja_env.add_extension(FragmentCacheExtension)
+    max_bytes = app.config.get('FRAGMENT_CACHE_BYTES', 0)
+    app.jinja_env.fragment_cache = FragmentCache(max_bytes) if max_bytes else None
+    return app.jinja_env.fragment_cache
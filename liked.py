@@ -0,0 +1,117 @@
+"""
+Which videos on a feed page the current user has liked.
+
+    liked = liked.LikedSet(db, user_id, cache)
+    liked.load(video_ids)          # one query for the whole page
+    video_id in liked
+
+Like buttons are rendered outside the {% cache %} blocks, since a card's
+fragment is shared by every viewer. A LikedSet resolves a page of video IDs
+with a single indexed IN query on likes(video_id, user_id), skipping IDs the
+LikedCache already knows for that user. The cache keeps the known like state
+of recently active users (least recently used users are evicted first) and
+like() invalidates the user's entry once the like is committed. A page that
+read likes before that invalidation doesn't put its (possibly stale) result
+back: each read carries the cache's clock, and update() drops results read
+before the user's last invalidation. With several worker processes each
+keeps its own cache, so a like made through one process is only visible to
+another's cache once that user's entry is evicted; set LIKED_CACHE_USERS = 0
+there unless requests are sticky per user.
+"""
+import threading
+from collections import OrderedDict
+
+import metrics
+import queries
+
+LOOKUPS = metrics.Counter('liked_cache_lookups_total', 'Liked-state lookups per video', ('result',))
+
+
+class LikedCache:
+    def __init__(self, max_users=10000, max_videos=1000):
+        self.max_users = max_users
+        self.max_videos = max_videos
+        self.users = OrderedDict()
+        self.lock = threading.Lock()
+        self.clock = 0
+        # user_id -> clock of their last invalidation, oldest first; users
+        # dropped from it count as invalidated at `forgotten`
+        self.invalidated = OrderedDict()
+        self.forgotten = 0
+
+    def get(self, user_id, video_ids):
+        """({video_id: liked} for the IDs known for user_id, [IDs that are not], clock to pass to update)"""
+        with self.lock:
+            clock = self.clock
+            states = self.users.get(user_id)
+            if states is None:
+                return {}, list(video_ids), clock
+            self.users.move_to_end(user_id)
+            known = {video_id: states[video_id] for video_id in video_ids if video_id in states}
+        return known, [video_id for video_id in video_ids if video_id not in known], clock
+
+    def update(self, user_id, states, clock):
+        """Remember states read after get() returned clock, unless user_id was invalidated since"""
+        with self.lock:
+            if self.invalidated.get(user_id, self.forgotten) > clock:
+                return
+            entry = self.users.get(user_id)
+            if entry is None or len(entry) + len(states) > self.max_videos:
+                entry = self.users[user_id] = {}
+            entry.update(states)
+            self.users.move_to_end(user_id)
+            while len(self.users) > self.max_users:
+                self.users.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self.lock:
+            self.clock += 1
+            self.users.pop(user_id, None)
+            self.invalidated[user_id] = self.clock
+            self.invalidated.move_to_end(user_id)
+            while len(self.invalidated) > self.max_users:
+                self.forgotten = self.invalidated.popitem(last=False)[1]
+
+    def clear(self):
+        with self.lock:
+            self.clock += 1
+            self.users.clear()
+            self.invalidated.clear()
+            self.forgotten = self.clock
+
+
+class LikedSet:
+    """Liked video IDs for one user, filled a page at a time"""
+
+    def __init__(self, db, user_id, cache=None):
+        self.db = db
+        self.user_id = user_id
+        self.cache = cache
+        self.ids = set()
+
+    def load(self, video_ids):
+        video_ids = list(video_ids)
+        if self.user_id is None or not video_ids:
+            return
+        if self.cache is not None:
+            known, missing, clock = self.cache.get(self.user_id, video_ids)
+        else:
+            known, missing = {}, video_ids
+        LOOKUPS.inc(('hit',), len(known))
+        if missing:
+            LOOKUPS.inc(('miss',), len(missing))
+            found = {row.video_id for row in self.db.execute(
+                queries.LIKED_AMONG, {'user_id': self.user_id, 'ids': missing})}
+            known.update((video_id, video_id in found) for video_id in missing)
+            if self.cache is not None:
+                self.cache.update(self.user_id, {video_id: known[video_id] for video_id in missing}, clock)
+        self.ids.update(video_id for video_id, is_liked in known.items() if is_liked)
+
+    def __contains__(self, video_id):
+        return video_id in self.ids
+
+
+def init_app(app):
+    """The app's LikedCache, or None when LIKED_CACHE_USERS is 0"""
+    max_users = app.config.get('LIKED_CACHE_USERS', 0)
+    return LikedCache(max_users, app.config.get('LIKED_CACHE_VIDEOS', 1000)) if max_users else None
@@ -0,0 +1,538 @@
+"""
+Live comments and like/comment counts over Server-Sent Events.
+
+    broker = live.Broker(app)
+    broker.publish(video_id, 'comment', {...})
+    broker.publish(video_id, 'counts', {'likes': 12})
+    port = broker.stream_port()       # where pages open streams; if None:
+    return broker.response([video_id])   # a stream through the WSGI server
+
+Each subscriber is a wake-up registered on the channels (videos) it
+follows; publish() only wakes that video's subscribers, so an idle
+subscriber costs nothing per publish elsewhere.
+Comments are kept in a short per-video ring; counts are a latest-value
+snapshot, so a burst of likes reaches a subscriber as one counts event.
+Counts are published with the videos.version they were read at, and a count
+older than the one held is ignored, so likes finishing out of order (or
+relayed from another process) can't roll a count back. Each
+subscriber also waits LIVE_COALESCE_SECONDS after waking before it reads.
+
+Streams are served by a Dispatcher: one thread per process that owns every
+stream's socket on LIVE_PORT and multiplexes them with a selector, so an
+idle subscriber is a socket and a few objects, not a thread, and up to
+LIVE_MAX_SUBSCRIBERS of them fit in a process. Worker processes all listen
+on the port with SO_REUSEPORT and the kernel spreads connections across
+them. Responses allow any origin, since pages are served from another port.
+If LIVE_PORT is 0 or can't be bound (or the page is HTTPS and no proxy path
+is configured), pages fall back to response(), which
+streams through the WSGI server and parks one of its threads per client;
+those are capped at LIVE_MAX_THREAD_STREAMS, well below any server's thread
+pool, and the rest get a 503.
+
+Event ids are a per-process sequence; a reconnecting EventSource sends
+Last-Event-ID and gets the comments it missed if they are still in the ring.
+
+With LIVE_SOCKET_DIR set, every worker process binds a Unix datagram socket
+in that directory and forwards what it publishes to the others, so a like
+handled by one worker reaches subscribers connected to another.
+"""
+import atexit
+import itertools
+import json
+import logging
+import os
+import selectors
+import socket
+import threading
+import time
+from collections import deque
+from urllib.parse import parse_qs, urlsplit
+
+from flask import Response
+
+import metrics
+
+logger = logging.getLogger('live')
+
+SUBSCRIBERS = metrics.Gauge('live_subscribers', 'Open live update streams')
+EVENTS = metrics.Counter('live_events_total', 'Events published to live channels', ('kind',))
+# Largest datagram a relay will send; longer comments are forwarded truncated
+MAX_DATAGRAM = 60000
+# Dispatcher: longest request head, time allowed to send it, and output a
+# slow client may fall behind by before it is dropped
+MAX_REQUEST_BYTES = 16384
+REQUEST_TIMEOUT = 10.0
+MAX_PENDING_OUTPUT = 1 << 20
+STREAM_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+
+def video_ids_from(text, limit):
+    """Distinct video IDs from "1,2,3", the last limit of them; None if malformed"""
+    try:
+        video_ids = [int(part) for part in (text or '').split(',') if part]
+    except ValueError:
+        return None
+    return list(dict.fromkeys(video_ids))[-limit:]
+
+
+def format_events(events):
+    return ''.join(f'id: {seq}\nevent: {name}\ndata: {json.dumps(data)}\n\n' for seq, name, data in events)
+
+
+class Channel:
+    __slots__ = ('comments', 'counts', 'versions', 'counts_seq', 'subscribers')
+
+    def __init__(self, ring_size):
+        self.comments = deque(maxlen=ring_size)
+        self.counts = {}
+        # count name -> version of the write it was read after
+        self.versions = {}
+        self.counts_seq = 0
+        self.subscribers = set()
+
+
+class Subscription:
+    __slots__ = ('video_ids', 'wake', 'last_seq')
+
+    def __init__(self, video_ids, last_seq, wake=None):
+        self.video_ids = video_ids
+        # Anything with set(): a threading.Event for response(), or the dispatcher's hook
+        self.wake = threading.Event() if wake is None else wake
+        self.last_seq = last_seq
+
+
+class Broker:
+    def __init__(self, app=None):
+        self.lock = threading.Lock()
+        self.channels = {}
+        self.seq = itertools.count(1)
+        self.last_seq = 0
+        self.subscriber_count = 0
+        self.thread_streams = 0
+        self.relay = None
+        self.dispatcher = None
+        SUBSCRIBERS.set_function(lambda: self.subscriber_count)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.ring_size = app.config.get('LIVE_RING_SIZE', 50)
+        self.coalesce = app.config.get('LIVE_COALESCE_SECONDS', 0.25)
+        self.heartbeat = app.config.get('LIVE_HEARTBEAT_SECONDS', 15.0)
+        self.max_subscribers = app.config.get('LIVE_MAX_SUBSCRIBERS', 1000)
+        self.max_thread_streams = app.config.get('LIVE_MAX_THREAD_STREAMS', 8)
+        self.max_videos = app.config.get('LIVE_MAX_VIDEOS', 200)
+        if app.config.get('LIVE_SOCKET_DIR'):
+            self.relay = SocketRelay(app.config['LIVE_SOCKET_DIR'], self)
+        if app.config.get('LIVE_PORT'):
+            self.dispatcher = Dispatcher(self, app.config.get('LIVE_HOST', ''), app.config['LIVE_PORT'])
+
+    def stream_port(self):
+        """Port the dispatcher serves streams on, starting it if needed; None to stream through response()"""
+        if self.dispatcher is not None and self.dispatcher.start():
+            return self.dispatcher.port
+        return None
+
+    def subscribe(self, video_ids, last_seq=None, wake=None):
+        """Subscription to video_ids, or None if the process is at LIVE_MAX_SUBSCRIBERS"""
+        if self.relay is not None:
+            self.relay.start()
+        with self.lock:
+            if self.subscriber_count >= self.max_subscribers:
+                return None
+            self.subscriber_count += 1
+            sub = Subscription(tuple(video_ids), self.last_seq if last_seq is None else last_seq, wake)
+            for video_id in sub.video_ids:
+                channel = self.channels.get(video_id)
+                if channel is None:
+                    channel = self.channels[video_id] = Channel(self.ring_size)
+                channel.subscribers.add(sub)
+        if last_seq is not None:
+            sub.wake.set()  # replay whatever the ring still holds
+        return sub
+
+    def unsubscribe(self, sub):
+        with self.lock:
+            self.subscriber_count -= 1
+            for video_id in sub.video_ids:
+                channel = self.channels.get(video_id)
+                if channel is None:
+                    continue
+                channel.subscribers.discard(sub)
+                if not channel.subscribers:
+                    del self.channels[video_id]
+
+    def publish(self, video_id, kind, data, version=None, relay=True):
+        """kind is 'comment' (appended to the ring) or 'counts' (merged into the snapshot)
+
+        version orders counts: a count read at a lower version than the one
+        held is dropped."""
+        EVENTS.inc((kind,))
+        subscribers = ()
+        with self.lock:
+            channel = self.channels.get(video_id)
+            if channel is not None and kind == 'counts' and version is not None:
+                data = {name: value for name, value in data.items()
+                        if version >= channel.versions.get(name, version)}
+                channel.versions.update(dict.fromkeys(data, version))
+            if channel is not None and data:
+                seq = self.last_seq = next(self.seq)
+                if kind == 'comment':
+                    channel.comments.append((seq, data))
+                else:
+                    channel.counts.update(data)
+                    channel.counts_seq = seq
+                subscribers = list(channel.subscribers)
+        for sub in subscribers:
+            sub.wake.set()
+        if relay and self.relay is not None:
+            self.relay.send(video_id, kind, data, version)
+
+    def collect(self, sub):
+        """(id, event, data) for everything on sub's channels it hasn't seen yet"""
+        events = []
+        with self.lock:
+            last = sub.last_seq
+            for video_id in sub.video_ids:
+                channel = self.channels.get(video_id)
+                if channel is None:
+                    continue
+                for seq, data in channel.comments:
+                    if seq > last:
+                        events.append((seq, 'comment', {'video_id': video_id, **data}))
+                if channel.counts_seq > last:
+                    events.append((channel.counts_seq, 'counts', {'video_id': video_id, **channel.counts}))
+            sub.last_seq = self.last_seq
+        events.sort(key=lambda event: event[0])
+        return events
+
+    def stream(self, sub):
+        try:
+            yield 'retry: 3000\n\n'
+            while True:
+                if not sub.wake.wait(self.heartbeat):
+                    # Also how a closed connection is noticed: the write fails
+                    yield ': keepalive\n\n'
+                    continue
+                time.sleep(self.coalesce)
+                sub.wake.clear()
+                events = self.collect(sub)
+                if events:
+                    yield format_events(events)
+        finally:
+            self.unsubscribe(sub)
+            with self.lock:
+                self.thread_streams -= 1
+
+    def response(self, video_ids, last_event_id=None):
+        """A stream served by the WSGI server's own thread, for when there is no dispatcher"""
+        with self.lock:
+            full = self.thread_streams >= self.max_thread_streams
+            if not full:
+                self.thread_streams += 1
+        sub = None if full else self.subscribe(video_ids, parse_seq(last_event_id))
+        if sub is None:
+            if not full:
+                with self.lock:
+                    self.thread_streams -= 1
+            return Response('Too many live connections\n', status=503, headers={'Retry-After': '30'})
+        return Response(self.stream(sub), mimetype='text/event-stream', headers=STREAM_HEADERS)
+
+
+def parse_seq(last_event_id):
+    try:
+        return int(last_event_id) if last_event_id else None
+    except ValueError:
+        return None
+
+
+class Connection:
+    __slots__ = ('sock', 'head', 'out', 'sub', 'due', 'deadline', 'written', 'closing')
+
+    def __init__(self, sock, now):
+        self.sock = sock
+        self.head = bytearray()
+        self.out = bytearray()
+        self.sub = None
+        # When a woken stream collects its events (after LIVE_COALESCE_SECONDS)
+        self.due = None
+        self.deadline = now + REQUEST_TIMEOUT
+        self.written = now
+        # Close once the output is flushed (error responses)
+        self.closing = False
+
+
+class Wake:
+    """Subscription.wake for a dispatcher stream: schedules a collect and pokes the selector"""
+    __slots__ = ('dispatcher', 'conn')
+
+    def __init__(self, dispatcher, conn):
+        self.dispatcher = dispatcher
+        self.conn = conn
+
+    def set(self):
+        self.dispatcher.wake(self.conn)
+
+
+class Dispatcher:
+    """Serves every live stream of this process from one thread on its own port"""
+
+    def __init__(self, broker, host, port):
+        self.broker = broker
+        self.host = host
+        self.port = port
+        self.pid = None
+        self.failed = False
+        self.start_lock = threading.Lock()
+        self.lock = threading.Lock()
+        self.woken = set()
+
+    def start(self):
+        """Listen on the port and start the thread, once per process; False if the port can't be used"""
+        if self.pid == os.getpid():
+            return not self.failed
+        with self.start_lock:
+            if self.pid == os.getpid():
+                return not self.failed
+            self.pid = os.getpid()
+            try:
+                listener = socket.create_server((self.host, self.port), backlog=128,
+                                                reuse_port=hasattr(socket, 'SO_REUSEPORT'))
+            except OSError as e:
+                logger.warning("Live streams fall back to the app server; can't listen on port %s: %s",
+                               self.port, e)
+                self.failed = True
+                return False
+            listener.setblocking(False)
+            self.waker, self.poke = socket.socketpair()
+            self.waker.setblocking(False)
+            self.poke.setblocking(False)
+            self.selector = selectors.DefaultSelector()
+            self.selector.register(listener, selectors.EVENT_READ, 'listener')
+            self.selector.register(self.waker, selectors.EVENT_READ, 'waker')
+            self.listener = listener
+            self.connections = set()
+            self.failed = False
+            threading.Thread(target=self._loop, name='live-dispatcher', daemon=True).start()
+            return True
+
+    def wake(self, conn):
+        # Called by publishing threads
+        with self.lock:
+            self.woken.add(conn)
+        try:
+            self.poke.send(b'\0')
+        except (BlockingIOError, OSError):
+            pass  # a wake-up is already pending
+
+    def _loop(self):
+        while True:
+            try:
+                self._step()
+            except Exception:
+                logger.exception("Live dispatcher step failed")
+                time.sleep(0.1)
+
+    def _step(self):
+        now = time.monotonic()
+        deadlines = [conn.due if conn.due is not None else
+                     conn.deadline if conn.sub is None else conn.written + self.broker.heartbeat
+                     for conn in self.connections]
+        timeout = max(0.0, min(deadlines, default=now + self.broker.heartbeat) - now)
+        for key, events in self.selector.select(timeout):
+            if key.data == 'listener':
+                self._accept(now)
+            elif key.data == 'waker':
+                try:
+                    while self.waker.recv(4096):
+                        pass
+                except BlockingIOError:
+                    pass
+            else:
+                conn = key.data
+                if events & selectors.EVENT_READ:
+                    self._read(conn, now)
+                if events & selectors.EVENT_WRITE and conn in self.connections:
+                    self._flush(conn)
+        with self.lock:
+            woken, self.woken = self.woken, set()
+        now = time.monotonic()
+        for conn in woken:
+            if conn in self.connections and conn.due is None:
+                conn.due = now + self.broker.coalesce
+        for conn in list(self.connections):
+            if conn.sub is None:
+                if now >= conn.deadline:
+                    self._close(conn)
+            elif conn.due is not None and now >= conn.due:
+                conn.due = None
+                events = self.broker.collect(conn.sub)
+                if events:
+                    self._send(conn, format_events(events).encode(), now)
+            elif now - conn.written >= self.broker.heartbeat:
+                self._send(conn, b': keepalive\n\n', now)
+
+    def _accept(self, now):
+        while True:
+            try:
+                sock, _ = self.listener.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                logger.warning("Live dispatcher accept failed: %s", e)
+                return
+            sock.setblocking(False)
+            conn = Connection(sock, now)
+            self.connections.add(conn)
+            self.selector.register(sock, selectors.EVENT_READ, conn)
+
+    def _read(self, conn, now):
+        try:
+            data = conn.sock.recv(4096)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self._close(conn)
+            return
+        if conn.sub is not None or conn.closing:
+            return  # nothing more is expected from a stream's client
+        conn.head += data
+        if b'\r\n\r\n' in conn.head:
+            self._open(conn, bytes(conn.head).split(b'\r\n\r\n', 1)[0], now)
+        elif len(conn.head) > MAX_REQUEST_BYTES:
+            self._fail(conn, 431, 'Request Header Fields Too Large', now)
+
+    def _open(self, conn, head, now):
+        lines = head.decode('latin-1').split('\r\n')
+        parts = lines[0].split()
+        if len(parts) != 3 or parts[0] != 'GET':
+            self._fail(conn, 405, 'Method Not Allowed', now)
+            return
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        url = urlsplit(parts[1])
+        query = parse_qs(url.query)
+        path_id = url.path.rstrip('/').rpartition('/')[2]
+        video_ids = video_ids_from(path_id if path_id.isdigit() else query.get('videos', [''])[0],
+                                   self.broker.max_videos)
+        if not video_ids:
+            self._fail(conn, 400, 'Bad Request', now)
+            return
+        last_seq = parse_seq(headers.get('last-event-id') or query.get('since', [''])[0])
+        sub = self.broker.subscribe(video_ids, last_seq, Wake(self, conn))
+        if sub is None:
+            self._fail(conn, 503, 'Service Unavailable', now, {'Retry-After': '30'})
+            return
+        conn.sub = sub
+        conn.head = None
+        self._send(conn, self._head(200, 'OK', dict(STREAM_HEADERS, **{'Content-Type': 'text/event-stream'}))
+                   + b'retry: 3000\n\n', now)
+
+    def _head(self, status, reason, headers):
+        lines = [f'HTTP/1.1 {status} {reason}', 'Access-Control-Allow-Origin: *', 'Connection: close']
+        lines += [f'{name}: {value}' for name, value in headers.items()]
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+    def _fail(self, conn, status, reason, now, headers=None):
+        body = f'{reason}\n'.encode()
+        conn.closing = True
+        self._send(conn, self._head(status, reason, dict(headers or {}, **{
+            'Content-Type': 'text/plain', 'Content-Length': str(len(body))})) + body, now)
+
+    def _send(self, conn, data, now):
+        conn.written = now
+        conn.out += data
+        if len(conn.out) > MAX_PENDING_OUTPUT:
+            self._close(conn)  # a client this far behind isn't reading
+            return
+        self._flush(conn)
+
+    def _flush(self, conn):
+        try:
+            sent = conn.sock.send(conn.out)
+        except (BlockingIOError, InterruptedError):
+            sent = 0
+        except OSError:
+            self._close(conn)
+            return
+        del conn.out[:sent]
+        if not conn.out and conn.closing:
+            self._close(conn)
+            return
+        wanted = selectors.EVENT_READ | (selectors.EVENT_WRITE if conn.out else 0)
+        if self.selector.get_key(conn.sock).events != wanted:
+            self.selector.modify(conn.sock, wanted, conn)
+
+    def _close(self, conn):
+        if conn not in self.connections:
+            return
+        self.connections.discard(conn)
+        self.selector.unregister(conn.sock)
+        conn.sock.close()
+        if conn.sub is not None:
+            self.broker.unsubscribe(conn.sub)
+
+
+class SocketRelay:
+    """Forwards published events to the other worker processes' brokers"""
+
+    def __init__(self, directory, broker):
+        self.directory = directory
+        self.broker = broker
+        self.sock = None
+        self.path = None
+        self.start_lock = threading.Lock()
+
+    def start(self):
+        # Bound on first use so forked worker processes each get their own socket
+        if self.sock is not None and self.path.endswith(f'/{os.getpid()}.sock'):
+            return
+        with self.start_lock:
+            if self.sock is not None and self.path.endswith(f'/{os.getpid()}.sock'):
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(os.path.abspath(self.directory), f'{os.getpid()}.sock')
+            if os.path.exists(path):
+                os.unlink(path)
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            sock.bind(path)
+            self.sock, self.path = sock, path
+            atexit.register(remove_socket, path)
+            threading.Thread(target=self._receive, args=(sock,), name='live-relay', daemon=True).start()
+
+    def send(self, video_id, kind, data, version=None):
+        self.start()
+        message = json.dumps({'video_id': video_id, 'kind': kind, 'data': data, 'version': version}).encode()
+        if len(message) > MAX_DATAGRAM and kind == 'comment':
+            data = dict(data, comment=data.get('comment', '')[:MAX_DATAGRAM // 8])
+            message = json.dumps({'video_id': video_id, 'kind': kind, 'data': data, 'version': version}).encode()
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith('.sock') or entry.path == self.path:
+                continue
+            try:
+                self.sock.sendto(message, entry.path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # That worker has exited
+                remove_socket(entry.path)
+            except OSError as e:
+                logger.warning("Live relay to %s failed: %s", entry.path, e)
+
+    def _receive(self, sock):
+        while True:
+            try:
+                message = json.loads(sock.recv(MAX_DATAGRAM * 2))
+                self.broker.publish(message['video_id'], message['kind'], message['data'],
+                                    message.get('version'), relay=False)
+            except Exception:
+                logger.exception("Bad live relay message")
+
+
+def remove_socket(path):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
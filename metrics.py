@@ -0,0 +1,334 @@
+"""
+In-process request and SQLite instrumentation, rendered in the Prometheus
+text exposition format by the /metrics route.
+
+Counters live in this process only; with several workers each one exposes
+its own numbers and the scraper aggregates them.
+"""
+import bisect
+import contextvars
+import sqlite3
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+
+from flask import g, request
+from flask.signals import before_render_template, template_rendered
+from sqlalchemy import event
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100, 250, 1000)
+
+# [statements, seconds, rows] for the request being served on this thread
+_request_stats = contextvars.ContextVar('request_stats', default=None)
+_statement_listeners = []
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, doc, labelnames=()):
+        self.name = name
+        self.doc = doc
+        self.labelnames = labelnames
+        self.values = {}
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _labels(self, labels, **extra):
+        pairs = [f'{k}="{_escape(v)}"' for k, v in zip(self.labelnames, labels)]
+        pairs.extend(f'{k}="{_escape(v)}"' for k, v in extra.items())
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.doc}', f'# TYPE {self.name} {self.kind}']
+        with self.lock:
+            items = sorted(self.values.items())
+            lines.extend(self._render_items(items))
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, labels=(), amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def _render_items(self, items):
+        return [f'{self.name}{self._labels(labels)} {_number(value)}' for labels, value in items]
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, doc, labelnames=()):
+        super().__init__(name, doc, labelnames)
+        self.function = None
+
+    def set(self, value, labels=()):
+        with self.lock:
+            self.values[labels] = value
+
+    def set_function(self, function):
+        """Sample an unlabelled value from function() at scrape time instead"""
+        self.function = function
+
+    def _render_items(self, items):
+        if self.function is not None:
+            items = [((), self.function())]
+        return [f'{self.name}{self._labels(labels)} {_number(value)}' for labels, value in items]
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, doc, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, doc, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, labels=()):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            state = self.values.get(labels)
+            if state is None:
+                # one slot per bucket plus +Inf, then sum
+                state = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            state[index] += 1
+            state[-1] += value
+
+    def _render_items(self, items):
+        lines = []
+        for labels, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), state):
+                cumulative += count
+                le = bound if bound == '+Inf' else _number(bound)
+                lines.append(f'{self.name}_bucket{self._labels(labels, le=le)} {cumulative}')
+            lines.append(f'{self.name}_sum{self._labels(labels)} {_number(state[-1])}')
+            lines.append(f'{self.name}_count{self._labels(labels)} {cumulative}')
+        return lines
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+REGISTRY = []
+
+REQUEST_LATENCY = Histogram('http_request_duration_seconds', 'Request latency by endpoint',
+                            ('endpoint', 'method', 'status'))
+REQUEST_STATEMENTS = Histogram('db_statements_per_request', 'SQLite statements executed per request',
+                               ('endpoint',), COUNT_BUCKETS)
+REQUEST_DB_TIME = Histogram('db_time_per_request_seconds', 'Time spent in SQLite per request', ('endpoint',))
+STATEMENTS = Counter('db_statements_total', 'SQLite statements executed', ('endpoint',))
+DB_TIME = Counter('db_time_seconds_total', 'Time spent in SQLite', ('endpoint',))
+ROWS = Counter('db_rows_returned_total', 'Rows fetched from SQLite', ('endpoint',))
+TEMPLATE_RENDER = Histogram('template_render_duration_seconds', 'Jinja render time', ('template',))
+
+
+def add_statement_listener(listener):
+    """Call listener(sql, parameters, seconds, rows, connection) as each statement finishes"""
+    _statement_listeners.append(listener)
+
+
+def request_stats():
+    """The statement counts of the request being served in this context, or None"""
+    return _request_stats.get()
+
+
+@contextmanager
+def counting_for(stats):
+    """Count statements run in the block (e.g. on another thread) against stats from request_stats()"""
+    token = _request_stats.set(stats)
+    try:
+        yield
+    finally:
+        _request_stats.reset(token)
+
+
+def _record(sql, parameters, elapsed, rows, connection):
+    stats = _request_stats.get()
+    if stats is not None:
+        stats[0] += 1
+        stats[1] += elapsed
+        stats[2] += rows
+    for listener in _statement_listeners:
+        listener(sql, parameters, elapsed, rows, connection)
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Times execute and fetch calls; reports the statement once it is consumed"""
+    _sql = None
+
+    def _start(self, sql, parameters):
+        if self._sql is not None:
+            self._finish()
+        self._sql, self._parameters, self._elapsed, self._rows = sql, parameters, 0.0, 0
+
+    def _finish(self):
+        if self._sql is not None:
+            sql, self._sql = self._sql, None
+            _record(sql, self._parameters, self._elapsed, self._rows, self.connection)
+
+    def execute(self, sql, parameters=()):
+        self._start(sql, parameters)
+        started = perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._elapsed += perf_counter() - started
+
+    def executemany(self, sql, seq_of_parameters):
+        self._start(sql, None)
+        started = perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._elapsed += perf_counter() - started
+
+    def fetchone(self):
+        started = perf_counter()
+        row = super().fetchone()
+        self._elapsed += perf_counter() - started
+        if row is None:
+            self._finish()
+        else:
+            self._rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        started = perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._elapsed += perf_counter() - started
+        self._rows += len(rows)
+        if not rows:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        started = perf_counter()
+        rows = super().fetchall()
+        self._elapsed += perf_counter() - started
+        self._rows += len(rows)
+        self._finish()
+        return rows
+
+    def __next__(self):
+        started = perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._elapsed += perf_counter() - started
+            self._finish()
+            raise
+        self._elapsed += perf_counter() - started
+        self._rows += 1
+        return row
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        self._finish()
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """sqlite3.connect(..., factory=InstrumentedConnection)"""
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        started = perf_counter()
+        try:
+            super().commit()
+        finally:
+            _record('COMMIT', (), perf_counter() - started, 0, self)
+
+
+def instrument_engine(engine):
+    """Statement metrics for drivers whose cursors can't be subclassed; times execute() only"""
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('metrics_started', []).append(perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = perf_counter() - conn.info['metrics_started'].pop()
+        _record(statement, parameters, elapsed, max(cursor.rowcount, 0), conn.connection.dbapi_connection)
+
+
+def init_app(app):
+    @app.before_request
+    def _start_request():
+        g.metrics_started = perf_counter()
+        g.metrics_token = _request_stats.set([0, 0.0, 0])
+
+    def _observe(labels, stats, started):
+        endpoint = labels[0]
+        REQUEST_LATENCY.observe(perf_counter() - started, labels)
+        REQUEST_STATEMENTS.observe(stats[0], (endpoint,))
+        REQUEST_DB_TIME.observe(stats[1], (endpoint,))
+        if stats[0]:
+            STATEMENTS.inc((endpoint,), stats[0])
+            DB_TIME.inc((endpoint,), stats[1])
+            ROWS.inc((endpoint,), stats[2])
+
+    @app.after_request
+    def _finish_request(response):
+        stats = _request_stats.get()
+        started = g.pop('metrics_started', None)
+        if stats is None or started is None:
+            return response
+        labels = (request.endpoint or 'unmatched', request.method, str(response.status_code))
+        count_header = app.config.get('QUERY_COUNT_HEADER')
+        if response.is_streamed:
+            # Streamed pages run their queries while the body is generated, after
+            # this hook; the stats list keeps counting until the response closes
+            if count_header and response.mimetype == 'text/html' and not response.direct_passthrough:
+                # Headers go out before the body, so generate it first to count it
+                response.make_sequence()
+            else:
+                response.call_on_close(lambda: _observe(labels, stats, started))
+                return response
+        _observe(labels, stats, started)
+        if count_header:
+            # bench.py reports this as queries per request
+            response.headers['X-Query-Count'] = str(stats[0])
+        return response
+
+    @app.teardown_request
+    def _reset_request(exc):
+        token = g.pop('metrics_token', None)
+        if token is not None:
+            _request_stats.reset(token)
+
+    def _template_started(sender, template, context, **extra):
+        g.setdefault('metrics_templates', []).append(perf_counter())
+
+    def _template_finished(sender, template, context, **extra):
+        starts = g.get('metrics_templates')
+        if starts:
+            TEMPLATE_RENDER.observe(perf_counter() - starts.pop(), (template.name or 'string',))
+
+    before_render_template.connect(_template_started, app, weak=False)
+    template_rendered.connect(_template_finished, app, weak=False)
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,452 @@
+"""
+Local copies of videos submitted by URL.
+
+    mirrors = mirror.Mirror(app, writer)
+    mirrors.submit(video_id, url)     # after the video row exists
+    mirrors.start()                   # queue remote videos, resume unfinished ones
+    mirrors.resume()                  # start() on a background thread, once per process
+
+Each video is streamed in MIRROR_CHUNK_BYTES reads to <MIRROR_FOLDER>/mirror-<id>.<ext>.partial,
+then renamed into place. videos.url is switched to the local file (and the
+version bumped) only if it still points at the source. MP4s are then packaged
+for HLS like uploads. Progress is the partial file itself: a retry, or a
+restart that finds the row still 'pending' in video_mirrors, asks for the
+rest with Range plus If-Range on the stored ETag (or Last-Modified), so a
+changed source starts over instead of splicing two files.
+
+Every app process calls resume() on its first request, so under a WSGI
+server with several workers each of them resumes the same rows. A download
+first takes a lock on byte <video id> of <MIRROR_FOLDER>/.mirror.lock and
+rechecks that the row is still pending, so each video is fetched by one
+process at a time and a finished one is not fetched again.
+
+Concurrency is bounded twice: MIRROR_WORKERS downloads in total and at most
+MIRROR_PER_HOST against one host. Connections are kept per host and reused
+by the next download there. Failures are retried with exponential backoff up
+to MIRROR_ATTEMPTS; 4xx answers, oversized files and non-video content fail
+straight away. Sources resolving to loopback or private addresses are refused
+unless MIRROR_ALLOW_PRIVATE is set (e.g. to test against a local server).
+
+    python mirror.py run        # mirror every remote video, then exit
+"""
+import argparse
+import http.client
+import ipaddress
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait
+from urllib.parse import urljoin, urlsplit
+
+from flask import Flask
+
+try:
+    import fcntl
+except ImportError:  # Windows: a single dev server process, nothing to share with
+    fcntl = None
+
+import database
+import dbwriter
+import fmp4
+import metrics
+import queries
+
+logger = logging.getLogger('mirror')
+
+MAX_REDIRECTS = 5
+VIDEO_EXTENSIONS = {'mp4', 'webm', 'ogg'}
+ACCEPTED_TYPES = ('video/', 'application/octet-stream', 'binary/octet-stream')
+
+JOBS = metrics.Counter('mirror_jobs_total', 'Video mirror jobs finished', ('result',))
+BYTES = metrics.Counter('mirror_bytes_total', 'Bytes downloaded by video mirrors')
+ATTEMPTS = metrics.Counter('mirror_attempts_total', 'Download attempts by video mirrors', ('result',))
+ACTIVE = metrics.Gauge('mirror_active', 'Video mirrors downloading now')
+
+
+class MirrorError(Exception):
+    """A download failure that retrying won't fix"""
+
+
+class HostPool:
+    """Idle HTTP connections and a concurrency limit per (scheme, host, port)"""
+
+    def __init__(self, per_host=2, timeout=30.0):
+        self.per_host = per_host
+        self.timeout = timeout
+        self.idle = defaultdict(list)
+        self.slots = {}
+        self.lock = threading.Lock()
+
+    def slot(self, key):
+        with self.lock:
+            if key not in self.slots:
+                self.slots[key] = threading.BoundedSemaphore(self.per_host)
+            return self.slots[key]
+
+    def get(self, key, reuse=True):
+        """(connection, whether it was reused)"""
+        with self.lock:
+            if reuse and self.idle[key]:
+                return self.idle[key].pop(), True
+        scheme, host, port = key
+        factory = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+        return factory(host, port, timeout=self.timeout), False
+
+    def put(self, key, conn):
+        with self.lock:
+            if len(self.idle[key]) < self.per_host:
+                self.idle[key].append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self.lock:
+            for conns in self.idle.values():
+                for conn in conns:
+                    conn.close()
+            self.idle.clear()
+
+
+def host_key(url):
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        raise MirrorError(f'Not an http(s) URL: {url}')
+    return parts.scheme, parts.hostname, parts.port or (443 if parts.scheme == 'https' else 80)
+
+
+def check_address(host, port, allow_private=False):
+    """MirrorError if host resolves to an address the server shouldn't fetch from"""
+    if allow_private:
+        return
+    try:
+        infos = socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP)
+    except socket.gaierror as e:
+        raise OSError(f'Cannot resolve {host}: {e}') from e
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0].split('%')[0])
+        if not address.is_global:
+            raise MirrorError(f'{host} resolves to non-public address {address}')
+
+
+def extension_for(url):
+    name = urlsplit(url).path.rsplit('/', 1)[-1]
+    ext = name.rsplit('.', 1)[-1].lower() if '.' in name else ''
+    return ext if ext in VIDEO_EXTENSIONS else 'mp4'
+
+
+def validator(response):
+    """Value for If-Range; weak ETags may not be used there, so fall back to Last-Modified"""
+    etag = response.getheader('ETag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return response.getheader('Last-Modified')
+
+
+class Transfer:
+    """One video's download; etag survives failed attempts so the next one can use If-Range"""
+
+    def __init__(self, url, partial, etag=None):
+        self.url = url
+        self.partial = partial
+        self.etag = etag
+        self.size = None
+
+
+def request(pool, key, path, headers):
+    """Send a GET on a pooled connection, retrying once on a fresh one if an idle connection went stale"""
+    conn, reused = pool.get(key)
+    while True:
+        try:
+            conn.request('GET', path, headers=headers)
+            return conn, conn.getresponse()
+        except (ConnectionError, http.client.RemoteDisconnected, http.client.CannotSendRequest):
+            conn.close()
+            if not reused:
+                raise
+            conn, reused = pool.get(key, reuse=False)
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            raise
+
+
+def download(transfer, pool, max_bytes=None, chunk_bytes=1 << 20, allow_private=False):
+    """Fetch transfer.url into transfer.partial, continuing from its current size"""
+    url, partial, etag = transfer.url, transfer.partial, transfer.etag
+    for _ in range(MAX_REDIRECTS + 1):
+        key = host_key(url)
+        check_address(key[1], key[2], allow_private)
+        parts = urlsplit(url)
+        offset = os.path.getsize(partial) if os.path.exists(partial) else 0
+        headers = {'User-Agent': 'zeshare-mirror', 'Accept-Encoding': 'identity'}
+        if offset:
+            headers['Range'] = f'bytes={offset}-'
+            if etag:
+                headers['If-Range'] = etag
+        conn, response = request(pool, key, (parts.path or '/') + (f'?{parts.query}' if parts.query else ''),
+                                 headers)
+        try:
+            if response.status in (301, 302, 303, 307, 308) and response.getheader('Location'):
+                response.read()
+                url = urljoin(url, response.getheader('Location'))
+                continue
+            if response.status == 416 and offset:
+                # The partial file may already hold everything
+                response.read()
+                total = response.getheader('Content-Range', '').rpartition('/')[2]
+                if total.isdigit() and int(total) == offset:
+                    transfer.size = offset
+                    return transfer
+                os.remove(partial)
+                transfer.etag = None
+                raise OSError('Partial download is longer than the source; starting over')
+            if response.status >= 400:
+                message = f'HTTP {response.status} from {url}'
+                if response.status in (408, 429) or response.status >= 500:
+                    raise OSError(message)
+                raise MirrorError(message)
+            if response.status == 206:
+                start = response.getheader('Content-Range', '').partition(' ')[2].partition('-')[0]
+                if start != str(offset):
+                    raise OSError(f'Asked for bytes from {offset}, got {response.getheader("Content-Range")}')
+                mode = 'ab'
+            elif response.status == 200:
+                offset, mode = 0, 'wb'
+            else:
+                raise MirrorError(f'Unexpected HTTP {response.status} from {url}')
+            content_type = response.getheader('Content-Type', 'application/octet-stream').lower()
+            if not content_type.startswith(ACCEPTED_TYPES):
+                raise MirrorError(f'{url} is {content_type}, not a video')
+            length = response.getheader('Content-Length')
+            expected = offset + int(length) if length and length.isdigit() else None
+            if max_bytes and expected and expected > max_bytes:
+                raise MirrorError(f'{url} is {expected} bytes, over the {max_bytes} byte limit')
+            transfer.etag = etag = validator(response) or (etag if response.status == 206 else None)
+            size = offset
+            with open(partial, mode) as f:
+                while True:
+                    chunk = response.read(chunk_bytes)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                    size += len(chunk)
+                    BYTES.inc(amount=len(chunk))
+                    if max_bytes and size > max_bytes:
+                        raise MirrorError(f'{url} is over the {max_bytes} byte limit')
+            if expected is not None and size < expected:
+                raise OSError(f'Connection closed after {size} of {expected} bytes')
+            transfer.size = size
+            return transfer
+        finally:
+            if response.isclosed() and not response.will_close:
+                pool.put(key, conn)
+            else:
+                conn.close()
+    raise MirrorError(f'Too many redirects from {url}')
+
+
+# Write operations, run on the writer thread
+
+def queue_mirror(db, video_id, source_url):
+    db.execute(queries.QUEUE_MIRROR, {'video_id': video_id, 'source_url': source_url})
+
+
+def update_mirror(db, video_id, status, etag=None, size=None, attempts=0, error=None):
+    db.execute(queries.UPDATE_MIRROR, {'video_id': video_id, 'status': status, 'etag': etag,
+                                       'size': size, 'attempts': attempts, 'error': error})
+
+
+def use_mirror(db, video_id, source_url, url, etag, size, attempts):
+    """Point the video at its local copy; False if its URL was changed meanwhile"""
+    update_mirror(db, video_id, 'done', etag, size, attempts)
+    return db.execute(queries.USE_MIRROR, {'id': video_id, 'url': url, 'source_url': source_url}).rowcount > 0
+
+
+class Mirror:
+    def __init__(self, app=None, writer=None):
+        self.writer = writer
+        self.pool = None
+        self.futures = {}
+        self.lock = threading.Lock()
+        self.active = 0
+        self.resumed_pid = None
+        self.claims = None
+        ACTIVE.set_function(lambda: self.active)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.folder = app.config.get('MIRROR_FOLDER', app.config.get('UPLOAD_FOLDER', 'static/uploads'))
+        self.hls_folder = app.config.get('HLS_FOLDER')
+        self.hls_segment_seconds = app.config.get('HLS_SEGMENT_SECONDS', 2.0)
+        self.attempts = app.config.get('MIRROR_ATTEMPTS', 5)
+        self.backoff = app.config.get('MIRROR_BACKOFF_SECONDS', 2.0)
+        self.max_bytes = app.config.get('MIRROR_MAX_BYTES', 2 * 1024 ** 3)
+        self.chunk_bytes = app.config.get('MIRROR_CHUNK_BYTES', 1 << 20)
+        self.allow_private = app.config.get('MIRROR_ALLOW_PRIVATE', False)
+        self.hosts = HostPool(app.config.get('MIRROR_PER_HOST', 2), app.config.get('MIRROR_TIMEOUT', 30.0))
+        self.pool = ThreadPoolExecutor(max_workers=app.config.get('MIRROR_WORKERS', 2),
+                                       thread_name_prefix='mirror')
+        os.makedirs(self.folder, exist_ok=True)
+        if fcntl is not None:
+            # Record locks belong to the process, so forked workers can share the descriptor
+            self.claims = os.open(os.path.join(self.folder, '.mirror.lock'), os.O_RDWR | os.O_CREAT, 0o644)
+
+    def submit(self, video_id, source_url):
+        """Record and queue a mirror of source_url for video_id"""
+        self.writer.run(queue_mirror, video_id, source_url)
+        return self._queue(video_id, source_url)
+
+    def start(self):
+        """Queue every remote video without a mirror, then every unfinished one; returns their futures"""
+        with database.engine.connect() as db:
+            remote = db.execute(queries.REMOTE_VIDEOS).fetchall()
+        for video in remote:
+            self.writer.run(queue_mirror, video.id, video.url)
+        with database.engine.connect() as db:
+            pending = db.execute(queries.PENDING_MIRRORS).fetchall()
+        return [self._queue(row.video_id, row.source_url, row.etag) for row in pending]
+
+    def resume(self):
+        """Run start() on a background thread, once per process"""
+        pid = os.getpid()
+        if self.resumed_pid == pid:
+            return
+        with self.lock:
+            if self.resumed_pid == pid:
+                return
+            self.resumed_pid = pid
+        threading.Thread(target=self._resume, name='mirror-resume', daemon=True).start()
+
+    def _resume(self):
+        try:
+            self.start()
+        except Exception:
+            logger.exception("Could not resume video mirrors")
+
+    def _queue(self, video_id, source_url, etag=None):
+        with self.lock:
+            future = self.futures.get(video_id)
+            if future is None or future.done():
+                future = self.futures[video_id] = self.pool.submit(self._run, video_id, source_url, etag)
+            return future
+
+    def _count_active(self, delta):
+        with self.lock:
+            self.active += delta
+
+    def partial_path(self, video_id, source_url):
+        return os.path.join(self.folder, f'mirror-{video_id}.{extension_for(source_url)}.partial')
+
+    def _claim(self, video_id):
+        """Lock video_id against other processes; False if one of them holds it"""
+        if self.claims is None:
+            return True
+        try:
+            fcntl.lockf(self.claims, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, video_id)
+        except OSError:
+            return False
+        return True
+
+    def _release(self, video_id):
+        if self.claims is not None:
+            fcntl.lockf(self.claims, fcntl.LOCK_UN, 1, video_id)
+
+    def _run(self, video_id, source_url, etag=None):
+        if not self._claim(video_id):
+            logger.info("Video %s is being mirrored by another process", video_id)
+            return None
+        try:
+            # Another process may have finished it since this one read the row
+            with database.engine.connect() as db:
+                row = db.execute(queries.MIRROR_BY_VIDEO, {'video_id': video_id}).first()
+            if row is None or row.status != 'pending' or row.source_url != source_url:
+                return None
+            return self._mirror(video_id, source_url, etag)
+        finally:
+            self._release(video_id)
+
+    def _mirror(self, video_id, source_url, etag=None):
+        transfer = Transfer(source_url, self.partial_path(video_id, source_url), etag)
+        partial = transfer.partial
+        error = None
+        attempt = 0
+        try:
+            key = host_key(source_url)
+            for attempt in range(1, self.attempts + 1):
+                try:
+                    with self.hosts.slot(key):
+                        self._count_active(1)
+                        try:
+                            download(transfer, self.hosts, self.max_bytes, self.chunk_bytes, self.allow_private)
+                        finally:
+                            self._count_active(-1)
+                    ATTEMPTS.inc(('done',))
+                    break
+                except (OSError, http.client.HTTPException) as e:
+                    ATTEMPTS.inc(('retry',))
+                    error = str(e) or type(e).__name__
+                    logger.warning("Mirror of video %s, attempt %s: %s", video_id, attempt, error)
+                    self.writer.run(update_mirror, video_id, 'pending', transfer.etag, None, attempt, error)
+                    if attempt < self.attempts:
+                        time.sleep(self.backoff * 2 ** (attempt - 1))
+            else:
+                # Left 'pending' with its partial file, so the next start() resumes it
+                JOBS.inc(('gave_up',))
+                return None
+        except MirrorError as e:
+            logger.warning("Mirror of video %s failed: %s", video_id, e)
+            self.writer.run(update_mirror, video_id, 'failed', transfer.etag, None, attempt, str(e))
+            if os.path.exists(partial):
+                os.remove(partial)
+            JOBS.inc(('failed',))
+            return None
+
+        final = partial[:-len('.partial')]
+        os.replace(partial, final)
+        url = '/' + final.replace(os.sep, '/')
+        if not self.writer.run(use_mirror, video_id, source_url, url, transfer.etag, transfer.size, attempt):
+            logger.info("Video %s changed URL while being mirrored; dropping the copy", video_id)
+            os.remove(final)
+            JOBS.inc(('stale',))
+            return None
+        JOBS.inc(('done',))
+        logger.info("Mirrored video %s (%s bytes) to %s", video_id, transfer.size, url)
+        if self.hls_folder and final.endswith('.mp4'):
+            fmp4.package_upload(final, self.hls_folder, self.hls_segment_seconds)
+        return url
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Copy URL-submitted videos into local storage.")
+    parser.add_argument('--database-url', default=os.environ.get(
+        'DATABASE_URL', f"sqlite:///{os.environ.get('VIDEOAPP_DB', 'videoapp.db')}"))
+    parser.add_argument('--folder', default='static/uploads')
+    parser.add_argument('--hls-folder', default='static/hls')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--allow-private', action='store_true',
+                        help='allow sources on loopback/private addresses')
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('run', help='mirror every remote video and resume unfinished ones')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    database.engine = database.create(args.database_url)
+    database.migrate(database.engine)
+    writer = dbwriter.Writer(database.engine.connect)
+
+    app = Flask(__name__)
+    app.config.update(MIRROR_FOLDER=args.folder, HLS_FOLDER=args.hls_folder,
+                      MIRROR_WORKERS=args.workers, MIRROR_ALLOW_PRIVATE=args.allow_private)
+    mirrors = Mirror(app, writer)
+    futures = mirrors.start()
+    wait(futures)
+    done = sum(1 for future in futures if future.result())
+    print(f"Mirrored {done} of {len(futures)} videos", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
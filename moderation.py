@@ -0,0 +1,296 @@
+"""
+Blocked-term filter for comments.
+
+    comment_filter = moderation.CommentFilter(app)
+    term = comment_filter.blocked(text)      # the first blocked term found, or None
+
+Terms are read from COMMENT_FILTER_TERMS, one per line; blank lines and lines
+starting with # are ignored. A term matches whole words: "darn" blocks "darn
+it" but not "darned". A * at either end lets it match inside a word, so
+"darn*" also blocks "darned".
+
+Both the terms and each comment are normalized the same way before matching:
+NFKD with accents and zero-width characters removed, casefolded, common
+Cyrillic/Greek lookalikes mapped to Latin letters, and leetspeak folded
+(0→o, 1→i, 3→e, 4→a, 5→s, 7→t, 8→b, 9→g, @→a, $→s, and !, | and + when
+followed by a letter). Everything else that isn't a letter or digit becomes a
+single space, which is also how word boundaries are matched: a whole-word
+term is compiled with a space at each end.
+
+All terms are compiled into one Aho-Corasick automaton, so a comment is
+scanned once, character by character, however many terms there are. The file
+is checked for changes at most every COMMENT_FILTER_RELOAD_SECONDS; a changed
+file is compiled on a background thread and swapped in when ready, so
+requests keep using the previous automaton meanwhile and never wait for a
+build.
+"""
+import argparse
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import unicodedata
+from array import array
+from collections import deque
+
+import metrics
+
+logger = logging.getLogger('moderation')
+
+LEET = {'0': 'o', '1': 'i', '3': 'e', '4': 'a', '5': 's', '7': 't', '8': 'b', '9': 'g', '@': 'a', '$': 's'}
+# Only letters when they sit before one; otherwise they are punctuation ("wow!")
+LEET_BEFORE_LETTER = {'!': 'i', '|': 'i', '+': 't'}
+# Cyrillic and Greek letters that look like Latin ones and survive NFKD
+LOOKALIKES = {'а': 'a', 'в': 'b', 'е': 'e', 'к': 'k', 'м': 'm', 'н': 'h', 'о': 'o', 'р': 'p', 'с': 'c',
+              'т': 't', 'у': 'y', 'х': 'x', 'і': 'i', 'ј': 'j', 'ѕ': 's', 'ԁ': 'd', 'ɡ': 'g',
+              'α': 'a', 'β': 'b', 'ε': 'e', 'η': 'n', 'ι': 'i', 'κ': 'k', 'ν': 'v', 'ο': 'o', 'ρ': 'p',
+              'τ': 't', 'υ': 'u', 'χ': 'x'}
+FOLD = str.maketrans({**LEET, **LOOKALIKES})
+# The whole fold for ASCII text in one table: lowercase, leetspeak, punctuation to spaces
+ASCII_FOLD = str.maketrans({chr(i): LEET.get(chr(i).lower(), chr(i).lower() if chr(i).isalnum() else ' ')
+                            for i in range(128)})
+LEET_SYMBOL = re.compile(r'[!|+](?=[^\W\d_])')
+NON_WORD = re.compile(r'[\W_]+')
+
+CHECKS = metrics.Counter('comment_filter_checks_total', 'Comments checked against blocked terms', ('result',))
+TERMS = metrics.Gauge('comment_filter_terms', 'Blocked terms in the loaded automaton')
+BUILD = metrics.Histogram('comment_filter_build_seconds', 'Time to compile the blocked-term automaton',
+                          buckets=(0.01, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0))
+
+
+def normalize(text):
+    """Text as terms are matched against: folded, single-spaced, with a space at each end"""
+    text = LEET_SYMBOL.sub(lambda m: LEET_BEFORE_LETTER[m.group()], text)
+    if text.isascii():
+        return f" {' '.join(text.translate(ASCII_FOLD).split())} "
+    text = ''.join(c for c in unicodedata.normalize('NFKD', text)
+                   if not unicodedata.combining(c) and unicodedata.category(c) != 'Cf')
+    return f' {NON_WORD.sub(" ", text.casefold().translate(FOLD)).strip()} '
+
+
+def pattern(term):
+    """The string a term is compiled to, or None if nothing is left of it after normalizing"""
+    term = term.strip()
+    prefix, suffix = term.endswith('*'), term.startswith('*')
+    core = normalize(term.strip('*')).strip()
+    if not core:
+        return None
+    return f"{'' if suffix else ' '}{core}{'' if prefix else ' '}"
+
+
+class Codes(dict):
+    """Character -> alphabet code table for str.translate; characters in no term map to 0"""
+
+    def __missing__(self, char):
+        return 0
+
+
+class Automaton:
+    """Aho-Corasick automaton over a set of terms, stored as a double-array trie
+
+    Characters are first mapped to small codes (1..alphabet size). A state is
+    an index into four arrays: the child of state s for code c is
+    t = base[s] + c when check[t] == s; fail[s] is the state for the longest
+    proper suffix of s's string that is also in the trie; out[s] is the index
+    of a term ending at s or at any state on its fail chain, or -1. Flat int
+    arrays keep 100k terms to a few MB, where a dict per state would take
+    over 100 MB."""
+
+    def __init__(self, terms):
+        compiled = {}
+        for term in terms:
+            key = pattern(term)
+            if key is not None:
+                compiled.setdefault(key, term.strip())
+        self.terms = list(compiled.values())
+        index = {key: i for i, key in enumerate(compiled)}
+        patterns = sorted(compiled)
+        alphabet = sorted({char for key in patterns for char in key})
+        self.codes = Codes((ord(char), code) for code, char in enumerate(alphabet, 1))
+        self.wide = len(alphabet) > 255
+        base, check, fail, out = [0], [-2], [0], [-1]
+        free = 1  # no slot below this is free
+        queue = deque([(0, 0, len(patterns), 0)])
+        while queue:
+            state, lo, hi, depth = queue.popleft()
+            if lo < hi and len(patterns[lo]) == depth:
+                out[state] = index[patterns[lo]]
+                lo += 1
+            elif state:
+                out[state] = out[fail[state]]
+            children = []
+            while lo < hi:
+                char = patterns[lo][depth]
+                end = lo + 1
+                while end < hi and patterns[end][depth] == char:
+                    end += 1
+                children.append((self.codes[ord(char)], lo, end))
+                lo = end
+            if not children:
+                continue
+            codes = [code for code, _, _ in children]
+            while free < len(check) and check[free] != -1:
+                free += 1
+            # Most states have one child and fill the lowest free slot. States with
+            # more start near the end of the arrays, where slots are mostly free;
+            # the gaps they leave behind fill up with single children
+            slot = free if len(codes) == 1 else max(free, len(check) - len(self.codes))
+            while True:
+                offset = slot - codes[0]
+                if offset >= 0 and all(offset + code >= len(check) or check[offset + code] == -1
+                                       for code in codes):
+                    break
+                slot += 1
+            grow = offset + codes[-1] + 1 - len(check)
+            if grow > 0:
+                base.extend([0] * grow)
+                check.extend([-1] * grow)
+                fail.extend([0] * grow)
+                out.extend([-1] * grow)
+            base[state] = offset
+            for code, child_lo, child_hi in children:
+                child = offset + code
+                check[child] = state
+                back = fail[state]
+                while state:
+                    target = base[back] + code
+                    if target < len(check) and check[target] == back:
+                        fail[child] = target
+                        break
+                    if not back:
+                        break
+                    back = fail[back]
+                queue.append((child, child_lo, child_hi, depth + 1))
+        # Room for base[s] + c of every state and code without a bounds check
+        pad = len(alphabet) + 1
+        self.base = array('i', base + [0] * pad)
+        self.check = array('i', check + [-1] * pad)
+        self.fail = array('i', fail + [0] * pad)
+        self.out = array('i', out + [-1] * pad)
+        self.states = len(check) - check.count(-1)
+
+    def __len__(self):
+        return len(self.terms)
+
+    def encode(self, text):
+        """Alphabet codes of normalized text, as a sequence of ints"""
+        coded = text.translate(self.codes)
+        if self.wide:
+            return memoryview(coded.encode('utf-32-le')).cast('I')
+        return coded.encode('latin-1')
+
+    def search(self, text):
+        """Index of the first term found in normalized text, or -1"""
+        base, check, fail, out = self.base, self.check, self.fail, self.out
+        state = 0
+        for code in self.encode(text):
+            target = base[state] + code
+            if check[target] != state:
+                while state:
+                    state = fail[state]
+                    target = base[state] + code
+                    if check[target] == state:
+                        break
+                else:
+                    target = base[0] + code
+                    if check[target]:
+                        continue
+            state = target
+            if out[state] != -1:
+                return out[state]
+        return -1
+
+    def find(self, text):
+        """The first term text contains, or None"""
+        index = self.search(normalize(text))
+        return None if index == -1 else self.terms[index]
+
+
+def read_terms(path):
+    with open(path, encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith('#')]
+
+
+class CommentFilter:
+    def __init__(self, app=None):
+        self.automaton = Automaton(())
+        self.stamp = None
+        self.next_check = 0.0
+        self.loading = threading.Lock()
+        TERMS.set_function(lambda: len(self.automaton))
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.path = app.config.get('COMMENT_FILTER_TERMS', 'blocked_terms.txt')
+        self.interval = app.config.get('COMMENT_FILTER_RELOAD_SECONDS', 5.0)
+        # The first load is waited for, so no comment gets through unfiltered at startup
+        stamp = self._stamp()
+        if stamp is not None:
+            with self.loading:
+                self._load(stamp)
+
+    def _stamp(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+    def _load(self, stamp):
+        started = time.perf_counter()
+        try:
+            terms = read_terms(self.path) if stamp is not None else ()
+            automaton = Automaton(terms)
+        except (OSError, UnicodeDecodeError) as e:
+            logger.warning("Keeping the previous blocked terms; %s could not be read: %s", self.path, e)
+            return
+        finally:
+            BUILD.observe(time.perf_counter() - started)
+        self.automaton, self.stamp = automaton, stamp
+        logger.info("Loaded %d blocked terms (%d states) from %s in %.2fs", len(automaton),
+                    automaton.states, self.path, time.perf_counter() - started)
+
+    def _reload(self, stamp):
+        try:
+            self._load(stamp)
+        finally:
+            self.loading.release()
+
+    def check_file(self):
+        """Start compiling the terms file on a background thread if it changed"""
+        stamp = self._stamp()
+        if stamp != self.stamp and self.loading.acquire(blocking=False):
+            threading.Thread(target=self._reload, args=(stamp,), name='comment-filter', daemon=True).start()
+
+    def blocked(self, text):
+        """The first blocked term in text, or None"""
+        now = time.monotonic()
+        if now >= self.next_check:
+            self.next_check = now + self.interval
+            self.check_file()
+        term = self.automaton.find(text)
+        CHECKS.inc(('blocked' if term else 'clean',))
+        return term
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check text against the blocked terms file.")
+    parser.add_argument('--terms', default=os.environ.get('COMMENT_FILTER_TERMS', 'blocked_terms.txt'))
+    parser.add_argument('text', nargs='*', help='text to check (default: each line of stdin)')
+    args = parser.parse_args()
+
+    automaton = Automaton(read_terms(args.terms))
+    blocked = 0
+    for line in [' '.join(args.text)] if args.text else sys.stdin:
+        term = automaton.find(line)
+        if term:
+            blocked += 1
+            print(f'{term}\t{line.strip()}')
+    sys.exit(1 if blocked else 0)
+
+
+if __name__ == '__main__':
+    main()
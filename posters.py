@@ -0,0 +1,225 @@
+"""
+Poster images for video cards.
+
+    posters = posters.Posters(app, writer)
+    posters.submit(video_id, title, data)     # data is the uploaded image, or None
+    posters.srcset(video['poster'], 'webp')
+
+Cards show a poster instead of a live <video>, so a grid costs a few small
+images rather than dozens of players. A job decodes the creator's image (or
+draws a placeholder from the title when there is none) and writes WebP and
+JPEG renditions at each of POSTER_WIDTHS to POSTER_FOLDER, named by the sha1
+of the source bytes. It then sets videos.poster to that hash and bumps the
+video's version, so cached cards re-render with the new image. The same
+source image is only ever rendered once; renditions that already exist are
+reused. Sources narrower than a width are not upscaled, and that width's
+file holds the source size instead.
+
+Jobs run on a small thread pool and are not persisted; videos left without a
+poster (older rows, or a restart mid-job) get placeholders from
+
+    python posters.py backfill
+"""
+import argparse
+import hashlib
+import io
+import logging
+import os
+import sys
+import textwrap
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+from PIL import Image, ImageDraw, ImageFont, ImageOps
+
+import database
+import metrics
+import queries
+
+logger = logging.getLogger('posters')
+
+WIDTHS = (320, 640, 1280)
+# Poster aspect ratio; sources are centre-cropped to it
+ASPECT = 16 / 9
+FORMATS = {'webp': ('WEBP', {'quality': 80, 'method': 4}),
+           'jpg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True})}
+MAX_BYTES = 10 * 1024 * 1024
+MAX_PIXELS = 40_000_000
+# Placeholder gradient, matching the site background
+PLACEHOLDER_COLORS = ('#ff6a88', '#00ddeb')
+
+RENDERS = metrics.Counter('poster_renders_total', 'Poster jobs finished', ('source', 'result'))
+DURATION = metrics.Histogram('poster_render_seconds', 'Time to render one poster\'s renditions',
+                             buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+
+
+class PosterError(ValueError):
+    pass
+
+
+def digest(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+def filename(poster, width, fmt):
+    return f'{poster}-{width}.{fmt}'
+
+
+def check(data):
+    """Open data as an image without decoding it; PosterError if it can't be used"""
+    if len(data) > MAX_BYTES:
+        raise PosterError('Poster image is too large')
+    try:
+        image = Image.open(io.BytesIO(data))
+    except (OSError, Image.DecompressionBombError) as e:
+        raise PosterError('Poster is not a supported image') from e
+    if image.width * image.height > MAX_PIXELS:
+        raise PosterError('Poster image has too many pixels')
+    return image
+
+
+def open_image(data, size=None):
+    """Decoded RGB image from uploaded bytes
+
+    With size, JPEGs are decoded at the smallest scale still covering it."""
+    image = check(data)
+    try:
+        if size:
+            image.draft('RGB', size)
+        return ImageOps.exif_transpose(image).convert('RGB')
+    except OSError as e:
+        raise PosterError('Poster image could not be decoded') from e
+
+
+def placeholder(title, width=WIDTHS[-1]):
+    """PNG bytes of a gradient card with the title on it; the same title always gives the same bytes"""
+    height = round(width / ASPECT)
+    start, end = (Image.new('RGB', (width, height), color) for color in PLACEHOLDER_COLORS)
+    vertical = Image.linear_gradient('L')
+    mask = Image.blend(vertical, vertical.rotate(90), 0.5).resize((width, height))
+    image = Image.composite(end, start, mask)
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.load_default(size=height // 10)
+    lines = textwrap.wrap(title, width=28)[:3] or ['']
+    draw.multiline_text((width / 2, height / 2), '\n'.join(lines), font=font, fill='white',
+                        anchor='mm', align='center', spacing=height // 40)
+    out = io.BytesIO()
+    image.save(out, 'PNG')
+    return out.getvalue()
+
+
+def render(data, folder, widths=WIDTHS):
+    """Write every rendition of the image in data that doesn't exist yet; returns its hash"""
+    poster = digest(data)
+    missing = [(width, fmt) for width in widths for fmt in FORMATS
+               if not os.path.exists(os.path.join(folder, filename(poster, width, fmt)))]
+    if not missing:
+        return poster
+    source = open_image(data, (widths[-1], round(widths[-1] / ASPECT)))
+    # Largest centred 16:9 crop, at the source's resolution
+    if source.width / source.height > ASPECT:
+        size = (round(source.height * ASPECT), source.height)
+    else:
+        size = (source.width, round(source.width / ASPECT))
+    crop = ImageOps.fit(source, size)
+    os.makedirs(folder, exist_ok=True)
+    for width in sorted({width for width, _ in missing}, reverse=True):
+        if width < crop.width:
+            image = crop.resize((width, round(width / ASPECT)), Image.Resampling.LANCZOS)
+        else:
+            image = crop
+        for fmt in FORMATS:
+            if (width, fmt) not in missing:
+                continue
+            kind, options = FORMATS[fmt]
+            path = os.path.join(folder, filename(poster, width, fmt))
+            partial = f'{path}.{threading.get_ident()}.partial'
+            image.save(partial, kind, **options)
+            os.replace(partial, path)
+    return poster
+
+
+def set_poster(db, video_id, poster):
+    """Writer operation: point video_id at its poster renditions"""
+    db.execute(queries.SET_VIDEO_POSTER, {'id': video_id, 'poster': poster})
+    db.execute(queries.BUMP_VIDEO_VERSION, {'id': video_id})
+
+
+class Posters:
+    def __init__(self, app=None, writer=None):
+        self.writer = writer
+        self.pool = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.folder = app.config.get('POSTER_FOLDER', 'static/posters')
+        self.url_prefix = app.config.get('POSTER_URL', '/static/posters')
+        self.widths = tuple(sorted(app.config.get('POSTER_WIDTHS', WIDTHS)))
+        self.pool = ThreadPoolExecutor(max_workers=app.config.get('POSTER_WORKERS', 1),
+                                       thread_name_prefix='poster')
+        os.makedirs(self.folder, exist_ok=True)
+
+    def submit(self, video_id, title, data=None):
+        """Queue renditions of data (or a placeholder for title) for video_id"""
+        return self.pool.submit(self._run, video_id, title, data)
+
+    def _run(self, video_id, title, data):
+        source = 'upload' if data else 'placeholder'
+        started = perf_counter()
+        try:
+            if data:
+                try:
+                    poster = render(data, self.folder, self.widths)
+                except PosterError as e:
+                    logger.warning("Poster for video %s unusable, using a placeholder: %s", video_id, e)
+                    source = 'placeholder'
+                    data = None
+            if not data:
+                poster = render(placeholder(title, self.widths[-1]), self.folder, self.widths)
+            self.writer.run(set_poster, video_id, poster)
+            RENDERS.inc((source, 'done'))
+            return poster
+        except Exception:
+            logger.exception("Poster for video %s failed", video_id)
+            RENDERS.inc((source, 'failed'))
+        finally:
+            DURATION.observe(perf_counter() - started)
+
+    def url(self, poster, width=None, fmt='jpg'):
+        """URL of one rendition; the widest by default"""
+        return f'{self.url_prefix}/{filename(poster, width or self.widths[-1], fmt)}'
+
+    def srcset(self, poster, fmt='jpg'):
+        return ', '.join(f'{self.url(poster, width, fmt)} {width}w' for width in self.widths)
+
+
+def backfill(bind, folder, widths=WIDTHS):
+    """Placeholder posters for every video without one; returns how many were set"""
+    with bind.connect() as conn:
+        videos = conn.execute(queries.VIDEOS_WITHOUT_POSTER).fetchall()
+    for video in videos:
+        poster = render(placeholder(video.title, widths[-1]), folder, widths)
+        with bind.begin() as conn:
+            set_poster(conn, video.id, poster)
+    return len(videos)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain video poster renditions.")
+    parser.add_argument('--database-url', default=os.environ.get(
+        'DATABASE_URL', f"sqlite:///{os.environ.get('VIDEOAPP_DB', 'videoapp.db')}"))
+    parser.add_argument('--folder', default='static/posters')
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('backfill', help='generate placeholder posters for videos without one')
+    args = parser.parse_args()
+
+    engine = database.create(args.database_url)
+    database.migrate(engine)
+    count = backfill(engine, args.folder)
+    print(f"Set placeholder posters on {count} videos", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
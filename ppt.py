@@ -1,163 +1,466 @@
+import argparse
+import contextlib
+import glob
+import hashlib
+import io
+import json
 import os
 import re
-from bs4 import BeautifulSoup
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import lxml.html
+from PIL import Image
 from pptx import Presentation
 from pptx.util import Inches, Pt
 from pptx.dml.color import RGBColor
 from pptx.enum.text import PP_ALIGN, MSO_ANCHOR
 from pptx.enum.shapes import MSO_SHAPE
 
-def html_to_pptx_converter(html_file_path, output_pptx_path, image_folder='images'):
+def html_to_pptx_converter(html_file_path, output_pptx_path, image_folder='images', workers=None,
+                           incremental=True, image_dpi=None, timings=None):
     """
     Convert the HTML diabetes presentation to PPTX format with improved styling
+
+    With incremental=True, slides whose HTML and images are unchanged since the
+    last conversion (per the manifest beside the output) are kept from the
+    previous output; only new or edited slides are extracted and rendered.
+    With incremental=False no slide keys are computed and no manifest is
+    written, so the next incremental run starts from scratch.
+    The output is written to a temporary file and moved into place.
+
+    Chart images are downsampled to image_dpi (default IMAGE_DPI) at their
+    size on the slide before being embedded.
+
+    If timings is a dict, the seconds spent in the extract, build and save
+    phases are stored in it (see bench_ppt.py).
     """
-    # Read and parse HTML
-    with open(html_file_path, 'r', encoding='utf-8') as file:
-        html_content = file.read()
-    
-    soup = BeautifulSoup(html_content, 'html.parser')
-    
-    # Create presentation
-    prs = Presentation()
-    prs.slide_width = Inches(13.33)  # Widescreen for better layout
-    prs.slide_height = Inches(7.5)
-    
-    # Define slide layouts
-    title_slide_layout = prs.slide_layouts[0]
-    content_slide_layout = prs.slide_layouts[1]
-    blank_slide_layout = prs.slide_layouts[5]
-    
-    # Extract all slides
-    slides_data = extract_slides_data(soup)
-    
-    # Process each slide
-    for i, slide_data in enumerate(slides_data):
-        if i == 0:  # Title slide
-            slide = prs.slides.add_slide(title_slide_layout)
-            create_title_slide(slide, slide_data)
-        else:  # Content slides
-            slide = prs.slides.add_slide(blank_slide_layout)  # Use blank for custom layout
-            create_content_slide(slide, slide_data, image_folder)
-        
+    image_dpi = image_dpi or IMAGE_DPI
+    with _phase(timings, 'extract'):
+        # Read and parse HTML
+        with open(html_file_path, 'r', encoding='utf-8') as file:
+            html_content = file.read()
+        slide_elems = parse_slides(html_content)
+        total = len(slide_elems)
+        manifest_path = output_pptx_path + MANIFEST_SUFFIX
+        if incremental:
+            keys = [slide_cache_key(elem, i == 0, image_folder, image_dpi) for i, elem in enumerate(slide_elems)]
+            prs, previous = load_previous_output(output_pptx_path, manifest_path)
+        else:
+            keys, prs, previous = None, None, {}
+        if prs is None:
+            # Create presentation
+            prs = Presentation()
+            prs.slide_width = Inches(13.33)  # Widescreen for better layout
+            prs.slide_height = Inches(7.5)
+
+        # Reuse previous slides by key; everything else is extracted and rendered
+        old_slides = list(prs.slides)
+        reused = {}
+        for i, key in enumerate(keys or ()):
+            if previous.get(key):
+                reused[i] = old_slides[previous[key].pop(0)]
+        changed = [i for i in range(total) if i not in reused]
+        slides_data = extract_slide_elements([slide_elems[i] for i in changed], workers)
+
+    with _phase(timings, 'build'):
+        images = [chart_image_path(placeholder, image_folder)
+                  for i, slide_data in zip(changed, slides_data) if i != 0
+                  for placeholder in slide_data['chart_placeholders']]
+        prepare_images([path for path in images if os.path.exists(path)], image_dpi, workers)
+
+        # Define slide layouts
+        title_slide_layout = prs.slide_layouts[0]
+        content_slide_layout = prs.slide_layouts[1]
+        blank_slide_layout = prs.slide_layouts[5]
+
+        # Process each changed slide
+        ordered = dict(reused)
+        for i, slide_data in zip(changed, slides_data):
+            if i == 0:  # Title slide
+                slide = prs.slides.add_slide(title_slide_layout)
+                create_title_slide(slide, slide_data)
+            else:  # Content slides
+                slide = prs.slides.add_slide(blank_slide_layout)  # Use blank for custom layout
+                create_content_slide(slide, slide_data, image_folder, image_dpi)
+            ordered[i] = slide
+
+        keep = {id(slide) for slide in ordered.values()}
+        for slide in old_slides:
+            if id(slide) not in keep:
+                delete_slide(prs, slide)
+        reorder_slides(prs, [ordered[i] for i in range(total)])
+
         # Add slide counter
-        add_slide_counter(slide, i + 1, len(slides_data))
-    
-    # Save presentation
-    prs.save(output_pptx_path)
+        for i in range(total):
+            set_slide_counter(ordered[i], i + 1, total)
+
+    with _phase(timings, 'save'):
+        # Save presentation
+        partial = output_pptx_path + '.partial.pptx'
+        try:
+            prs.save(partial)
+            os.replace(partial, output_pptx_path)
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+        if keys is not None:
+            write_manifest(manifest_path, output_pptx_path, keys)
+        elif os.path.exists(manifest_path):
+            os.remove(manifest_path)
+    if incremental and reused:
+        print(f"♻️ Reused {len(reused)} of {total} slides from the previous output")
     print(f"✅ PPTX saved as: {output_pptx_path}")
     print("📝 Note: Gradients, animations, and rounded corners may need manual adjustment in PowerPoint.")
+    return total
 
-def extract_slides_data(soup):
-    """Extract structured data from each slide"""
-    slides = soup.find_all('div', class_='slide')
-    slides_data = []
-    
+@contextlib.contextmanager
+def _phase(timings, name):
+    if timings is None:
+        yield
+        return
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+    started = time.perf_counter()
+    yield
+    timings[name] = time.perf_counter() - started
+    if tracemalloc.is_tracing():
+        timings[name + '_peak_bytes'] = tracemalloc.get_traced_memory()[1]
+
+# Incremental rebuilds
+#
+# The manifest lists one key per slide of the output it sits next to. A key
+# hashes the slide's whitespace-normalized HTML, whether it is the title
+# slide, the bytes of every chart image it references and this file's own
+# source, so editing the converter invalidates everything. Image digests are
+# memoized by path, mtime and size, so a chart used on many slides is read once.
+
+MANIFEST_SUFFIX = '.manifest.json'
+with open(__file__, 'rb') as _source:
+    RENDERER_HASH = hashlib.sha1(_source.read()).hexdigest()
+CHART_PLACEHOLDER_XPATH = ".//div[contains(concat(' ', normalize-space(@class), ' '), ' chart-placeholder ')]"
+
+def chart_image_path(placeholder, image_folder):
+    img_name = re.sub(r'[\[\]]', '', placeholder).replace(' ', '_').replace('-', '_') + '.png'
+    return os.path.join(image_folder, img_name)
+
+# Chart images
+#
+# Charts are embedded CHART_WIDTH wide, so anything beyond CHART_WIDTH at
+# IMAGE_DPI is wasted bytes in the .pptx and wasted time in prs.save. Each
+# image is resized to that width (never enlarged) and recompressed once, then
+# kept in IMAGE_CACHE_DIR inside the image folder under its content hash and
+# target width, so later runs and other decks reuse it.
+
+CHART_WIDTH = Inches(9)
+IMAGE_DPI = 150
+IMAGE_CACHE_DIR = '.prepared'
+JPEG_QUALITY = 85
+PARALLEL_MIN_IMAGES = 8
+_prepared = {}
+_image_digests = {}
+
+def prepare_image(path, dpi=None):
+    """Path of a copy of the image sized for CHART_WIDTH at dpi, creating it if needed"""
+    dpi = dpi or IMAGE_DPI
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size, dpi)
+    if memo_key in _prepared:
+        return _prepared[memo_key]
+
+    with open(path, 'rb') as f:
+        data = f.read()
+    target_width = round(CHART_WIDTH.inches * dpi)
+    with Image.open(io.BytesIO(data)) as img:
+        fmt = 'JPEG' if img.format == 'JPEG' else 'PNG'
+        cache_dir = os.path.join(os.path.dirname(path), IMAGE_CACHE_DIR)
+        cached = os.path.join(cache_dir, f"{hashlib.sha1(data).hexdigest()}-{target_width}w.{fmt.lower().replace('jpeg', 'jpg')}")
+        if not os.path.exists(cached):
+            # Flat-colour charts stay palette PNGs; resampling would otherwise add thousands of edge shades
+            few_colors = fmt == 'PNG' and img.getcolors(256) is not None
+            if img.width > target_width:
+                height = max(1, round(img.height * target_width / img.width))
+                img.draft(img.mode, (target_width, height))  # cheap DCT downscale for JPEGs
+                out = img.resize((target_width, height), Image.Resampling.LANCZOS)
+            else:
+                out = img.copy()
+            if fmt == 'JPEG':
+                out = out.convert('RGB')
+                options = {'quality': JPEG_QUALITY, 'optimize': True, 'progressive': True}
+            else:
+                if few_colors:
+                    out = out.convert('RGBA').quantize(256, method=Image.Quantize.FASTOCTREE)
+                options = {'optimize': True}
+            os.makedirs(cache_dir, exist_ok=True)
+            partial = f"{cached}.{os.getpid()}.partial"
+            out.save(partial, fmt, dpi=(dpi, dpi), **options)
+            # Keep the original bytes if recompressing didn't make them any smaller
+            if os.path.getsize(partial) >= len(data):
+                with open(partial, 'wb') as f:
+                    f.write(data)
+            os.replace(partial, cached)
+    _prepared[memo_key] = cached
+    return cached
+
+def prepare_images(paths, dpi=None, workers=None):
+    """Prepare many images, in worker processes when there are enough to be worth it"""
+    paths = sorted(set(paths))
+    if workers is None:
+        workers = default_workers()
+    if workers <= 1 or len(paths) < PARALLEL_MIN_IMAGES:
+        return {path: prepare_image(path, dpi) for path in paths}
+    with ProcessPoolExecutor(max_workers=min(workers, len(paths))) as pool:
+        prepared = dict(zip(paths, pool.map(prepare_image, paths, [dpi] * len(paths))))
+    for path, cached in prepared.items():
+        stat = os.stat(path)
+        _prepared[(os.path.abspath(path), stat.st_mtime_ns, stat.st_size, dpi or IMAGE_DPI)] = cached
+    return prepared
+
+def slide_cache_key(slide, is_title, image_folder, image_dpi=None):
+    digest = hashlib.sha1(RENDERER_HASH.encode())
+    digest.update(str(image_dpi or IMAGE_DPI).encode())
+    digest.update(b'title' if is_title else b'content')
+    html = lxml.html.tostring(slide, encoding='unicode', with_tail=False)
+    digest.update(re.sub(r'\s+', ' ', html).encode())
+    if not is_title:
+        for placeholder in slide.xpath(CHART_PLACEHOLDER_XPATH):
+            path = chart_image_path(_text(placeholder), image_folder)
+            digest.update(path.encode())
+            image = image_digest(path)
+            if image is not None:
+                digest.update(image)
+    return digest.hexdigest()
+
+def image_digest(path):
+    """SHA-1 of the file's bytes, or None if it doesn't exist"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    memo_key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    if memo_key not in _image_digests:
+        with open(path, 'rb') as f:
+            _image_digests[memo_key] = hashlib.sha1(f.read()).digest()
+    return _image_digests[memo_key]
+
+def load_previous_output(output_path, manifest_path):
+    """(presentation, {key: [slide indexes]}) from the last run, or (None, {}) if it can't be trusted"""
+    try:
+        with open(manifest_path, encoding='utf-8') as f:
+            manifest = json.load(f)
+        stat = os.stat(output_path)
+    except (OSError, ValueError):
+        return None, {}
+    # The output was edited or replaced since the manifest was written
+    if manifest.get('renderer') != RENDERER_HASH or manifest.get('output') != [stat.st_size, stat.st_mtime_ns]:
+        return None, {}
+    prs = Presentation(output_path)
+    if len(prs.slides) != len(manifest['slides']):
+        return None, {}
+    previous = {}
+    for index, key in enumerate(manifest['slides']):
+        previous.setdefault(key, []).append(index)
+    return prs, previous
+
+def write_manifest(manifest_path, output_path, keys):
+    stat = os.stat(output_path)
+    manifest = {'renderer': RENDERER_HASH, 'output': [stat.st_size, stat.st_mtime_ns], 'slides': keys}
+    with open(manifest_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+def delete_slide(prs, slide):
+    slide_ids = prs.slides._sldIdLst
+    for slide_id in list(slide_ids):
+        if prs.part.related_part(slide_id.rId) is slide.part:
+            prs.part.drop_rel(slide_id.rId)
+            slide_ids.remove(slide_id)
+            return
+
+def reorder_slides(prs, slides):
+    slide_ids = prs.slides._sldIdLst
+    by_part = {prs.part.related_part(slide_id.rId): slide_id for slide_id in slide_ids}
+    for slide_id in list(slide_ids):
+        slide_ids.remove(slide_id)
     for slide in slides:
-        slide_info = {
-            'title': '',
-            'content': [],
-            'stats': [],
-            'tables': [],
-            'bullet_points': [],
-            'highlight_boxes': [],
-            'algorithm_grid': [],
-            'feature_bars': [],
-            'chart_placeholders': []
-        }
-        
-        # Extract title
-        title_elem = slide.find(['h1', 'h2'])
-        if title_elem:
-            slide_info['title'] = title_elem.get_text().strip()
-        
-        # Extract statistics cards
-        stat_cards = slide.find_all('div', class_='stat-card')
-        for card in stat_cards:
-            number = card.find('span', class_='stat-number')
-            label = card.find('span', class_='stat-label')
-            if number and label:
-                slide_info['stats'].append({
-                    'number': number.get_text().strip(),
-                    'label': label.get_text().strip()
-                })
-        
-        # Extract bullet points
-        bullet_lists = slide.find_all('ul', class_='bullet-points')
-        for ul in bullet_lists:
-            points = [li.get_text().strip() for li in ul.find_all('li')]
-            slide_info['bullet_points'].extend(points)
-        
-        # Extract tables
-        tables = slide.find_all('table', class_='performance-table')
-        for table in tables:
-            table_data = extract_table_data(table)
-            slide_info['tables'].append(table_data)
-        
-        # Extract highlight boxes
-        highlight_boxes = slide.find_all('div', class_='highlight-box')
-        for box in highlight_boxes:
-            text = box.get_text().strip()
-            if text:
-                slide_info['highlight_boxes'].append(text)
-        
-        # Extract algorithm grid
-        algo_grids = slide.find_all('div', class_='algorithm-grid')
-        for grid in algo_grids:
-            cards = grid.find_all('div', class_='algorithm-card')
-            for card in cards:
-                title = card.find('h4').get_text().strip() if card.find('h4') else ''
-                text = card.find('p').get_text().strip() if card.find('p') else ''
-                slide_info['algorithm_grid'].append({'title': title, 'text': text})
-        
-        # Extract feature importance bars
-        feature_bars = slide.find_all('div', class_='feature-bar')
-        for bar in feature_bars:
-            name = bar.find('span', class_='feature-name')
-            value = bar.find('div', class_='bar-fill')
-            if name and value:
-                width_match = re.search(r'width:\s*(\d+)%', value.get('style', ''))
-                width = int(width_match.group(1)) if width_match else 0
-                slide_info['feature_bars'].append({
-                    'name': name.get_text().strip(),
-                    'value': value.get_text().strip(),
-                    'width': width
-                })
-        
-        # Extract chart placeholders
-        chart_placeholders = slide.find_all('div', class_='chart-placeholder')
-        for placeholder in chart_placeholders:
-            slide_info['chart_placeholders'].append(placeholder.get_text().strip())
-        
-        # Extract regular paragraphs
-        paragraphs = slide.find_all('p')
-        for p in paragraphs:
-            if not p.find_parent(['div'], class_=['stat-card', 'highlight-box', 'algorithm-card']):
-                text = p.get_text().strip()
+        slide_ids.append(by_part[slide.part])
+    # Renumber slideN.xml so the next incremental run can't reuse a partname
+    prs.part.rename_slide_parts([slide_id.rId for slide_id in slide_ids])
+
+# Slides per worker task; below PARALLEL_MIN_SLIDES extraction stays in-process
+EXTRACT_CHUNK_SLIDES = 50
+PARALLEL_MIN_SLIDES = 200
+
+SLIDE_XPATH = "//div[contains(concat(' ', normalize-space(@class), ' '), ' slide ')]"
+# <p> inside these is part of the card, not body text
+CARD_CLASSES = {'stat-card', 'highlight-box', 'algorithm-card'}
+
+def parse_slides(html_content):
+    return lxml.html.fromstring(html_content).xpath(SLIDE_XPATH)
+
+def extract_slides_data(html_content, workers=None):
+    """Extract structured data from each slide
+
+    Slides are parsed once with lxml and each one is classified in a single
+    walk of its subtree. Large decks are split across worker processes;
+    workers=None picks a pool size from the CPU count, workers=1 keeps it in-process.
+    """
+    return extract_slide_elements(parse_slides(html_content), workers)
+
+def extract_slide_elements(slides, workers=None):
+    if workers is None:
+        workers = default_workers()
+    if workers <= 1 or len(slides) < PARALLEL_MIN_SLIDES:
+        return [extract_slide_data(slide) for slide in slides]
+
+    chunks = [
+        [lxml.html.tostring(slide, encoding='unicode') for slide in slides[i:i + EXTRACT_CHUNK_SLIDES]]
+        for i in range(0, len(slides), EXTRACT_CHUNK_SLIDES)
+    ]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return [info for chunk in pool.map(_extract_chunk, chunks) for info in chunk]
+
+def default_workers():
+    """CPUs this process may run on"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # not available on Windows or macOS
+        return os.cpu_count() or 1
+
+def _extract_chunk(slide_htmls):
+    return [extract_slide_data(lxml.html.fragment_fromstring(html)) for html in slide_htmls]
+
+_ASCII_SPACES = str.maketrans('', '', ' \n\t\f\r')
+
+def _text(elem):
+    # Matches BeautifulSoup's get_text(), which collapses whitespace-only strings to one character
+    parts = []
+    for piece in elem.itertext():
+        if not piece.translate(_ASCII_SPACES):
+            piece = '\n' if '\n' in piece else ' '
+        parts.append(piece)
+    return ''.join(parts).strip()
+
+def extract_slide_data(slide):
+    """Classify one slide's subtree into the slide_info buckets in a single walk"""
+    slide_info = {
+        'title': '',
+        'content': [],
+        'stats': [],
+        'tables': [],
+        'bullet_points': [],
+        'highlight_boxes': [],
+        'algorithm_grid': [],
+        'feature_bars': [],
+        'chart_placeholders': []
+    }
+    stats = []
+    bars = []
+    title = None
+
+    # (element, in_card, open stat-card, open feature-bar, open algorithm-card, inside algorithm-grid)
+    in_card = any(set(a.get('class', '').split()) & CARD_CLASSES for a in slide.iterancestors('div'))
+    stack = [(slide, in_card, None, None, None, False)]
+    while stack:
+        elem, in_card, stat, bar, card, in_grid = stack.pop()
+        tag = elem.tag
+        if not isinstance(tag, str):
+            continue  # comments and processing instructions
+        classes = (elem.get('class') or '').split()
+
+        if title is None and tag in ('h1', 'h2'):
+            title = _text(elem)
+        if tag == 'div' and classes:
+            if 'stat-card' in classes:
+                stat = {'number': None, 'label': None}
+                stats.append(stat)
+            if 'highlight-box' in classes:
+                text = _text(elem)
+                if text:
+                    slide_info['highlight_boxes'].append(text)
+            if 'algorithm-grid' in classes:
+                in_grid = True
+            if 'algorithm-card' in classes and in_grid:
+                card = {'title': None, 'text': None}
+                slide_info['algorithm_grid'].append(card)
+            if 'feature-bar' in classes:
+                bar = {'name': None, 'value': None, 'width': 0}
+                bars.append(bar)
+            if 'bar-fill' in classes and bar is not None and bar['value'] is None:
+                bar['value'] = _text(elem)
+                width_match = re.search(r'width:\s*(\d+)%', elem.get('style', ''))
+                bar['width'] = int(width_match.group(1)) if width_match else 0
+            if 'chart-placeholder' in classes:
+                slide_info['chart_placeholders'].append(_text(elem))
+            if not in_card and CARD_CLASSES.intersection(classes):
+                in_card = True
+        elif tag == 'span' and classes:
+            if stat is not None:
+                if 'stat-number' in classes and stat['number'] is None:
+                    stat['number'] = _text(elem)
+                if 'stat-label' in classes and stat['label'] is None:
+                    stat['label'] = _text(elem)
+            if bar is not None and 'feature-name' in classes and bar['name'] is None:
+                bar['name'] = _text(elem)
+        elif tag == 'ul' and 'bullet-points' in classes:
+            slide_info['bullet_points'].extend(_text(li) for li in elem.iter('li'))
+        elif tag == 'table' and 'performance-table' in classes:
+            slide_info['tables'].append(extract_table_data(elem))
+        elif tag == 'p':
+            if not in_card:
+                text = _text(elem)
                 if text:
                     slide_info['content'].append(text)
-        
-        slides_data.append(slide_info)
-    
-    return slides_data
+            if card is not None and card['text'] is None:
+                card['text'] = _text(elem)
+        elif tag == 'h4' and card is not None and card['title'] is None:
+            card['title'] = _text(elem)
+
+        # Children in reverse so they pop off the stack in document order
+        for child in reversed(elem):
+            stack.append((child, in_card, stat, bar, card, in_grid))
+
+    slide_info['title'] = title or ''
+    slide_info['stats'] = [s for s in stats if s['number'] is not None and s['label'] is not None]
+    slide_info['feature_bars'] = [b for b in bars if b['name'] is not None and b['value'] is not None]
+    for card in slide_info['algorithm_grid']:
+        card['title'] = card['title'] or ''
+        card['text'] = card['text'] or ''
+    return slide_info
 
 def extract_table_data(table):
     """Extract table data as structured format"""
     headers = []
     rows = []
     
-    thead = table.find('thead')
-    if thead:
-        header_row = thead.find('tr')
-        headers = [th.get_text().strip() for th in header_row.find_all('th')]
-    
-    tbody = table.find('tbody') or table
-    for tr in tbody.find_all('tr'):
-        row_data = [td.get_text().strip() for td in tr.find_all(['td', 'th'])]
+    thead = next(table.iter('thead'), None)
+    if thead is not None:
+        header_row = next(thead.iter('tr'), None)
+        if header_row is not None:
+            headers = [_text(th) for th in header_row.iter('th')]
+    
+    tbody = next(table.iter('tbody'), None)
+    if tbody is None:
+        tbody = table
+    for tr in tbody.iter('tr'):
+        row_data = [_text(td) for td in tr.iter('td', 'th')]
         if row_data:
             rows.append(row_data)
     
     return {'headers': headers, 'rows': rows}
 
+COUNTER_SHAPE_NAME = 'Slide Counter'
+
+def set_slide_counter(slide, current, total):
+    """Add the slide counter, or update the one on a reused slide"""
+    for shape in slide.shapes:
+        if shape.name == COUNTER_SHAPE_NAME:
+            shape.text_frame.paragraphs[0].runs[0].text = f"{current} / {total}"
+            return
+    add_slide_counter(slide, current, total)
+
 def add_slide_counter(slide, current, total):
     """Add slide counter to top-right corner"""
     left = Inches(12)
@@ -168,6 +471,7 @@ def add_slide_counter(slide, current, total):
     counter_shape = slide.shapes.add_shape(
         MSO_SHAPE.RECTANGLE, left, top, width, height
     )
+    counter_shape.name = COUNTER_SHAPE_NAME
     counter_shape.fill.solid()
     counter_shape.fill.fore_color.rgb = RGBColor(0, 0, 0)
     counter_shape.fill.fore_color.brightness = -0.3  # Semi-transparent black
@@ -223,7 +527,7 @@ def create_title_slide(slide, slide_data):
         p.font.color.rgb = RGBColor(51, 51, 51)
         p.alignment = PP_ALIGN.CENTER
 
-def create_content_slide(slide, slide_data, image_folder):
+def create_content_slide(slide, slide_data, image_folder, image_dpi=None):
     """Create content slides with improved styling"""
     # Add title
     title_shape = slide.shapes.add_textbox(Inches(0.5), Inches(0.5), Inches(12), Inches(1))
@@ -243,10 +547,9 @@ def create_content_slide(slide, slide_data, image_folder):
     # Add chart placeholders as images
     if slide_data['chart_placeholders']:
         for placeholder in slide_data['chart_placeholders']:
-            img_name = re.sub(r'[\[\]]', '', placeholder).replace(' ', '_').replace('-', '_') + '.png'
-            img_path = os.path.join(image_folder, img_name)
+            img_path = chart_image_path(placeholder, image_folder)
             if os.path.exists(img_path):
-                pic = slide.shapes.add_picture(img_path, Inches(2), top, width=Inches(9))
+                pic = slide.shapes.add_picture(prepare_image(img_path, image_dpi), Inches(2), top, width=CHART_WIDTH)
                 top += Inches(3.5)
             else:
                 print(f"⚠️ Image not found: {img_path}")
@@ -473,30 +776,155 @@ def add_table_to_slide(slide, table_data, top):
     
     return top + height + Inches(0.3)
 
+DEFAULT_INPUT = "index.html"
+DEFAULT_OUTPUT = "Machine_Learning_Diabetes_Prediction.pptx"
+
+def find_decks(patterns):
+    """Expand files, globs and directories (their *.html) into a sorted list of decks"""
+    decks = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            decks.update(glob.glob(os.path.join(pattern, '*.html')))
+        elif glob.has_magic(pattern):
+            decks.update(glob.glob(pattern, recursive=True))
+        else:
+            decks.add(pattern)
+    # ./a/deck.html and a/deck.html are one deck
+    return sorted({os.path.normpath(deck) for deck in decks})
+
+def output_path_for(deck, output_dir=None):
+    stem = os.path.splitext(os.path.basename(deck))[0]
+    return os.path.join(output_dir or os.path.dirname(deck), stem + '.pptx')
+
+def output_paths(decks, output_dir=None):
+    """{deck: output}; under output_dir each deck keeps its folder below the decks' common parent"""
+    if not output_dir or not decks:
+        return {deck: output_path_for(deck) for deck in decks}
+    folders = {deck: os.path.dirname(os.path.abspath(deck)) for deck in decks}
+    base = os.path.commonpath(list(folders.values()))
+    return {deck: os.path.normpath(output_path_for(deck, os.path.join(output_dir, os.path.relpath(folder, base))))
+            for deck, folder in folders.items()}
+
+def shared_outputs(jobs):
+    """{output: decks} for outputs more than one deck would write"""
+    writers = {}
+    for deck, output in jobs:
+        writers.setdefault(os.path.normcase(os.path.abspath(output)), []).append(deck)
+    return {output: decks for output, decks in writers.items() if len(decks) > 1}
+
+def is_up_to_date(deck, output):
+    return os.path.exists(output) and os.path.getmtime(output) >= os.path.getmtime(deck)
+
+def prepare_image_folder(image_folder, dpi, jobs):
+    paths = [path for path in glob.glob(os.path.join(image_folder, '*'))
+             if path.lower().endswith(('.png', '.jpg', '.jpeg'))]
+    if not paths:
+        print(f"❌ No images in {image_folder}")
+        return 1
+    started = time.perf_counter()
+    prepared = prepare_images(paths, dpi, jobs)
+    before = sum(os.path.getsize(path) for path in prepared)
+    after = sum(os.path.getsize(cached) for cached in prepared.values())
+    print(f"✅ Prepared {len(prepared)} images at {dpi} dpi in {time.perf_counter() - started:.2f}s: "
+          f"{before / 1e6:.1f} MB -> {after / 1e6:.1f} MB")
+    return 0
+
+def convert_deck(deck, output, image_folder, incremental=True, image_dpi=None):
+    """Pool task: convert one deck
+
+    Returns (status, seconds, slides, error, warnings); the converter's own
+    chatter is captured so parallel decks don't interleave on the terminal.
+    """
+    started = time.perf_counter()
+    log = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(log):
+            slides = html_to_pptx_converter(deck, output, image_folder, workers=1, incremental=incremental,
+                                            image_dpi=image_dpi)
+        status, error = 'converted', None
+    except Exception as e:
+        status, slides, error = 'failed', 0, f"{type(e).__name__}: {e}"
+    warnings = [line for line in log.getvalue().splitlines() if line.startswith(('⚠️', '♻️'))]
+    return status, time.perf_counter() - started, slides, error, warnings
+
 def main():
     """Main function to run the converter"""
+    parser = argparse.ArgumentParser(description="Convert HTML slide decks to PPTX.")
+    parser.add_argument('inputs', nargs='*', help=f"HTML files, globs or directories (default: {DEFAULT_INPUT})")
+    parser.add_argument('-o', '--output-dir', help="write decks here instead of next to each input")
+    parser.add_argument('-i', '--images', default='images', help="folder with chart placeholder images")
+    parser.add_argument('-j', '--jobs', type=int, default=default_workers(), help="decks converted at once")
+    parser.add_argument('-f', '--force', action='store_true', help="convert even if the output is newer than the input")
+    parser.add_argument('--full', action='store_true', help="re-render every slide instead of reusing unchanged ones")
+    parser.add_argument('--dpi', type=int, default=IMAGE_DPI, help="resolution chart images are downsampled to")
+    parser.add_argument('--prepare-images', action='store_true',
+                        help="only downsample everything in the image folder into its cache, then exit")
+    args = parser.parse_args()
+
     print("🔄 HTML to PPTX Converter for Diabetes Presentation")
     print("=" * 50)
-    
-    html_file = "index.html"
-    output_file = "Machine_Learning_Diabetes_Prediction.pptx"
-    image_folder = "images"
-    
-    if not os.path.exists(html_file):
-        print(f"❌ HTML file not found: {html_file}")
-        return
-    
-    if not os.path.exists(image_folder):
-        print(f"⚠️ Image folder not found: {image_folder}. Creating it.")
-        os.makedirs(image_folder)
-    
-    try:
-        html_to_pptx_converter(html_file, output_file, image_folder)
-        print(f"✅ Successfully converted to: {output_file}")
-    except Exception as e:
-        print(f"❌ Error during conversion: {str(e)}")
+
+    if args.prepare_images:
+        return prepare_image_folder(args.images, args.dpi, args.jobs)
+
+    if args.inputs:
+        decks = find_decks(args.inputs)
+        jobs = list(output_paths(decks, args.output_dir).items())
+    else:
+        jobs = [(DEFAULT_INPUT, os.path.join(args.output_dir or '', DEFAULT_OUTPUT))]
+
+    missing = [deck for deck, _ in jobs if not os.path.exists(deck)]
+    for deck in missing:
+        print(f"❌ HTML file not found: {deck}")
+    jobs = [(deck, output) for deck, output in jobs if deck not in missing]
+    if not jobs:
+        return 1
+    # Two decks writing one .pptx would overwrite each other's output and .partial.pptx
+    clashes = shared_outputs(jobs)
+    for output, decks in clashes.items():
+        print(f"❌ {' and '.join(decks)} would both be written to {output}; rename one of them")
+    if clashes:
+        return 1
+
+    if not os.path.exists(args.images):
+        print(f"⚠️ Image folder not found: {args.images}. Creating it.")
+        os.makedirs(args.images)
+    for folder in {os.path.dirname(output) for _, output in jobs}:
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+    results = {}
+    pending = []
+    for deck, output in jobs:
+        if not args.force and is_up_to_date(deck, output):
+            results[deck] = ('skipped', 0.0, None, None, [])
+        else:
+            pending.append((deck, output))
+
+    started = time.perf_counter()
+    if len(pending) == 1 or args.jobs <= 1:
+        for deck, output in pending:
+            results[deck] = convert_deck(deck, output, args.images, not args.full, args.dpi)
+    elif pending:
+        with ProcessPoolExecutor(max_workers=min(args.jobs, len(pending))) as pool:
+            futures = {pool.submit(convert_deck, deck, output, args.images, not args.full, args.dpi): deck for deck, output in pending}
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+    elapsed = time.perf_counter() - started
+
+    width = max(len(deck) for deck, _ in jobs)
+    for deck, output in jobs:
+        status, seconds, slides, error, warnings = results[deck]
+        mark = {'converted': '✅', 'skipped': '⏭️', 'failed': '❌'}[status]
+        detail = f"{slides} slides" if slides is not None else "up to date"
+        print(f"{mark} {deck:<{width}}  {status:<9} {seconds:7.2f}s  {detail if not error else error}")
+        if status == 'converted':
+            print(f"   → {output}")
+        for warning in warnings:
+            print(f"   {warning}")
+    counts = {status: sum(1 for r in results.values() if r[0] == status) for status in ('converted', 'skipped', 'failed')}
+    print(f"{counts['converted']} converted, {counts['skipped']} skipped, {counts['failed']} failed in {elapsed:.2f}s")
+    return 1 if counts['failed'] else 0
 
 if __name__ == "__main__":
-    print("Installing required packages...")
-    os.system("pip install python-pptx beautifulsoup4 lxml")
-    main()
\ No newline at end of file
+    sys.exit(main())
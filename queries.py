@@ -0,0 +1,189 @@
+"""
+Every SQL statement the app runs, written once for SQLite and PostgreSQL.
+
+Statements take :named parameters, which SQLAlchemy binds in each driver's
+own style, and stick to syntax both backends accept (INSERT ... ON CONFLICT
+DO NOTHING rather than INSERT OR IGNORE). They are module-level text()
+constructs so each is compiled once per dialect and then served from
+SQLAlchemy's statement cache.
+
+Statements behind streamed pages set stream_results, so PostgreSQL reads them
+through a server-side cursor instead of buffering every row; sqlite3 always
+steps rows lazily.
+"""
+from sqlalchemy import bindparam, text
+
+# Users
+
+INSERT_USER = text(
+    'INSERT INTO users (username, password, role) VALUES (:username, :password, :role)'
+)
+USER_ID_BY_NAME = text('SELECT id FROM users WHERE username = :username')
+USER_BY_LOGIN = text('SELECT * FROM users WHERE username = :username AND password = :password')
+
+# Videos
+
+COUNT_VIDEOS = text('SELECT COUNT(*) FROM videos')
+INSERT_VIDEO = text(
+    'INSERT INTO videos (title, publisher, producer, genre, age_rating, url, uploaded_by) '
+    'VALUES (:title, :publisher, :producer, :genre, :age_rating, :url, :uploaded_by)'
+)
+INSERT_VIDEO_RETURNING_ID = text(INSERT_VIDEO.text + ' RETURNING id')
+VIDEO_BY_ID = text('SELECT * FROM videos WHERE id = :id')
+VIDEO_EXISTS = text('SELECT id FROM videos WHERE id = :id')
+LATEST_VIDEOS = text('SELECT * FROM videos ORDER BY id DESC LIMIT :limit')
+VIDEOS_BY_UPLOADER = text(
+    'SELECT * FROM videos WHERE uploaded_by = :user_id ORDER BY id DESC'
+).execution_options(stream_results=True)
+# Keyset page of the feed, newest first; callers pass limit + 1 to learn whether more follow
+SHORTS_PAGE = text('''
+    SELECT v.*,
+           (SELECT COUNT(*) FROM comments c WHERE c.video_id = v.id) as comment_count,
+           (SELECT COUNT(*) FROM likes l WHERE l.video_id = v.id) as like_count
+    FROM videos v
+    WHERE v.id < :before
+    ORDER BY v.id DESC
+    LIMIT :limit
+''').execution_options(stream_results=True)
+BUMP_VIDEO_VERSION = text('UPDATE videos SET version = version + 1 WHERE id = :id')
+VIDEO_VERSION = text('SELECT version FROM videos WHERE id = :id')
+VIDEO_GENRES_IN = text('SELECT id, genre FROM videos WHERE id IN :ids').bindparams(bindparam('ids', expanding=True))
+# Trending rows (in any order); one primary-key probe per ID
+VIDEOS_BY_IDS = text('SELECT * FROM videos WHERE id IN :ids').bindparams(bindparam('ids', expanding=True))
+SET_VIDEO_POSTER = text('UPDATE videos SET poster = :poster WHERE id = :id')
+VIDEOS_WITHOUT_POSTER = text('SELECT id, title FROM videos WHERE poster IS NULL ORDER BY id')
+VIDEOS_IN = text('SELECT id FROM videos WHERE id IN :ids').bindparams(bindparam('ids', expanding=True))
+
+# Views, folded in by views.ViewCounter
+
+VIEWS_FOR_VIDEO = text('SELECT views FROM video_views WHERE video_id = :video_id')
+ADD_VIDEO_VIEWS = text(
+    'INSERT INTO video_views (video_id, views) VALUES (:video_id, :views) '
+    'ON CONFLICT (video_id) DO UPDATE SET views = video_views.views + excluded.views'
+)
+ADD_DAILY_VIDEO_VIEWS = text(
+    'INSERT INTO video_daily_views (video_id, day, views) VALUES (:video_id, :day, :views) '
+    'ON CONFLICT (video_id, day) DO UPDATE SET views = video_daily_views.views + excluded.views'
+)
+
+# Comments
+
+COMMENTS_FOR_VIDEO = text('''
+    SELECT c.comment, c.rating, u.username, c.created_at
+    FROM comments c
+    JOIN users u ON c.user_id = u.id
+    WHERE c.video_id = :video_id
+    ORDER BY c.id DESC
+''')
+COUNT_COMMENTS = text('SELECT COUNT(*) FROM comments WHERE video_id = :video_id')
+INSERT_COMMENT = text(
+    'INSERT INTO comments (video_id, user_id, comment, rating, created_at) '
+    'VALUES (:video_id, :user_id, :comment, :rating, :created_at)'
+)
+
+# Daily engagement rollups (rollups.py)
+
+_ROLLUP_UPDATE = (
+    'likes = {t}.likes + excluded.likes, unlikes = {t}.unlikes + excluded.unlikes, '
+    'comments = {t}.comments + excluded.comments, rating_sum = {t}.rating_sum + excluded.rating_sum'
+)
+ADD_VIDEO_ENGAGEMENT = text(
+    'INSERT INTO video_daily_engagement (video_id, day, likes, unlikes, comments, rating_sum) '
+    'VALUES (:video_id, :day, :likes, :unlikes, :comments, :rating_sum) '
+    'ON CONFLICT (video_id, day) DO UPDATE SET ' + _ROLLUP_UPDATE.format(t='video_daily_engagement')
+)
+ADD_CREATOR_ENGAGEMENT = text(
+    'INSERT INTO creator_daily_engagement (user_id, day, likes, unlikes, comments, rating_sum) '
+    'VALUES (:user_id, :day, :likes, :unlikes, :comments, :rating_sum) '
+    'ON CONFLICT (user_id, day) DO UPDATE SET ' + _ROLLUP_UPDATE.format(t='creator_daily_engagement')
+)
+VIDEO_UPLOADER = text('SELECT uploaded_by FROM videos WHERE id = :id')
+CREATOR_ENGAGEMENT_RANGE = text('''
+    SELECT day, likes, unlikes, comments, rating_sum
+    FROM creator_daily_engagement
+    WHERE user_id = :user_id AND day BETWEEN :start AND :end
+    ORDER BY day
+''')
+TOP_VIDEOS_ENGAGEMENT = text('''
+    SELECT v.id, v.title,
+           SUM(e.likes) as likes, SUM(e.unlikes) as unlikes,
+           SUM(e.comments) as comments, SUM(e.rating_sum) as rating_sum
+    FROM videos v
+    JOIN video_daily_engagement e ON e.video_id = v.id
+    WHERE v.uploaded_by = :user_id AND e.day BETWEEN :start AND :end
+    GROUP BY v.id, v.title
+    ORDER BY SUM(e.likes) + SUM(e.comments) DESC
+    LIMIT :limit
+''')
+# Full recompute
+ALL_COMMENT_DAYS = text('SELECT video_id, created_at, rating FROM comments').execution_options(stream_results=True)
+LIKES_PER_VIDEO = text('SELECT video_id, COUNT(*) as likes FROM likes GROUP BY video_id')
+VIDEO_UPLOADERS = text('SELECT id, uploaded_by FROM videos')
+CLEAR_VIDEO_ENGAGEMENT = text('DELETE FROM video_daily_engagement')
+CLEAR_CREATOR_ENGAGEMENT = text('DELETE FROM creator_daily_engagement')
+
+# Engagement exports: keyset pages over one creator's videos and their comments
+
+EXPORT_VIDEOS = text('''
+    SELECT v.id, v.title, v.genre, v.age_rating,
+           (SELECT COUNT(*) FROM likes l WHERE l.video_id = v.id) as likes,
+           (SELECT COUNT(*) FROM comments c WHERE c.video_id = v.id) as comments,
+           (SELECT COUNT(c.rating) FROM comments c WHERE c.video_id = v.id) as ratings,
+           (SELECT AVG(c.rating) FROM comments c WHERE c.video_id = v.id) as average_rating
+    FROM videos v
+    WHERE v.uploaded_by = :user_id AND v.id > :after
+    ORDER BY v.id
+    LIMIT :limit
+''')
+# A comment page is the rest of the video it stopped in, then the creator's later
+# videos; both are range scans of idx_comments_video_id, so no page re-reads rows
+EXPORT_COMMENTS_IN_VIDEO = text('''
+    SELECT c.id, c.video_id, v.title, u.username, c.rating, c.comment, c.created_at
+    FROM comments c
+    JOIN videos v ON v.id = c.video_id
+    LEFT JOIN users u ON u.id = c.user_id
+    WHERE c.video_id = :video_id AND c.id > :after
+    ORDER BY c.id
+    LIMIT :limit
+''')
+EXPORT_COMMENTS_AFTER_VIDEO = text('''
+    SELECT c.id, c.video_id, v.title, u.username, c.rating, c.comment, c.created_at
+    FROM videos v
+    JOIN comments c ON c.video_id = v.id
+    LEFT JOIN users u ON u.id = c.user_id
+    WHERE v.uploaded_by = :user_id AND v.id > :after
+    ORDER BY v.id, c.id
+    LIMIT :limit
+''')
+
+# Likes
+
+INSERT_LIKE = text(
+    'INSERT INTO likes (video_id, user_id) VALUES (:video_id, :user_id) ON CONFLICT DO NOTHING'
+)
+# Which of a page of videos the user has liked; each ID is a probe of UNIQUE(video_id, user_id)
+LIKED_AMONG = text(
+    'SELECT video_id FROM likes WHERE user_id = :user_id AND video_id IN :ids'
+).bindparams(bindparam('ids', expanding=True))
+DELETE_LIKE = text('DELETE FROM likes WHERE video_id = :video_id AND user_id = :user_id')
+COUNT_LIKES = text('SELECT COUNT(*) FROM likes WHERE video_id = :video_id')
+
+# Mirrors of URL-submitted videos (mirror.py)
+
+QUEUE_MIRROR = text('''
+    INSERT INTO video_mirrors (video_id, source_url, status) VALUES (:video_id, :source_url, 'pending')
+    ON CONFLICT (video_id) DO UPDATE SET source_url = excluded.source_url, status = 'pending', attempts = 0, error = NULL
+''')
+REMOTE_VIDEOS = text('''
+    SELECT v.id, v.url FROM videos v
+    LEFT JOIN video_mirrors m ON m.video_id = v.id
+    WHERE (v.url LIKE 'http://%' OR v.url LIKE 'https://%') AND m.video_id IS NULL
+''')
+PENDING_MIRRORS = text("SELECT video_id, source_url, etag FROM video_mirrors WHERE status = 'pending' ORDER BY video_id")
+MIRROR_BY_VIDEO = text('SELECT * FROM video_mirrors WHERE video_id = :video_id')
+UPDATE_MIRROR = text('''
+    UPDATE video_mirrors SET status = :status, etag = :etag, size = :size, attempts = :attempts, error = :error
+    WHERE video_id = :video_id
+''')
+# Only switches videos still pointing at the mirrored URL, in case it was edited meanwhile
+USE_MIRROR = text('UPDATE videos SET url = :url, version = version + 1 WHERE id = :id AND url = :source_url')
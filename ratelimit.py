@@ -0,0 +1,190 @@
+"""
+Token-bucket admission control for write routes.
+
+Each limited route gets a per-user bucket, a global bucket and a cap on the
+number of requests allowed to wait on the database at once. A request that
+fails any of them gets a 429 with Retry-After before the view runs.
+
+Buckets live in process memory by default. Setting RATE_LIMIT_DB to a file
+path (ideally on tmpfs, e.g. /dev/shm/zeshare-ratelimit.db) shares them
+between worker processes through a small SQLite file that is separate from
+the application database. Rows idle for PRUNE_IDLE_SECONDS are deleted as
+they go, and if that file can't be used (locked past its busy timeout,
+unwritable) requests are let through and the error is logged and counted:
+the limiter guards the database, so it should not take the routes down.
+"""
+import functools
+import logging
+import math
+import sqlite3
+import threading
+import time
+
+from flask import jsonify, request, session
+
+import metrics
+
+logger = logging.getLogger('ratelimit')
+
+# Buckets idle for a minute have refilled for any sane rate; dropping them is lossless
+PRUNE_IDLE_SECONDS = 60
+
+ERRORS = metrics.Counter('rate_limit_errors_total', 'Shared bucket lookups that failed and let the request through')
+
+DEFAULT_LIMITS = {
+    'like': {'user_rate': 2.0, 'user_burst': 10, 'global_rate': 200.0, 'global_burst': 400, 'max_pending': 64},
+    'comment': {'user_rate': 0.5, 'user_burst': 5, 'global_rate': 100.0, 'global_burst': 200, 'max_pending': 32},
+}
+
+
+class MemoryBuckets:
+    def __init__(self, max_keys=100000):
+        self.buckets = {}
+        self.lock = threading.Lock()
+        self.max_keys = max_keys
+
+    def take(self, key, rate, burst, now=None):
+        """Take one token; return 0 on success or the seconds until one is available"""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            tokens, updated = self.buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            if tokens >= 1:
+                self.buckets[key] = (tokens - 1, now)
+                wait = 0.0
+            else:
+                self.buckets[key] = (tokens, now)
+                wait = (1 - tokens) / rate
+            if len(self.buckets) > self.max_keys:
+                self._prune(now)
+            return wait
+
+    def give_back(self, key, burst):
+        with self.lock:
+            if key in self.buckets:
+                tokens, updated = self.buckets[key]
+                self.buckets[key] = (min(burst, tokens + 1), updated)
+
+    def _prune(self, now):
+        idle = [k for k, (_, updated) in self.buckets.items() if now - updated > PRUNE_IDLE_SECONDS]
+        for k in idle:
+            del self.buckets[k]
+
+
+class SharedBuckets:
+    """Buckets in a side SQLite file so every worker process sees the same counts"""
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        self.next_prune = 0.0
+        conn = self._conn()
+        conn.execute('CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL, updated REAL)')
+
+    def _conn(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, timeout=1.0)
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA synchronous = OFF')
+            self.local.conn = conn
+        return conn
+
+    def take(self, key, rate, burst, now=None):
+        """As MemoryBuckets.take, but 0 (let through) if the bucket file can't be used"""
+        now = time.time() if now is None else now
+        try:
+            conn = self._conn()
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+            tokens, updated = row if row else (burst, now)
+            tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+            wait = 0.0 if tokens >= 1 else (1 - tokens) / rate
+            if not wait:
+                tokens -= 1
+            conn.execute('INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)',
+                         (key, tokens, now))
+            if now >= self.next_prune:
+                self.next_prune = now + PRUNE_IDLE_SECONDS
+                conn.execute('DELETE FROM buckets WHERE updated < ?', (now - PRUNE_IDLE_SECONDS,))
+            conn.execute('COMMIT')
+        except sqlite3.Error as e:
+            self._failed(e)
+            return 0.0
+        return wait
+
+    def give_back(self, key, burst):
+        try:
+            self._conn().execute('UPDATE buckets SET tokens = MIN(?, tokens + 1) WHERE key = ?', (burst, key))
+        except sqlite3.Error as e:
+            self._failed(e)
+
+    def _failed(self, error):
+        ERRORS.inc()
+        logger.warning("Rate limit buckets in %s unavailable, letting the request through: %s", self.path, error)
+        conn = getattr(self.local, 'conn', None)
+        if conn is not None and conn.in_transaction:
+            try:
+                conn.execute('ROLLBACK')
+            except sqlite3.Error:
+                # Leave no half-open connection behind; the next call reconnects
+                conn.close()
+                self.local.conn = None
+
+
+class Limiter:
+    def __init__(self, app=None):
+        self.limits = {}
+        self.buckets = MemoryBuckets()
+        self.pending = 0
+        self.pending_lock = threading.Lock()
+        # Replaced by the writer queue depth when one exists
+        self.queue_depth = lambda: self.pending
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.limits = {route: dict(DEFAULT_LIMITS.get(route, {}), **overrides)
+                       for route, overrides in app.config.get('RATE_LIMITS', {}).items()}
+        for route, limits in DEFAULT_LIMITS.items():
+            self.limits.setdefault(route, dict(limits))
+        if app.config.get('RATE_LIMIT_DB'):
+            self.buckets = SharedBuckets(app.config['RATE_LIMIT_DB'])
+
+    def check(self, route):
+        """Return None if the request may proceed, else seconds to wait"""
+        limits = self.limits.get(route)
+        if not limits:
+            return None
+        if self.queue_depth() >= limits.get('max_pending', math.inf):
+            return 1.0
+        user = session.get('user')
+        user_key = f"{route}:user:{user['id'] if user else request.remote_addr}"
+        wait = self.buckets.take(user_key, limits['user_rate'], limits['user_burst'])
+        if wait:
+            return wait
+        wait = self.buckets.take(f'{route}:global', limits['global_rate'], limits['global_burst'])
+        if wait:
+            self.buckets.give_back(user_key, limits['user_burst'])
+            return wait
+        return None
+
+    def limit(self, route):
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapped(*args, **kwargs):
+                wait = self.check(route)
+                if wait is not None:
+                    response = jsonify({"success": False, "message": "Too many requests, please slow down."})
+                    response.status_code = 429
+                    response.headers['Retry-After'] = str(max(1, math.ceil(wait)))
+                    return response
+                with self.pending_lock:
+                    self.pending += 1
+                try:
+                    return view(*args, **kwargs)
+                finally:
+                    with self.pending_lock:
+                        self.pending -= 1
+            return wrapped
+        return decorator
@@ -0,0 +1,131 @@
+"""
+Daily engagement rollups for the creator dashboard.
+
+    rollups.add(db, video_id, day, likes=1)      # inside a writer operation
+    rollups.creator_range(db, user_id, start, end)
+
+video_daily_engagement holds one row per video per day with likes, unlikes,
+comments and rating_sum; creator_daily_engagement holds the same counters
+summed per creator. Both are bumped by add() in the same transaction as the
+like or comment that caused them, so they never drift from the write paths.
+Dashboard charts read at most one row per day in the range instead of
+scanning likes and comments.
+
+Rows written around the write paths (bulk_io.py imports, manual SQL) are not
+counted; recompute everything with
+
+    python rollups.py rebuild
+
+Likes carry no timestamp, so a rebuild files existing likes under the day it
+runs. Days are UTC, as YYYY-MM-DD.
+"""
+import argparse
+import os
+import sys
+from collections import Counter, defaultdict
+from datetime import date, datetime, timedelta
+
+import database
+import queries
+
+COUNTERS = ('likes', 'unlikes', 'comments', 'rating_sum')
+# Longest range a dashboard query may ask for
+MAX_DAYS = 366
+
+
+def today():
+    return datetime.utcnow().date().isoformat()
+
+
+def add(db, video_id, day, **counts):
+    """Add counts (likes, unlikes, comments, rating_sum) for video_id on day to both rollups"""
+    params = {name: counts.get(name, 0) for name in COUNTERS}
+    params.update(video_id=video_id, day=day)
+    db.execute(queries.ADD_VIDEO_ENGAGEMENT, params)
+    uploader = db.execute(queries.VIDEO_UPLOADER, {'id': video_id}).scalar()
+    if uploader is not None:
+        params['user_id'] = uploader
+        db.execute(queries.ADD_CREATOR_ENGAGEMENT, params)
+
+
+def parse_range(start, end, default_days=30):
+    """(start, end) dates from YYYY-MM-DD strings, defaulting to the last default_days; clamped to MAX_DAYS"""
+    end = date.fromisoformat(end) if end else datetime.utcnow().date()
+    start = date.fromisoformat(start) if start else end - timedelta(days=default_days - 1)
+    if start > end:
+        raise ValueError('start is after end')
+    return max(start, end - timedelta(days=MAX_DAYS - 1)), end
+
+
+def creator_range(db, user_id, start, end):
+    """One entry per day from start to end (missing days are zero) plus totals over the range"""
+    rows = db.execute(queries.CREATOR_ENGAGEMENT_RANGE,
+                      {'user_id': user_id, 'start': start.isoformat(), 'end': end.isoformat()})
+    by_day = {str(row.day)[:10]: row for row in rows}
+    days, totals = [], Counter()
+    day = start
+    while day <= end:
+        row = by_day.get(day.isoformat())
+        counts = {name: getattr(row, name) if row else 0 for name in COUNTERS}
+        totals.update(counts)
+        days.append({'day': day.isoformat(), **counts})
+        day += timedelta(days=1)
+    totals = {name: totals[name] for name in COUNTERS}
+    totals['average_rating'] = round(totals['rating_sum'] / totals['comments'], 2) if totals['comments'] else None
+    return {'start': start.isoformat(), 'end': end.isoformat(), 'days': days, 'totals': totals}
+
+
+def top_videos(db, user_id, start, end, limit=10):
+    rows = db.execute(queries.TOP_VIDEOS_ENGAGEMENT, {'user_id': user_id, 'start': start.isoformat(),
+                                                      'end': end.isoformat(), 'limit': limit})
+    return [dict(row._mapping) for row in rows]
+
+
+def rebuild(bind):
+    """Recompute both rollups from comments and likes"""
+    videos = defaultdict(Counter)
+    with bind.connect() as conn:
+        for row in conn.execute(queries.ALL_COMMENT_DAYS):
+            counts = videos[row.video_id, str(row.created_at)[:10]]
+            counts['comments'] += 1
+            counts['rating_sum'] += row.rating or 0
+        day = today()
+        for row in conn.execute(queries.LIKES_PER_VIDEO):
+            videos[row.video_id, day]['likes'] += row.likes
+        uploaders = {row.id: row.uploaded_by for row in conn.execute(queries.VIDEO_UPLOADERS)}
+
+    creators = defaultdict(Counter)
+    for (video_id, day), counts in videos.items():
+        if uploaders.get(video_id) is not None:
+            creators[uploaders[video_id], day].update(counts)
+
+    video_rows = [{'video_id': video_id, 'day': day, **{name: counts[name] for name in COUNTERS}}
+                  for (video_id, day), counts in videos.items() if video_id in uploaders]
+    creator_rows = [{'user_id': user_id, 'day': day, **{name: counts[name] for name in COUNTERS}}
+                    for (user_id, day), counts in creators.items()]
+    with bind.begin() as conn:
+        conn.execute(queries.CLEAR_VIDEO_ENGAGEMENT)
+        conn.execute(queries.CLEAR_CREATOR_ENGAGEMENT)
+        if video_rows:
+            conn.execute(queries.ADD_VIDEO_ENGAGEMENT, video_rows)
+        if creator_rows:
+            conn.execute(queries.ADD_CREATOR_ENGAGEMENT, creator_rows)
+    return len(video_rows), len(creator_rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the daily engagement rollups.")
+    parser.add_argument('--database-url', default=os.environ.get(
+        'DATABASE_URL', f"sqlite:///{os.environ.get('VIDEOAPP_DB', 'videoapp.db')}"))
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('rebuild', help='recompute the rollups from comments and likes')
+    args = parser.parse_args()
+
+    engine = database.create(args.database_url)
+    database.migrate(engine)
+    video_rows, creator_rows = rebuild(engine)
+    print(f"Rebuilt {video_rows} video-day and {creator_rows} creator-day rows", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
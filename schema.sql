@@ -124,6 +124,9 @@ CREATE TABLE IF NOT EXISTS videos (
     age_rating TEXT,
     url TEXT NOT NULL,
     uploaded_by INTEGER,
+    version INTEGER NOT NULL DEFAULT 0,
+    -- Hash naming the poster renditions in static/posters (see posters.py)
+    poster TEXT,
     FOREIGN KEY (uploaded_by) REFERENCES users(id)
 );
 
@@ -145,4 +148,57 @@ CREATE TABLE IF NOT EXISTS likes (
     FOREIGN KEY (video_id) REFERENCES videos(id),
     FOREIGN KEY (user_id) REFERENCES users(id),
     UNIQUE(video_id, user_id)
-);
\ No newline at end of file
+);
+
+-- Running view counts, kept by views.ViewCounter
+CREATE TABLE IF NOT EXISTS video_views (
+    video_id INTEGER PRIMARY KEY,
+    views INTEGER NOT NULL DEFAULT 0,
+    FOREIGN KEY (video_id) REFERENCES videos(id)
+);
+
+CREATE TABLE IF NOT EXISTS video_daily_views (
+    video_id INTEGER NOT NULL,
+    day TEXT NOT NULL,
+    views INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (video_id, day),
+    FOREIGN KEY (video_id) REFERENCES videos(id)
+);
+
+-- Per-day likes/comments, kept by rollups.add() from the write paths
+CREATE TABLE IF NOT EXISTS video_daily_engagement (
+    video_id INTEGER NOT NULL,
+    day TEXT NOT NULL,
+    likes INTEGER NOT NULL DEFAULT 0,
+    unlikes INTEGER NOT NULL DEFAULT 0,
+    comments INTEGER NOT NULL DEFAULT 0,
+    rating_sum INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (video_id, day),
+    FOREIGN KEY (video_id) REFERENCES videos(id)
+);
+
+CREATE TABLE IF NOT EXISTS creator_daily_engagement (
+    user_id INTEGER NOT NULL,
+    day TEXT NOT NULL,
+    likes INTEGER NOT NULL DEFAULT 0,
+    unlikes INTEGER NOT NULL DEFAULT 0,
+    comments INTEGER NOT NULL DEFAULT 0,
+    rating_sum INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, day),
+    FOREIGN KEY (user_id) REFERENCES users(id)
+);
+
+-- Local copies of URL-submitted videos, kept by mirror.Mirror
+CREATE TABLE IF NOT EXISTS video_mirrors (
+    video_id INTEGER PRIMARY KEY,
+    source_url TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    etag TEXT,
+    size INTEGER,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    FOREIGN KEY (video_id) REFERENCES videos(id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_videos_uploaded_by ON videos(uploaded_by);
+CREATE INDEX IF NOT EXISTS idx_comments_video_id ON comments(video_id);
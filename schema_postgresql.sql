@@ -0,0 +1,81 @@
+-- PostgreSQL version of schema.sql; keep the two in step.
+CREATE TABLE IF NOT EXISTS users (
+    id SERIAL PRIMARY KEY,
+    username TEXT UNIQUE NOT NULL,
+    password TEXT NOT NULL,
+    role TEXT CHECK(role IN ('creator', 'consumer')) NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS videos (
+    id SERIAL PRIMARY KEY,
+    title TEXT NOT NULL,
+    publisher TEXT NOT NULL,
+    producer TEXT,
+    genre TEXT,
+    age_rating TEXT,
+    url TEXT NOT NULL,
+    uploaded_by INTEGER REFERENCES users(id),
+    version INTEGER NOT NULL DEFAULT 0,
+    poster TEXT
+);
+
+CREATE TABLE IF NOT EXISTS comments (
+    id SERIAL PRIMARY KEY,
+    video_id INTEGER REFERENCES videos(id),
+    user_id INTEGER REFERENCES users(id),
+    comment TEXT NOT NULL,
+    rating INTEGER CHECK(rating BETWEEN 1 AND 5),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS likes (
+    id SERIAL PRIMARY KEY,
+    video_id INTEGER REFERENCES videos(id),
+    user_id INTEGER REFERENCES users(id),
+    UNIQUE(video_id, user_id)
+);
+
+CREATE TABLE IF NOT EXISTS video_views (
+    video_id INTEGER PRIMARY KEY REFERENCES videos(id),
+    views INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS video_daily_views (
+    video_id INTEGER NOT NULL REFERENCES videos(id),
+    day DATE NOT NULL,
+    views INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (video_id, day)
+);
+
+CREATE TABLE IF NOT EXISTS video_daily_engagement (
+    video_id INTEGER NOT NULL REFERENCES videos(id),
+    day DATE NOT NULL,
+    likes INTEGER NOT NULL DEFAULT 0,
+    unlikes INTEGER NOT NULL DEFAULT 0,
+    comments INTEGER NOT NULL DEFAULT 0,
+    rating_sum INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (video_id, day)
+);
+
+CREATE TABLE IF NOT EXISTS creator_daily_engagement (
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    day DATE NOT NULL,
+    likes INTEGER NOT NULL DEFAULT 0,
+    unlikes INTEGER NOT NULL DEFAULT 0,
+    comments INTEGER NOT NULL DEFAULT 0,
+    rating_sum INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, day)
+);
+
+CREATE TABLE IF NOT EXISTS video_mirrors (
+    video_id INTEGER PRIMARY KEY REFERENCES videos(id),
+    source_url TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    etag TEXT,
+    size BIGINT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT
+);
+
+CREATE INDEX IF NOT EXISTS idx_videos_uploaded_by ON videos(uploaded_by);
+CREATE INDEX IF NOT EXISTS idx_comments_video_id ON comments(video_id);
@@ -0,0 +1,182 @@
+"""
+Slow-query log for the instrumented SQLite connections in metrics.py.
+
+Every finished statement is reduced to a fingerprint (literals, IN lists and
+whitespace normalized). Statements slower than the threshold are appended to
+a JSONL log; the first slow sighting of each fingerprint also records its
+EXPLAIN QUERY PLAN so full scans and temp B-trees are visible offline:
+
+    python slowlog.py report slow_queries.log --top 20 --by total
+"""
+import argparse
+import hashlib
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+
+from flask import has_request_context, request
+
+import metrics
+
+logger = logging.getLogger('slowlog')
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST = re.compile(r'\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)', re.IGNORECASE)
+_SPACE = re.compile(r'\s+')
+# SQLite EXPLAIN QUERY PLAN steps, then PostgreSQL EXPLAIN nodes
+_WARN_DETAILS = ('SCAN ', 'USE TEMP B-TREE', 'Seq Scan')
+
+
+def normalize(sql):
+    sql = _STRING.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = _IN_LIST.sub('IN (?+)', sql)
+    return _SPACE.sub(' ', sql).strip()
+
+
+def fingerprint(sql):
+    return hashlib.sha1(normalize(sql).encode()).hexdigest()[:12]
+
+
+def explain(connection, sql, parameters):
+    if not isinstance(connection, sqlite3.Connection):
+        return _explain_postgresql(connection, sql, parameters)
+    # A plain sqlite3.Cursor bypasses the instrumented one, so this is not re-logged
+    if parameters is None:
+        parameters = (None,) * sql.count('?')
+    try:
+        rows = sqlite3.Cursor(connection).execute('EXPLAIN QUERY PLAN ' + sql, parameters).fetchall()
+    except sqlite3.Error as e:
+        return [f'(no plan: {e})']
+    depth = {0: -1}
+    plan = []
+    for row in rows:
+        node, parent, detail = row[0], row[1], row[3]
+        depth[node] = depth.get(parent, -1) + 1
+        plan.append('  ' * depth[node] + detail)
+    return plan
+
+
+def _explain_postgresql(connection, sql, parameters):
+    # Runs on the request's own connection, so a failed EXPLAIN must not abort its transaction
+    cursor = connection.cursor()
+    try:
+        cursor.execute('SAVEPOINT slowlog_explain')
+        try:
+            cursor.execute('EXPLAIN ' + sql, parameters or None)
+            return [row[0] for row in cursor.fetchall()]
+        except Exception as e:
+            return [f'(no plan: {e})']
+        finally:
+            cursor.execute('ROLLBACK TO SAVEPOINT slowlog_explain')
+            cursor.execute('RELEASE SAVEPOINT slowlog_explain')
+    finally:
+        cursor.close()
+
+
+def plan_warnings(plan):
+    """Plan steps that read a whole table or sort into a temp B-tree"""
+    warnings = []
+    for line in plan:
+        step = line.strip().lstrip('-> ')
+        if step.startswith(_WARN_DETAILS) and 'USING' not in step.replace('USE TEMP', ''):
+            warnings.append(step)
+    return warnings
+
+
+class SlowQueryLog:
+    def __init__(self, path, threshold_ms=50.0):
+        self.path = path
+        self.threshold = threshold_ms / 1000.0
+        self.planned = set()
+        self.lock = threading.Lock()
+
+    def __call__(self, sql, parameters, elapsed, rows, connection):
+        if elapsed < self.threshold or sql == 'COMMIT':
+            return
+        fp = fingerprint(sql)
+        entry = {
+            'ts': time.time(),
+            'fingerprint': fp,
+            'sql': normalize(sql),
+            'ms': round(elapsed * 1000, 3),
+            'rows': rows,
+            'endpoint': request.endpoint if has_request_context() else None,
+        }
+        with self.lock:
+            first = fp not in self.planned
+            self.planned.add(fp)
+        if first:
+            entry['plan'] = explain(connection, sql, parameters)
+        logger.warning("Slow query %s (%.1f ms, %d rows): %s", fp, entry['ms'], rows, entry['sql'])
+        line = json.dumps(entry) + '\n'
+        with self.lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+
+
+def init_app(app):
+    threshold = app.config.get('SLOW_QUERY_MS')
+    if threshold is None:
+        return None
+    log = SlowQueryLog(app.config.get('SLOW_QUERY_LOG', 'slow_queries.log'), float(threshold))
+    metrics.add_statement_listener(log)
+    return log
+
+
+def report(args):
+    stats = defaultdict(lambda: {'count': 0, 'total': 0.0, 'max': 0.0, 'rows': 0, 'times': [],
+                                 'endpoints': set(), 'plan': None, 'sql': ''})
+    with open(args.path, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            s = stats[entry['fingerprint']]
+            s['count'] += 1
+            s['total'] += entry['ms']
+            s['max'] = max(s['max'], entry['ms'])
+            s['rows'] += entry.get('rows') or 0
+            s['times'].append(entry['ms'])
+            s['sql'] = entry['sql']
+            if entry.get('endpoint'):
+                s['endpoints'].add(entry['endpoint'])
+            if entry.get('plan') and s['plan'] is None:
+                s['plan'] = entry['plan']
+
+    key = {'total': lambda s: s['total'], 'max': lambda s: s['max'], 'count': lambda s: s['count']}[args.by]
+    ranked = sorted(stats.items(), key=lambda item: key(item[1]), reverse=True)[:args.top]
+    for rank, (fp, s) in enumerate(ranked, 1):
+        times = sorted(s['times'])
+        p95 = times[min(len(times) - 1, int(len(times) * 0.95))]
+        warnings = plan_warnings(s['plan'] or [])
+        print(f"#{rank} {fp}  count={s['count']}  total={s['total']:.1f}ms  p95={p95:.1f}ms  "
+              f"max={s['max']:.1f}ms  avg_rows={s['rows'] / s['count']:.0f}  "
+              f"endpoints={','.join(sorted(s['endpoints'])) or '-'}")
+        print(f"    {s['sql']}")
+        for line in s['plan'] or []:
+            print(f"    | {line}")
+        if warnings:
+            print(f"    ! {'; '.join(warnings)}")
+        print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('report', help='top-N slow fingerprints from a log file')
+    p.add_argument('path', nargs='?', default='slow_queries.log')
+    p.add_argument('--top', type=int, default=20)
+    p.add_argument('--by', choices=['total', 'max', 'count'], default='total')
+    p.set_defaults(func=report)
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Streamed HTML responses for list pages.
+
+    rows = RowStream(db.execute(queries.SHORTS_PAGE, params), limit=24)
+    return stream_page('shorts.html', videos=rows)
+
+The page head goes out before the first row is fetched, rows are pulled from
+the cursor in fetchmany batches while the template renders them, and output
+is sent in chunks of a few KiB instead of one write per template fragment.
+A RowStream can only be iterated once, so templates use {% for %}...{% else %}
+rather than {% if videos %}.
+"""
+from flask import Response, get_flashed_messages, stream_template
+
+BATCH_ROWS = 50
+HEAD_FLUSH_CHARS = 1024
+FLUSH_CHARS = 8 * 1024
+
+
+class RowStream:
+    """Rows from a result, fetched in batches as the template asks for them"""
+
+    def __init__(self, cursor, batch_rows=BATCH_ROWS, limit=None, key='id', on_batch=None):
+        self.cursor = cursor
+        self.batch_rows = batch_rows
+        self.limit = limit
+        self.key = key
+        # Called with each fetched batch before its rows are yielded, e.g. to
+        # look up per-user state for the whole batch in one query
+        self.on_batch = on_batch
+        self.count = 0
+        # Key of the last row yielded when more rows exist past the limit
+        self.next_cursor = None
+
+    def __iter__(self):
+        last = None
+        while True:
+            rows = self.cursor.fetchmany(self.batch_rows)
+            if not rows:
+                break
+            if self.on_batch is not None:
+                self.on_batch(rows[:self.limit - self.count] if self.limit is not None else rows)
+            for row in rows:
+                if self.count == self.limit:
+                    self.next_cursor = last._mapping[self.key]
+                    self.cursor.close()
+                    return
+                self.count += 1
+                last = row
+                yield row
+
+
+def _chunked(fragments):
+    buffer, buffered, threshold = [], 0, HEAD_FLUSH_CHARS
+    try:
+        for fragment in fragments:
+            buffer.append(fragment)
+            buffered += len(fragment)
+            if buffered >= threshold:
+                yield ''.join(buffer)
+                buffer, buffered, threshold = [], 0, FLUSH_CHARS
+        if buffer:
+            yield ''.join(buffer)
+    finally:
+        # Pops the request context held by stream_template if the client went away
+        fragments.close()
+
+
+def stream_page(template_name, **context):
+    # The session cookie is written before the body is generated, so flashed
+    # messages must be popped now rather than when base.html reaches them.
+    get_flashed_messages()
+    return Response(_chunked(stream_template(template_name, **context)), mimetype='text/html')
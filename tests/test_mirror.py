@@ -0,0 +1,185 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from flask import Flask
+
+import database
+import dbwriter
+import mirror
+import queries
+from support import TMP, empty, fresh_engine
+
+
+class SourceHandler(BaseHTTPRequestHandler):
+    """Serves server.body with ETag, Range and If-Range like a static file server"""
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append({'Range': self.headers.get('Range'), 'If-Range': self.headers.get('If-Range')})
+        if server.status:
+            self.send_error(server.status)
+            return
+        body, start = server.body, 0
+        ranged = self.headers.get('Range', '').startswith('bytes=') and \
+            self.headers.get('If-Range') in (None, server.etag)
+        if ranged:
+            start = int(self.headers['Range'][len('bytes='):].partition('-')[0])
+            if start >= len(body):
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{len(body)}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+        self.send_response(206 if ranged else 200)
+        if ranged:
+            self.send_header('Content-Range', f'bytes {start}-{len(body) - 1}/{len(body)}')
+        self.send_header('Content-Type', 'video/mp4')
+        self.send_header('Content-Length', str(len(body) - start))
+        self.send_header('ETag', server.etag)
+        self.end_headers()
+        if server.cut_after is not None:
+            # Drop the connection part way through, as a reset or a restart would
+            self.wfile.write(body[start:start + server.cut_after])
+            server.cut_after = None
+            self.close_connection = True
+            return
+        self.wfile.write(body[start:])
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Source:
+    def __init__(self, body, etag='"v1"'):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), SourceHandler)
+        self.server.daemon_threads = True
+        self.server.body, self.server.etag = body, etag
+        self.server.status, self.server.cut_after = None, None
+        self.server.requests = []
+        self.url = f'http://127.0.0.1:{self.server.server_port}/clip.mp4'
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class DownloadTest(unittest.TestCase):
+    def setUp(self):
+        self.body = os.urandom(100_000)
+        self.source = Source(self.body)
+        self.addCleanup(self.source.close)
+        self.hosts = mirror.HostPool(per_host=2, timeout=5)
+        self.addCleanup(self.hosts.close)
+        self.folder = tempfile.mkdtemp(dir=TMP)
+        self.partial = os.path.join(self.folder, 'clip.mp4.partial')
+
+    def download(self, transfer):
+        return mirror.download(transfer, self.hosts, chunk_bytes=8192, allow_private=True)
+
+    def test_resumes_a_cut_off_transfer(self):
+        self.source.server.cut_after = 30_000
+        transfer = mirror.Transfer(self.source.url, self.partial)
+        with self.assertRaises(OSError):
+            self.download(transfer)
+        self.assertEqual(os.path.getsize(self.partial), 30_000)
+        self.assertEqual(transfer.etag, '"v1"')
+
+        self.download(transfer)
+        with open(self.partial, 'rb') as f:
+            self.assertEqual(f.read(), self.body)
+        self.assertEqual(transfer.size, len(self.body))
+        self.assertEqual(self.source.server.requests[-1], {'Range': 'bytes=30000-', 'If-Range': '"v1"'})
+
+    def test_changed_source_is_downloaded_again_in_full(self):
+        with open(self.partial, 'wb') as f:
+            f.write(b'x' * 30_000)
+        transfer = mirror.Transfer(self.source.url, self.partial, etag='"v0"')
+        self.download(transfer)
+        with open(self.partial, 'rb') as f:
+            self.assertEqual(f.read(), self.body)
+        self.assertEqual(transfer.etag, '"v1"')
+        self.assertEqual(self.source.server.requests, [{'Range': 'bytes=30000-', 'If-Range': '"v0"'}])
+
+    def test_complete_partial_is_kept(self):
+        with open(self.partial, 'wb') as f:
+            f.write(self.body)
+        transfer = self.download(mirror.Transfer(self.source.url, self.partial, etag='"v1"'))
+        self.assertEqual(transfer.size, len(self.body))
+
+    def test_client_error_fails_the_transfer(self):
+        self.source.server.status = 404
+        with self.assertRaisesRegex(mirror.MirrorError, 'HTTP 404'):
+            self.download(mirror.Transfer(self.source.url, self.partial))
+
+    def test_private_source_is_refused_by_default(self):
+        with self.assertRaisesRegex(mirror.MirrorError, 'non-public'):
+            mirror.download(mirror.Transfer(self.source.url, self.partial), self.hosts)
+        self.assertEqual(self.source.server.requests, [])
+
+
+class MirrorTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        fd, path = tempfile.mkstemp(suffix='.db', dir=TMP)
+        os.close(fd)
+        cls.engine = fresh_engine(f'sqlite:///{path}')
+        cls.writer = dbwriter.Writer(cls.engine.connect)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.engine.dispose()
+
+    def setUp(self):
+        empty(self.engine)
+        self.addCleanup(setattr, database, 'engine', database.engine)
+        database.engine = self.engine
+        self.body = os.urandom(50_000)
+        self.source = Source(self.body)
+        self.addCleanup(self.source.close)
+        self.folder = tempfile.mkdtemp(dir=TMP)
+        self.addCleanup(shutil.rmtree, self.folder)
+        app = Flask(__name__)
+        app.config.update(MIRROR_FOLDER=self.folder, MIRROR_ALLOW_PRIVATE=True, MIRROR_ATTEMPTS=3,
+                          MIRROR_BACKOFF_SECONDS=0, MIRROR_TIMEOUT=5, MIRROR_CHUNK_BYTES=4096)
+        self.mirrors = mirror.Mirror(app, self.writer)
+        with self.engine.begin() as db:
+            db.execute(queries.INSERT_USER, {'username': 'creator', 'password': 'x', 'role': 'creator'})
+            self.video_id = db.execute(queries.INSERT_VIDEO_RETURNING_ID, {
+                'title': 'Clip', 'publisher': 'P', 'producer': '', 'genre': '', 'age_rating': 'G',
+                'url': self.source.url, 'uploaded_by': 1
+            }).scalar()
+
+    def row(self):
+        with self.engine.connect() as db:
+            return (db.execute(queries.MIRROR_BY_VIDEO, {'video_id': self.video_id}).one(),
+                    db.execute(queries.VIDEO_BY_ID, {'id': self.video_id}).one())
+
+    def test_retry_resumes_and_switches_the_video(self):
+        self.source.server.cut_after = 20_000
+        url = self.mirrors.submit(self.video_id, self.source.url).result(10)
+        mirrored, video = self.row()
+        self.assertEqual((mirrored.status, mirrored.attempts, mirrored.size), ('done', 2, len(self.body)))
+        self.assertEqual(video.url, url)
+        with open(url[1:], 'rb') as f:
+            self.assertEqual(f.read(), self.body)
+        self.assertEqual([request['Range'] for request in self.source.server.requests], [None, 'bytes=20000-'])
+
+    def test_client_error_fails_without_retrying(self):
+        self.source.server.status = 403
+        self.assertIsNone(self.mirrors.submit(self.video_id, self.source.url).result(10))
+        mirrored, video = self.row()
+        self.assertEqual((mirrored.status, mirrored.error), ('failed', f'HTTP 403 from {self.source.url}'))
+        self.assertEqual(video.url, self.source.url)
+        self.assertEqual(len(self.source.server.requests), 1)
+        self.assertEqual(os.listdir(self.folder), ['.mirror.lock'] if mirror.fcntl else [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import ppt
+from support import TMP
+
+DECK = '<html><body><div class="slide"><h1>{title}</h1><p>One slide</p></div></body></html>'
+
+
+class OutputPathsTest(unittest.TestCase):
+    def test_decks_in_one_folder_go_straight_into_the_output_dir(self):
+        outputs = ppt.output_paths(['talks/a.html', 'talks/b.html'], 'out')
+        self.assertEqual(outputs, {'talks/a.html': os.path.join('out', 'a.pptx'),
+                                   'talks/b.html': os.path.join('out', 'b.pptx')})
+
+    def test_decks_keep_their_folders_below_the_common_parent(self):
+        outputs = ppt.output_paths(['talks/a/deck.html', 'talks/b/deck.html', 'talks/index.html'], 'out')
+        self.assertEqual(outputs, {'talks/a/deck.html': os.path.join('out', 'a', 'deck.pptx'),
+                                   'talks/b/deck.html': os.path.join('out', 'b', 'deck.pptx'),
+                                   'talks/index.html': os.path.join('out', 'index.pptx')})
+
+    def test_without_output_dir_decks_are_written_beside_their_html(self):
+        self.assertEqual(ppt.output_paths(['a/deck.html', 'b/deck.html']),
+                         {'a/deck.html': os.path.join('a', 'deck.pptx'), 'b/deck.html': os.path.join('b', 'deck.pptx')})
+
+    def test_same_stem_in_one_folder_is_shared(self):
+        jobs = list(ppt.output_paths(['a/deck.html', 'a/deck.htm', 'a/other.html'], 'out').items())
+        self.assertEqual(list(ppt.shared_outputs(jobs).values()), [['a/deck.html', 'a/deck.htm']])
+
+
+class MainTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(dir=TMP)
+        for name in ('a/deck.html', 'b/deck.html', 'b/deck.htm'):
+            os.makedirs(os.path.join(self.folder, os.path.dirname(name)), exist_ok=True)
+            with open(os.path.join(self.folder, name), 'w') as f:
+                f.write(DECK.format(title=name))
+
+    def main(self, *args):
+        argv = ['ppt.py', *args, '-i', os.path.join(self.folder, 'images'), '-j', '1']
+        out = io.StringIO()
+        with mock.patch('sys.argv', argv), contextlib.redirect_stdout(out):
+            return ppt.main(), out.getvalue()
+
+    def test_decks_with_the_same_name_get_their_own_outputs(self):
+        out = os.path.join(self.folder, 'out')
+        status, log = self.main(os.path.join(self.folder, 'a', 'deck.html'), os.path.join(self.folder, 'b', 'deck.html'),
+                                '-o', out)
+        self.assertEqual(status, 0, log)
+        self.assertEqual(sorted(os.listdir(out)), ['a', 'b'])
+        for name in ('a', 'b'):
+            self.assertEqual(sorted(os.listdir(os.path.join(out, name))), ['deck.pptx', 'deck.pptx.manifest.json'])
+            slide = ppt.Presentation(os.path.join(out, name, 'deck.pptx')).slides[0]
+            self.assertIn(f'{name}/deck.html', [shape.text_frame.text for shape in slide.shapes if shape.has_text_frame])
+
+    def test_decks_that_would_share_an_output_are_rejected(self):
+        status, log = self.main(os.path.join(self.folder, 'b', 'deck.html'), os.path.join(self.folder, 'b', 'deck.htm'))
+        self.assertEqual(status, 1)
+        self.assertIn('would both be written to', log)
+        self.assertEqual(sorted(os.listdir(os.path.join(self.folder, 'b'))), ['deck.htm', 'deck.html'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,210 @@
+import threading
+import unittest
+from datetime import date, datetime
+
+from sqlalchemy import inspect
+from sqlalchemy.exc import IntegrityError
+
+import database
+import dbwriter
+import exports
+import mirror
+import queries
+import rollups
+import views
+from support import PostgreSQLCase, SQLiteCase, empty, fresh_engine
+
+
+class Queries:
+    @classmethod
+    def setUpClass(cls):
+        cls.engine = fresh_engine(cls.database_url())
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.engine.dispose()
+
+    def setUp(self):
+        empty(self.engine)
+        with self.engine.begin() as db:
+            self.creator = self.user(db, 'creator', 'creator')
+            self.viewer = self.user(db, 'viewer', 'consumer')
+
+    def user(self, db, username, role):
+        db.execute(queries.INSERT_USER, {'username': username, 'password': 'x', 'role': role})
+        return db.execute(queries.USER_ID_BY_NAME, {'username': username}).scalar()
+
+    def video(self, db, title='Video', url='/static/uploads/a.mp4', genre='Nature'):
+        return db.execute(queries.INSERT_VIDEO_RETURNING_ID, {
+            'title': title, 'publisher': 'P', 'producer': '', 'genre': genre, 'age_rating': 'G',
+            'url': url, 'uploaded_by': self.creator
+        }).scalar()
+
+    def comment(self, db, video_id, rating=4):
+        db.execute(queries.INSERT_COMMENT, {'video_id': video_id, 'user_id': self.viewer, 'comment': 'Nice',
+                                            'rating': rating, 'created_at': datetime(2024, 5, 1, 12)})
+
+    def test_insert_returns_new_ids(self):
+        with self.engine.begin() as db:
+            first, second = self.video(db), self.video(db)
+            self.assertEqual(second, first + 1)
+            self.assertEqual(db.execute(queries.VIDEO_BY_ID, {'id': second}).one().version, 0)
+
+    def test_duplicate_username_is_an_integrity_error(self):
+        with self.assertRaises(IntegrityError), self.engine.begin() as db:
+            self.user(db, 'viewer', 'consumer')
+
+    def test_shorts_pages_by_id_with_counts(self):
+        with self.engine.begin() as db:
+            ids = [self.video(db, f'V{n}') for n in range(5)]
+            self.comment(db, ids[3])
+            db.execute(queries.INSERT_LIKE, {'video_id': ids[3], 'user_id': self.viewer})
+            first = db.execute(queries.SHORTS_PAGE, {'before': 2 ** 62, 'limit': 3}).fetchall()
+            second = db.execute(queries.SHORTS_PAGE, {'before': first[-1].id, 'limit': 3}).fetchall()
+        self.assertEqual([row.id for row in first], ids[:1:-1])
+        self.assertEqual([row.id for row in second], ids[1::-1])
+        self.assertEqual((first[1].comment_count, first[1].like_count), (1, 1))
+        self.assertEqual((first[0].comment_count, first[0].like_count), (0, 0))
+
+    def test_likes_are_set_once_and_looked_up_in_bulk(self):
+        with self.engine.begin() as db:
+            ids = [self.video(db) for _ in range(3)]
+            params = {'video_id': ids[1], 'user_id': self.viewer}
+            self.assertEqual(db.execute(queries.INSERT_LIKE, params).rowcount, 1)
+            self.assertEqual(db.execute(queries.INSERT_LIKE, params).rowcount, 0)
+            self.assertEqual(db.execute(queries.COUNT_LIKES, {'video_id': ids[1]}).scalar(), 1)
+            liked = db.execute(queries.LIKED_AMONG, {'user_id': self.viewer, 'ids': ids}).scalars().all()
+            self.assertEqual(liked, [ids[1]])
+            self.assertEqual(db.execute(queries.DELETE_LIKE, params).rowcount, 1)
+            self.assertEqual(db.execute(queries.LIKED_AMONG, {'user_id': self.viewer, 'ids': ids}).all(), [])
+
+    def test_views_add_up(self):
+        with self.engine.begin() as db:
+            video_id = self.video(db)
+            views.add_views(db, {video_id: 2, 999: 5}, {(video_id, '2024-05-01'): 2, (999, '2024-05-01'): 5})
+            views.add_views(db, {video_id: 3}, {(video_id, '2024-05-01'): 1, (video_id, '2024-05-02'): 2})
+            self.assertEqual(db.execute(queries.VIEWS_FOR_VIDEO, {'video_id': video_id}).scalar(), 5)
+            daily = db.exec_driver_sql('SELECT day, views FROM video_daily_views ORDER BY day').all()
+        self.assertEqual([(str(day)[:10], n) for day, n in daily], [('2024-05-01', 3), ('2024-05-02', 2)])
+
+    def test_engagement_rollups_add_up_per_day(self):
+        with self.engine.begin() as db:
+            video_id = self.video(db)
+            rollups.add(db, video_id, '2024-05-01', likes=2)
+            rollups.add(db, video_id, '2024-05-01', comments=1, rating_sum=4)
+            rollups.add(db, video_id, '2024-05-03', unlikes=1)
+            result = rollups.creator_range(db, self.creator, date(2024, 5, 1), date(2024, 5, 3))
+            top = rollups.top_videos(db, self.creator, date(2024, 5, 1), date(2024, 5, 3))
+        self.assertEqual([(day['day'], day['likes'], day['unlikes']) for day in result['days']],
+                         [('2024-05-01', 2, 0), ('2024-05-02', 0, 0), ('2024-05-03', 0, 1)])
+        self.assertEqual(result['totals']['average_rating'], 4)
+        self.assertEqual([(row['id'], row['likes'], row['comments']) for row in top], [(video_id, 2, 1)])
+
+    def test_rebuild_recomputes_rollups(self):
+        with self.engine.begin() as db:
+            video_id = self.video(db)
+            self.comment(db, video_id, rating=5)
+            db.execute(queries.INSERT_LIKE, {'video_id': video_id, 'user_id': self.viewer})
+        self.assertEqual(rollups.rebuild(self.engine), (2, 2))
+        with self.engine.connect() as db:
+            result = rollups.creator_range(db, self.creator, date(2024, 5, 1), date(2024, 5, 1))
+        self.assertEqual((result['totals']['comments'], result['totals']['rating_sum']), (1, 5))
+
+    def test_export_pages_cover_every_row_once(self):
+        with self.engine.begin() as db:
+            ids = [self.video(db) for _ in range(3)]
+            for video_id, n in zip(ids, (3, 0, 2)):
+                for _ in range(n):
+                    self.comment(db, video_id)
+        with self.engine.connect() as db:
+            videos = [[row.id for row in page] for page in exports.video_pages(db, self.creator, 2)]
+            comments = [[row.video_id for row in page] for page in exports.comment_pages(db, self.creator, 2)]
+            average = next(exports.video_pages(db, self.creator, 1))[0].average_rating
+        self.assertEqual(videos, [ids[:2], ids[2:]])
+        self.assertEqual(comments, [[ids[0]] * 2, [ids[0], ids[2]], [ids[2]]])
+        self.assertEqual(float(average), 4)
+
+    def test_mirror_queue_and_switch(self):
+        with self.engine.begin() as db:
+            remote = self.video(db, url='https://example.com/a.mp4')
+            self.video(db)
+            self.assertEqual([row.id for row in db.execute(queries.REMOTE_VIDEOS)], [remote])
+            mirror.queue_mirror(db, remote, 'https://example.com/a.mp4')
+            mirror.update_mirror(db, remote, 'failed', attempts=3, error='timed out')
+            mirror.queue_mirror(db, remote, 'https://example.com/a.mp4')
+            row = db.execute(queries.MIRROR_BY_VIDEO, {'video_id': remote}).one()
+            self.assertEqual((row.status, row.attempts, row.error), ('pending', 0, None))
+            self.assertEqual(db.execute(queries.REMOTE_VIDEOS).all(), [])
+            self.assertTrue(mirror.use_mirror(db, remote, 'https://example.com/a.mp4', '/static/uploads/a.mp4',
+                                              '"v1"', 3 << 30, 1))
+            row = db.execute(queries.MIRROR_BY_VIDEO, {'video_id': remote}).one()
+            self.assertEqual((row.status, row.size), ('done', 3 << 30))
+            self.assertFalse(mirror.use_mirror(db, remote, 'https://example.com/a.mp4', '/x', None, 0, 1))
+            video = db.execute(queries.VIDEO_BY_ID, {'id': remote}).one()
+        self.assertEqual((video.url, video.version), ('/static/uploads/a.mp4', 1))
+
+    def test_writer_rolls_back_only_the_failed_operation(self):
+        writer = dbwriter.Writer(self.engine.connect)
+        release = threading.Event()
+        blocked = writer.submit(lambda db: release.wait(10))
+
+        def fail_after_insert(db):
+            self.user(db, 'half', 'consumer')
+            raise ValueError('no')
+
+        # Queued behind the blocked operation, so these commit together in one batch
+        futures = [writer.submit(self.user, 'a', 'consumer'),
+                   writer.submit(self.user, 'viewer', 'consumer'),
+                   writer.submit(fail_after_insert),
+                   writer.submit(self.user, 'b', 'consumer')]
+        release.set()
+        blocked.result(10)
+        self.assertIsInstance(futures[1].exception(10), IntegrityError)
+        self.assertIsInstance(futures[2].exception(10), ValueError)
+        self.assertIsNotNone(futures[3].result(10))
+        with self.engine.connect() as db:
+            names = db.exec_driver_sql('SELECT username FROM users ORDER BY id').scalars().all()
+        self.assertEqual(names, ['creator', 'viewer', 'a', 'b'])
+
+
+class SQLiteQueriesTest(Queries, SQLiteCase):
+    pass
+
+
+class PostgreSQLQueriesTest(Queries, PostgreSQLCase):
+    pass
+
+
+class Migrate:
+    def test_adds_missing_columns_and_tables(self):
+        engine = fresh_engine(self.database_url(), schema=False)
+        try:
+            with engine.begin() as db:
+                db.exec_driver_sql('CREATE TABLE users (id INTEGER PRIMARY KEY, username TEXT UNIQUE NOT NULL, '
+                                   'password TEXT NOT NULL, role TEXT NOT NULL)')
+                db.exec_driver_sql('CREATE TABLE videos (id INTEGER PRIMARY KEY, title TEXT NOT NULL, '
+                                   'publisher TEXT NOT NULL, producer TEXT, genre TEXT, age_rating TEXT, '
+                                   'url TEXT NOT NULL, uploaded_by INTEGER)')
+                db.exec_driver_sql("INSERT INTO videos (id, title, publisher, url) VALUES (1, 'Old', 'P', '/a.mp4')")
+            database.migrate(engine)
+            database.migrate(engine)
+            tables = inspect(engine)
+            self.assertIn('video_mirrors', tables.get_table_names())
+            self.assertLessEqual({'version', 'poster'}, {c['name'] for c in tables.get_columns('videos')})
+            with engine.connect() as db:
+                video = db.execute(queries.VIDEO_BY_ID, {'id': 1}).one()
+            self.assertEqual((video.version, video.poster), (0, None))
+        finally:
+            engine.dispose()
+
+
+class SQLiteMigrateTest(Migrate, SQLiteCase):
+    pass
+
+
+class PostgreSQLMigrateTest(Migrate, PostgreSQLCase):
+    pass
+
+
+if __name__ == '__main__':
+    unittest.main()
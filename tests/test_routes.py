@@ -0,0 +1,156 @@
+import unittest
+
+import support
+from support import PostgreSQLCase, SQLiteCase
+
+app = support.load_app()
+
+
+class Routes:
+    @classmethod
+    def setUpClass(cls):
+        cls.engine = support.fresh_engine(cls.database_url())
+        support.use_database(app, cls.engine)
+
+    @classmethod
+    def tearDownClass(cls):
+        support.forget(app)
+        cls.engine.dispose()
+
+    def setUp(self):
+        support.forget(app)
+        support.empty(self.engine)
+        app.add_demo_videos()
+        self.client = app.app.test_client()
+
+    def sign_up(self, username, role='consumer', client=None):
+        client = client or self.client
+        response = client.post('/register', data={'username': username, 'password': 'pw', 'role': role})
+        self.assertEqual(response.status_code, 302)
+        response = client.post('/login', data={'username': username, 'password': 'pw'})
+        self.assertEqual(response.status_code, 302)
+        with client.session_transaction() as session:
+            return session['user']['id']
+
+    def upload(self, title, genre='Nature'):
+        return self.client.post('/upload', data={
+            'title': title, 'publisher': 'P', 'genre': genre, 'age_rating': 'G', 'url': '/static/uploads/x.mp4'
+        })
+
+    def test_register_rejects_taken_username_and_bad_login(self):
+        self.sign_up('ann')
+        response = self.client.post('/register', data={'username': 'ann', 'password': 'pw', 'role': 'creator'})
+        self.assertEqual(response.status_code, 200)
+        with self.engine.connect() as db:
+            self.assertEqual(db.exec_driver_sql("SELECT role FROM users WHERE username = 'ann'").scalars().all(),
+                             ['consumer'])
+        other = app.app.test_client()
+        self.assertEqual(other.post('/login', data={'username': 'ann', 'password': 'wrong'}).status_code, 200)
+        self.assertEqual(other.get('/profile').status_code, 302)
+
+    def test_pages_list_videos(self):
+        self.assertEqual(self.client.get('/').status_code, 200)
+        self.sign_up('ann')
+        self.assertEqual(self.client.get('/').status_code, 302)
+        self.assertIn(b'Beginner Yoga Flow', self.client.get('/shorts').data)
+        self.assertIn(b'Wonders of the Deep Ocean', self.client.get('/watch/1').data)
+        self.assertEqual(self.client.get('/watch/999').status_code, 302)
+
+    def test_shorts_pages_follow_the_cursor(self):
+        self.sign_up('cat', 'creator')
+        for n in range(30):
+            self.assertEqual(self.upload(f'Upload {n}').status_code, 302)
+        seen, before = [], None
+        while True:
+            page = self.client.get('/shorts/page', query_string={'before': before} if before else {}).get_json()
+            self.assertTrue(page['success'])
+            seen += [n for n in range(30) if f'Upload {n}<'.encode() in page['html'].encode()]
+            before = page['next']
+            if before is None:
+                break
+        self.assertEqual(sorted(seen), list(range(30)))
+
+    def test_upload_shows_on_dashboard(self):
+        self.sign_up('cat', 'creator')
+        self.assertEqual(self.upload('My clip').status_code, 302)
+        page = self.client.get('/dashboard').data
+        self.assertIn(b'uploaded successfully', page)
+        self.assertIn(b'My clip', page)
+        self.assertIn(b'My clip', self.client.get('/profile').data)
+
+    def test_consumer_cannot_upload(self):
+        self.sign_up('ann')
+        self.upload('Nope')
+        with self.engine.connect() as db:
+            self.assertEqual(db.exec_driver_sql("SELECT COUNT(*) FROM videos WHERE title = 'Nope'").scalar(), 0)
+
+    def test_comments_are_saved_and_filtered(self):
+        self.sign_up('ann')
+        response = self.client.post('/comment', data={'video_id': 2, 'comment': 'Lovely pasta', 'rating': 5})
+        self.assertTrue(response.get_json()['success'])
+        response = self.client.post('/comment', data={'video_id': 2, 'comment': 'what a BADWORD', 'rating': 1})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.post('/comment', data={'video_id': 999, 'comment': 'x', 'rating': 1}).status_code,
+                         400)
+        page = self.client.get('/watch/2').data
+        self.assertIn(b'Lovely pasta', page)
+        self.assertNotIn(b'BADWORD', page)
+
+    def test_likes_count_each_user_once(self):
+        self.sign_up('ann')
+        other = app.app.test_client()
+        self.sign_up('bob', client=other)
+        like = {'video_id': 3, 'liked': 'true'}
+        self.assertEqual(self.client.post('/like', data=like).get_json()['like_count'], 1)
+        self.assertEqual(self.client.post('/like', data=like).get_json()['like_count'], 1)
+        self.assertEqual(other.post('/like', data=like).get_json()['like_count'], 2)
+        self.assertEqual(self.client.post('/like', data={'video_id': 3, 'liked': 'false'}).get_json()['like_count'], 1)
+        self.assertEqual(self.client.post('/like', data={'video_id': 999, 'liked': 'true'}).status_code, 400)
+
+    def test_views_are_counted_after_a_flush(self):
+        self.assertEqual(self.client.post('/view', data={'video_id': 4}).status_code, 204)
+        self.client.post('/view', data={'video_id': 4})
+        app.app.test_client().post('/view', data={'video_id': 4}, headers={'User-Agent': 'other'})
+        self.assertEqual(app.view_counter.flush(), 2)
+        self.assertIn(b'<strong>Views:</strong> 2<', self.client.get('/watch/4').data)
+
+    def test_engagement_reports_todays_likes_and_comments(self):
+        self.sign_up('ann')
+        self.client.post('/like', data={'video_id': 1, 'liked': 'true'})
+        self.client.post('/comment', data={'video_id': 1, 'comment': 'Deep', 'rating': 4})
+        creator = app.app.test_client()
+        creator.post('/login', data={'username': 'demo_creator', 'password': 'demo123'})
+        self.assertEqual(creator.get('/dashboard').status_code, 200)
+        result = creator.get('/dashboard/engagement').get_json()
+        self.assertEqual((result['totals']['likes'], result['totals']['comments']), (1, 1))
+        self.assertEqual(result['videos'][0]['id'], 1)
+        self.assertEqual(creator.get('/dashboard/engagement?start=2024-02-01&end=2024-01-01').status_code, 400)
+        self.assertEqual(self.client.get('/dashboard/engagement').status_code, 403)
+
+    def test_trending_ranks_recent_engagement(self):
+        self.sign_up('ann')
+        self.client.post('/like', data={'video_id': 5, 'liked': 'true'})
+        self.client.post('/comment', data={'video_id': 2, 'comment': 'Tasty', 'rating': 5})
+        self.client.post('/comment', data={'video_id': 5, 'comment': 'Calm', 'rating': 5})
+        result = self.client.get('/trending?window=1h', headers={'Accept': 'application/json'}).get_json()
+        self.assertEqual([video['id'] for video in result['videos']], [5, 2])
+        result = self.client.get('/trending?window=1h&genre=cooking', headers={'Accept': 'application/json'}).get_json()
+        self.assertEqual([video['id'] for video in result['videos']], [2])
+        self.assertEqual(self.client.get('/trending?window=2h').status_code, 400)
+
+    def test_metrics_count_queries(self):
+        self.client.get('/')
+        body = self.client.get('/metrics').data
+        self.assertIn(b'db_statements', body)
+
+
+class SQLiteRoutesTest(Routes, SQLiteCase):
+    pass
+
+
+class PostgreSQLRoutesTest(Routes, PostgreSQLCase):
+    pass
+
+
+if __name__ == '__main__':
+    unittest.main()
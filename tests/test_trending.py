@@ -0,0 +1,87 @@
+import random
+import unittest
+
+import trending
+
+
+class WindowTest(unittest.TestCase):
+    def test_ranking_refills_after_ranked_videos_expire(self):
+        window = trending.Window('1h', 60, 60, 1)
+        window.add('A', None, 10, 0)
+        window.add('B', None, 5, 600)
+        window.add('C', None, 4, 1200)
+
+        window.advance(3600, {})
+        self.assertEqual(window.ranking(trending.ALL).top(), [('B', 5)])
+        window.advance(4200, {})
+        self.assertEqual(window.scores[trending.ALL], {'C': 4})
+        self.assertEqual(window.ranking(trending.ALL).top(), [('C', 4)])
+
+    def test_ranking_matches_scores_as_buckets_expire(self):
+        window = trending.Window('1h', 60, 60, 3)
+        genres = {video_id: 'g' for video_id in range(0, 17, 2)}
+        for minute in range(180):
+            video_id = minute * 5 % 17
+            window.add(video_id, genres.get(video_id), minute % 7 + 1, minute * 60)
+            window.advance(minute * 60, genres)
+            for genre in (trending.ALL, 'g'):
+                scores = window.scores.get(genre, {})
+                expected = sorted(scores.values(), reverse=True)[:3]
+                self.assertEqual([score for _, score in window.ranking(genre).top()], expected)
+
+    def test_late_event_expires_with_its_own_bucket(self):
+        window = trending.Window('1h', 60, 60, 5)
+        window.add('A', None, 1, 0)
+        window.add('B', None, 1, 600)
+        window.add('C', None, 3, 300)
+
+        window.advance(3600, {})
+        window.advance(3600 + 300, {})
+        self.assertEqual(window.scores[trending.ALL], {'B': 1})
+        self.assertEqual(window.ranking(trending.ALL).top(), [('B', 1)])
+
+    def test_expired_unlike_lets_video_back_into_ranking(self):
+        window = trending.Window('1h', 60, 60, 1)
+        window.add('A', None, -3, 0)
+        window.add('B', None, 5, 600)
+        window.add('C', None, 5, 600)
+        window.add('A', None, 7, 600)
+
+        window.advance(600, {})
+        window.advance(3600, {})
+        self.assertEqual(window.scores[trending.ALL], {'A': 7, 'B': 5, 'C': 5})
+        self.assertEqual(window.ranking(trending.ALL).top(), [('A', 7)])
+
+    def test_ranking_matches_scores_with_unlikes_and_late_events(self):
+        rng = random.Random(5)
+        window = trending.Window('1h', 60, 60, 3)
+        genres = {video_id: rng.choice(['g', 'h', None]) for video_id in range(20)}
+        now = 0
+        for _ in range(2000):
+            now += rng.choice([0, 10, 60, 300, 900])
+            video_id = rng.randrange(20)
+            late = rng.choice([0, 0, 0, 120, 600])
+            window.add(video_id, genres[video_id], rng.choice([-3, -3, 1, 3, 5]), max(0, now - late))
+            window.advance(now, genres)
+            for genre in (trending.ALL, 'g', 'h'):
+                scores = window.scores.get(genre, {})
+                expected = sorted((score for score in scores.values() if score > 0), reverse=True)[:3]
+                self.assertEqual([score for _, score in window.ranking(genre).top()], expected)
+
+
+class SeriesTest(unittest.TestCase):
+    def test_late_bucket_is_kept_in_order(self):
+        series = trending.Series()
+        series.add(5, 1)
+        series.add(9, 2)
+        series.add(7, -3)
+        series.add(5, 4)
+        self.assertEqual([bucket for bucket, _ in series.buckets], [5, 7, 9])
+
+        series.expire(8)
+        self.assertEqual(series.total, 2)
+        self.assertEqual([list(bucket) for bucket in series.buckets], [[9, 2]])
+
+
+if __name__ == '__main__':
+    unittest.main()
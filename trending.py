@@ -0,0 +1,418 @@
+"""
+Trending videos over sliding windows, overall and per genre.
+
+    trends = trending.Trending(app)
+    trends.record(video_id, 'like')           # or 'unlike', 'comment', 'view'
+    trends.top('24h', genre='Cooking')        # [(video_id, score), ...] best first
+
+Every event adds its weight (TRENDING_WEIGHTS) to the video's counter in each
+window. A counter is a ring of time buckets (1h: 60 x 1 minute, 24h: 96 x 15
+minutes, 7d: 168 x 1 hour) kept sparsely, so only buckets that saw activity
+take memory, with a running total as the score. Each window keeps a bounded
+min-heap of twice TRENDING_TOP_K candidates per genre (and overall), updated
+in place as events arrive. When a window's oldest bucket falls out, the
+ticker thread expires it from just the videos that had events in it; those
+outside a heap whose score went up (an unlike expired) are offered to it
+again. A heap is only rebuilt from the window's scores when fewer than K of
+its candidates still score at least as much as any video left out of it
+could; videos whose score runs out leave the heap. A candidate pushed down
+by an unlike is checked at the next tick, whether or not a bucket ended.
+Reads return a list sorted when it last changed, so they cost O(K).
+
+The counters are written to TRENDING_SNAPSHOT (JSON) every
+TRENDING_SNAPSHOT_SECONDS and at exit, and loaded on start, so a restart
+keeps the windows. Counts live in this process; with several worker processes
+each ranks only the events it handled.
+"""
+import atexit
+import heapq
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from operator import itemgetter
+
+import database
+import metrics
+import queries
+
+logger = logging.getLogger('trending')
+
+# name: (bucket seconds, buckets)
+WINDOWS = {'1h': (60, 60), '24h': (15 * 60, 96), '7d': (3600, 168)}
+DEFAULT_WEIGHTS = {'view': 1, 'like': 3, 'unlike': -3, 'comment': 5}
+# Heap key for the ranking across all genres
+ALL = ''
+
+EVENTS = metrics.Counter('trending_events_total', 'Engagement events ranked for trending', ('kind',))
+TRACKED = metrics.Gauge('trending_videos', 'Videos with activity in a trending window', ('window',))
+REBUILD = metrics.Histogram('trending_rebuild_seconds', 'Time to expire a bucket and rebuild a window\'s rankings')
+
+
+class Series:
+    """Non-empty buckets of one video in one window, oldest first, and their sum"""
+    __slots__ = ('buckets', 'total')
+
+    def __init__(self):
+        self.buckets = deque()
+        self.total = 0
+
+    def add(self, bucket, amount):
+        buckets = self.buckets
+        self.total += amount
+        if buckets and buckets[-1][0] == bucket:
+            buckets[-1][1] += amount
+            return
+        if not buckets or buckets[-1][0] < bucket:
+            buckets.append([bucket, amount])
+            return
+        # A late event; keep the buckets in order so expire() can stop at the first live one
+        for index in range(len(buckets) - 1, -1, -1):
+            if buckets[index][0] == bucket:
+                buckets[index][1] += amount
+                return
+            if buckets[index][0] < bucket:
+                buckets.insert(index + 1, [bucket, amount])
+                return
+        buckets.appendleft([bucket, amount])
+
+    def expire(self, oldest):
+        buckets = self.buckets
+        while buckets and buckets[0][0] < oldest:
+            self.total -= buckets.popleft()[1]
+
+
+class TopK:
+    """The best of the scores offered, as a min-heap of [score, video_id] with an index by video
+
+    Keeps up to twice the k it reports, and bound: the highest score a video
+    left out of the heap can have had since the last rebuild. While k members
+    still score at least that, the heap holds the top k, so a window can
+    expire a bucket without rescanning every video."""
+
+    def __init__(self, k):
+        self.k = k
+        self.capacity = 2 * k
+        self.heap = []
+        self.entries = {}
+        self.ranked = None
+        self.bound = 0
+        # A member's score went down outside advance(); check it at the next tick
+        self.lowered = False
+
+    def offer(self, video_id, score):
+        entry = self.entries.get(video_id)
+        if entry is not None:
+            if score < entry[0]:
+                self.lowered = True
+            if score <= 0:
+                self.discard(video_id)
+                return
+            entry[0] = score
+            heapq.heapify(self.heap)
+        elif score <= 0:
+            return
+        elif len(self.heap) < self.capacity:
+            entry = self.entries[video_id] = [score, video_id]
+            heapq.heappush(self.heap, entry)
+        elif score > self.heap[0][0]:
+            entry = self.entries[video_id] = [score, video_id]
+            evicted = heapq.heapreplace(self.heap, entry)
+            del self.entries[evicted[1]]
+            self.bound = max(self.bound, evicted[0])
+        else:
+            self.bound = max(self.bound, score)
+            return
+        self.ranked = None
+
+    def discard(self, video_id):
+        entry = self.entries.pop(video_id, None)
+        if entry is not None:
+            self.heap.remove(entry)
+            heapq.heapify(self.heap)
+            self.ranked = None
+
+    def complete(self):
+        """Re-order after members changed; False if the top k may now include a video outside the heap"""
+        heapq.heapify(self.heap)
+        self.ranked = None
+        self.lowered = False
+        return self.bound <= 0 or sum(1 for entry in self.heap if entry[0] >= self.bound) >= self.k
+
+    def replace(self, best):
+        """Reset to best, the highest (score, video_id) pairs in descending order, up to capacity + 1"""
+        self.heap = [[score, video_id] for score, video_id in best[:self.capacity] if score > 0]
+        heapq.heapify(self.heap)
+        self.entries = {entry[1]: entry for entry in self.heap}
+        self.bound = best[self.capacity][0] if len(best) > self.capacity else 0
+        self.ranked = None
+        self.lowered = False
+
+    def top(self):
+        if self.ranked is None:
+            self.ranked = [(video_id, score) for score, video_id in heapq.nlargest(self.k, self.heap)]
+        return self.ranked
+
+
+class Window:
+    def __init__(self, name, bucket_seconds, size, k):
+        self.name = name
+        self.bucket_seconds = bucket_seconds
+        self.size = size
+        self.k = k
+        self.series = {}
+        # {genre: {video_id: score}} for active videos, and ALL for every genre;
+        # the candidates when a ranking is rebuilt
+        self.scores = {ALL: {}}
+        self.rankings = {}
+        # [bucket, videos with events in it], oldest first; advance() only revisits these
+        self.touched = deque()
+        self.current = None
+
+    def bucket(self, now):
+        return int(now // self.bucket_seconds)
+
+    def ranking(self, genre):
+        ranking = self.rankings.get(genre)
+        if ranking is None:
+            ranking = self.rankings[genre] = TopK(self.k)
+        return ranking
+
+    def _touch(self, bucket, video_id):
+        touched = self.touched
+        if touched and touched[-1][0] == bucket:
+            touched[-1][1].add(video_id)
+            return
+        if not touched or touched[-1][0] < bucket:
+            touched.append([bucket, {video_id}])
+            return
+        # A late event from a bucket that has already been followed by another
+        for index in range(len(touched) - 1, -1, -1):
+            if touched[index][0] == bucket:
+                touched[index][1].add(video_id)
+                return
+            if touched[index][0] < bucket:
+                touched.insert(index + 1, [bucket, {video_id}])
+                return
+        touched.appendleft([bucket, {video_id}])
+
+    def add(self, video_id, genre, amount, now):
+        bucket = self.bucket(now)
+        if self.current is not None and bucket < self.current - self.size + 1:
+            return
+        series = self.series.get(video_id)
+        if series is None:
+            series = self.series[video_id] = Series()
+        series.add(bucket, amount)
+        self._touch(bucket, video_id)
+        total = series.total
+        self.scores[ALL][video_id] = total
+        self.ranking(ALL).offer(video_id, total)
+        if genre:
+            scores = self.scores.get(genre)
+            if scores is None:
+                scores = self.scores[genre] = {}
+            scores[video_id] = total
+            self.ranking(genre).offer(video_id, total)
+
+    def advance(self, now, genres):
+        """Expire buckets that left the window and repair the rankings; False if no bucket ended"""
+        bucket = self.bucket(now)
+        if bucket == self.current:
+            self._repair({key for key, ranking in self.rankings.items() if ranking.lowered})
+            return False
+        self.current = bucket
+        oldest = bucket - self.size + 1
+        stale = set()
+        while self.touched and self.touched[0][0] < oldest:
+            stale |= self.touched.popleft()[1]
+        affected = {key for key, ranking in self.rankings.items() if ranking.lowered}
+        for video_id in stale:
+            series = self.series.get(video_id)
+            if series is None:
+                continue
+            before = series.total
+            series.expire(oldest)
+            genre = genres.get(video_id)
+            genre_scores = self.scores.get(genre) if genre else None
+            if series.buckets:
+                self.scores[ALL][video_id] = series.total
+                if genre_scores is not None:
+                    genre_scores[video_id] = series.total
+            else:
+                del self.series[video_id]
+                del self.scores[ALL][video_id]
+                if genre_scores is not None:
+                    genre_scores.pop(video_id, None)
+            for key in (ALL, genre) if genre else (ALL,):
+                ranking = self.rankings.get(key)
+                if ranking is None:
+                    continue
+                entry = ranking.entries.get(video_id)
+                if entry is None:
+                    # An expired unlike raises the score; it may now belong in the heap
+                    if series.buckets and series.total > before:
+                        ranking.offer(video_id, series.total)
+                        affected.add(key)
+                    continue
+                if series.buckets and series.total > 0:
+                    entry[0] = series.total
+                else:
+                    ranking.discard(video_id)
+                affected.add(key)
+        self._repair(affected)
+        TRACKED.set(len(self.series), (self.name,))
+        return True
+
+    def _repair(self, keys):
+        for key in keys:
+            if not self.rankings[key].complete():
+                self.rebuild(key)
+
+    def rebuild(self, genre):
+        ranking = self.ranking(genre)
+        best = heapq.nlargest(ranking.capacity + 1, self.scores.get(genre, {}).items(), key=itemgetter(1))
+        ranking.replace([(score, video_id) for video_id, score in best])
+
+
+def genre_key(genre):
+    return (genre or '').strip().casefold()
+
+
+class Trending:
+    def __init__(self, app=None):
+        self.lock = threading.Lock()
+        self.genres = {}
+        self.names = {}
+        self.thread = None
+        self.start_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.k = app.config.get('TRENDING_TOP_K', 50)
+        self.weights = dict(DEFAULT_WEIGHTS, **app.config.get('TRENDING_WEIGHTS', {}))
+        self.tick_seconds = app.config.get('TRENDING_TICK_SECONDS', 10.0)
+        self.snapshot_path = app.config.get('TRENDING_SNAPSHOT')
+        self.snapshot_seconds = app.config.get('TRENDING_SNAPSHOT_SECONDS', 300.0)
+        self.windows = {name: Window(name, seconds, size, self.k) for name, (seconds, size) in WINDOWS.items()}
+        if self.snapshot_path:
+            self.load(self.snapshot_path)
+            atexit.register(self.save, self.snapshot_path)
+
+    def _start(self):
+        # Lazily, so forked worker processes each get their own ticker
+        if self.thread is not None and self.thread.is_alive():
+            return
+        with self.start_lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._tick_loop, name='trending', daemon=True)
+                self.thread.start()
+
+    def genre_of(self, video_ids):
+        """{video_id: genre key} for video_ids, looking up the ones not seen before"""
+        missing = [video_id for video_id in video_ids if video_id not in self.genres]
+        if missing:
+            with database.engine.connect() as db:
+                rows = db.execute(queries.VIDEO_GENRES_IN, {'ids': missing}).fetchall()
+            for row in rows:
+                key = genre_key(row.genre)
+                self.genres[row.id] = key
+                if key:
+                    self.names.setdefault(key, row.genre.strip())
+        return {video_id: self.genres.get(video_id) for video_id in video_ids}
+
+    def record(self, video_id, kind, count=1, now=None):
+        self.record_many({video_id: count}, kind, now)
+
+    def record_many(self, counts, kind, now=None):
+        """Add count events of kind for each video in {video_id: count}"""
+        self._start()
+        weight = self.weights[kind]
+        now = time.time() if now is None else now
+        genres = self.genre_of(list(counts))
+        with self.lock:
+            for video_id, count in counts.items():
+                if video_id not in self.genres:
+                    continue  # no such video
+                for window in self.windows.values():
+                    window.add(video_id, genres[video_id], weight * count, now)
+        EVENTS.inc((kind,), sum(counts.values()))
+
+    def record_views(self, counts):
+        # views.ViewCounter listener: counts are the views that survived dedup
+        self.record_many(counts, 'view')
+
+    def top(self, window='24h', genre=None, limit=None):
+        """[(video_id, score), ...] best first; KeyError for an unknown window"""
+        ranking = self.windows[window].rankings.get(genre_key(genre))
+        ranked = ranking.top() if ranking is not None else []
+        return ranked[:limit] if limit else ranked
+
+    def genre_names(self):
+        """Display names of the genres seen so far, sorted"""
+        return sorted(self.names.values(), key=str.casefold)
+
+    def advance(self, now=None):
+        now = time.time() if now is None else now
+        with self.lock:
+            for window in self.windows.values():
+                started = time.perf_counter()
+                if window.advance(now, self.genres):
+                    REBUILD.observe(time.perf_counter() - started)
+
+    def _tick_loop(self):
+        saved = time.monotonic()
+        while True:
+            try:
+                self.advance()
+                if self.snapshot_path and time.monotonic() - saved >= self.snapshot_seconds:
+                    self.save(self.snapshot_path)
+                    saved = time.monotonic()
+            except Exception:
+                logger.exception("Trending tick failed")
+            time.sleep(self.tick_seconds)
+
+    def save(self, path):
+        with self.lock:
+            state = {
+                'saved': time.time(),
+                'genres': {video_id: genre for video_id, genre in self.genres.items() if genre},
+                'names': dict(self.names),
+                'windows': {name: {video_id: [tuple(bucket) for bucket in series.buckets]
+                                   for video_id, series in window.series.items()}
+                            for name, window in self.windows.items()},
+            }
+        partial = f'{path}.partial'
+        with open(partial, 'w') as f:
+            f.write(json.dumps(state, separators=(',', ':')))
+        os.replace(partial, path)
+
+    def load(self, path):
+        try:
+            with open(path) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring unreadable trending snapshot %s: %s", path, e)
+            return
+        with self.lock:
+            self.genres.update({int(video_id): genre for video_id, genre in state.get('genres', {}).items()})
+            self.names.update(state.get('names', {}))
+            for name, series_by_video in state.get('windows', {}).items():
+                window = self.windows.get(name)
+                if window is None:
+                    continue
+                restored = []
+                for video_id, buckets in series_by_video.items():
+                    for bucket, amount in buckets:
+                        restored.append((bucket, int(video_id), amount))
+                restored.sort()
+                for bucket, video_id, amount in restored:
+                    window.add(video_id, self.genres.get(video_id), amount, bucket * window.bucket_seconds)
+                for genre in list(window.rankings):
+                    window.rebuild(genre)
+        self.advance()
@@ -0,0 +1,173 @@
+"""
+View counting without a database write per play.
+
+    view_counter = views.ViewCounter(app, writer)
+    view_counter.record(video_id, viewer)
+
+record() only appends to an in-process ring buffer, so the /view beacon
+returns without touching the database. Once a second an aggregator thread
+drains the buffer, drops repeat views of a video by the same viewer within
+VIEW_DEDUP_SECONDS, folds what is left into per-video and per-day totals and
+hands them to the single writer as one operation: a few upserts per active
+video instead of one INSERT per play.
+
+Repeat views are recognised by an 8-byte digest of (viewer, video), kept in
+two generations of at most VIEW_DEDUP_KEYS / 2 each: when the newer one fills
+up, the older is discarded. Memory stays bounded however many anonymous
+viewers show up, at the price of counting a repeat again once its first view
+has aged out of both generations.
+
+Listeners (trending) get each flush's fresh views once its write commits;
+totals from a failed write are retried with the next flush and reach the
+listeners with it, and those from a write that timed out are not passed on.
+
+If the buffer fills faster than it is drained the oldest events are dropped
+and counted in views_dropped_total. Events still buffered when the process
+dies are lost; at most one flush interval's worth. With several worker
+processes each keeps its own buffer and de-duplication window.
+"""
+import atexit
+import collections
+import hashlib
+import logging
+import threading
+import time
+
+import dbwriter
+import metrics
+import queries
+
+logger = logging.getLogger('views')
+
+RECEIVED = metrics.Counter('views_received_total', 'View beacons accepted into the buffer')
+DUPLICATES = metrics.Counter('views_duplicate_total', 'Views dropped as repeats within the dedup window')
+DROPPED = metrics.Counter('views_dropped_total', 'Views lost because the buffer was full')
+FLUSH_LATENCY = metrics.Histogram('views_flush_seconds', 'Time to aggregate and commit one flush')
+FLUSH_EVENTS = metrics.Histogram('views_flush_events', 'Buffered views folded per flush',
+                                 buckets=(0, 10, 100, 1000, 10000, 100000))
+BUFFERED = metrics.Gauge('views_buffered', 'Views waiting for the next flush')
+
+
+def add_views(db, totals, daily):
+    """Writer operation: add {video_id: views} and {(video_id, day): views} to the counters"""
+    ids = list(totals)
+    known = {row.id for row in db.execute(queries.VIDEOS_IN, {'ids': ids})}
+    rows = [{'video_id': video_id, 'views': n} for video_id, n in totals.items() if video_id in known]
+    if rows:
+        db.execute(queries.ADD_VIDEO_VIEWS, rows)
+    rows = [{'video_id': video_id, 'day': day, 'views': n}
+            for (video_id, day), n in daily.items() if video_id in known]
+    if rows:
+        db.execute(queries.ADD_DAILY_VIDEO_VIEWS, rows)
+    return len(known)
+
+
+class ViewCounter:
+    def __init__(self, app=None, writer=None):
+        self.writer = writer
+        self.buffer = collections.deque(maxlen=100000)
+        self.thread = None
+        self.start_lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        # Digests of views already counted in the current dedup window, newer generation first
+        self.window = None
+        self.seen = set()
+        self.seen_before = set()
+        self.max_keys = 1000000
+        # Totals from a flush whose write failed, retried with the next one
+        self.pending_totals = collections.Counter()
+        self.pending_daily = collections.Counter()
+        self.pending_fresh = collections.Counter()
+        self.days = {}
+        # Called with {video_id: views} once a flush commits, e.g. trending.Trending.record_views
+        self.listeners = []
+        BUFFERED.set_function(lambda: len(self.buffer))
+        if app is not None:
+            self.init_app(app, writer)
+
+    def init_app(self, app, writer=None):
+        self.writer = writer or self.writer
+        self.buffer = collections.deque(maxlen=app.config.get('VIEW_BUFFER_EVENTS', 100000))
+        self.flush_seconds = app.config.get('VIEW_FLUSH_SECONDS', 1.0)
+        self.dedup_seconds = app.config.get('VIEW_DEDUP_SECONDS', 1800)
+        self.max_keys = app.config.get('VIEW_DEDUP_KEYS', 1000000)
+        atexit.register(self.flush)
+
+    def record(self, video_id, viewer):
+        """Count a view of video_id by viewer (any hashable); never blocks on the database"""
+        if self.thread is None:
+            self._start()
+        if len(self.buffer) == self.buffer.maxlen:
+            DROPPED.inc()
+        self.buffer.append((time.time(), video_id, viewer))
+
+    def _start(self):
+        # Started on first use so forked worker processes each get their own thread
+        with self.start_lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._loop, name='view-aggregator', daemon=True)
+                self.thread.start()
+
+    def _loop(self):
+        while True:
+            time.sleep(self.flush_seconds)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("View flush failed")
+
+    def _day(self, ts):
+        day_number = int(ts // 86400)
+        day = self.days.get(day_number)
+        if day is None:
+            day = self.days[day_number] = time.strftime('%Y-%m-%d', time.gmtime(ts))
+        return day
+
+    def flush(self):
+        """Fold everything buffered so far into the counters; returns the views written"""
+        with self.flush_lock:
+            started = time.perf_counter()
+            totals, daily, fresh = self.pending_totals, self.pending_daily, self.pending_fresh
+            buffer, popleft = self.buffer, self.buffer.popleft
+            events = [popleft() for _ in range(len(buffer))]
+            duplicates = 0
+            generation = max(self.max_keys // 2, 1)
+            for ts, video_id, viewer in events:
+                window = int(ts // self.dedup_seconds)
+                if self.window is None or window > self.window:
+                    self.window, self.seen, self.seen_before = window, set(), set()
+                key = hashlib.blake2b(f'{viewer!r}\0{video_id}'.encode(), digest_size=8).digest()
+                if key in self.seen or key in self.seen_before:
+                    duplicates += 1
+                    continue
+                if len(self.seen) >= generation:
+                    self.seen_before, self.seen = self.seen, set()
+                self.seen.add(key)
+                totals[video_id] += 1
+                fresh[video_id] += 1
+                daily[video_id, self._day(ts)] += 1
+            RECEIVED.inc(amount=len(events))
+            DUPLICATES.inc(amount=duplicates)
+            FLUSH_EVENTS.observe(len(events))
+            if not totals:
+                return 0
+            try:
+                self.writer.run(add_views, dict(totals), dict(daily))
+            except dbwriter.WriteTimeout:
+                # Still queued and may yet commit; retrying could count these twice
+                logger.warning("View counts for %d videos not confirmed in time", len(totals))
+            except Exception:
+                # Keep the totals; the next flush adds to them and tries again
+                logger.exception("Could not write %d view counts", len(totals))
+                return 0
+            else:
+                for listener in self.listeners:
+                    try:
+                        listener(dict(fresh))
+                    except Exception:
+                        logger.exception("View listener %r failed", listener)
+            counted = sum(totals.values())
+            self.pending_totals, self.pending_daily = collections.Counter(), collections.Counter()
+            self.pending_fresh = collections.Counter()
+            FLUSH_LATENCY.observe(time.perf_counter() - started)
+            return counted